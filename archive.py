@@ -0,0 +1,231 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import db_pool
+from db_init import restore_archived_user_stats, upgrade_connection
+from db_pool import ARCHIVE_SCHEMA, get_connection
+from log_config import get_logger
+from query_cache import read_cache
+from write_queue import run_write
+
+logger = get_logger('archive')
+
+# 最終アクティビティからこの日数が過ぎた解決済みの質問をアーカイブDBへ移す（環境変数 QA_APP_ARCHIVE_AFTER_DAYS で変更可能）
+ARCHIVE_AFTER_DAYS = int(os.environ.get('QA_APP_ARCHIVE_AFTER_DAYS', '365'))
+
+# 1回の書き込みで移す質問数（ライターを長く占有しないよう小分けにする）
+BATCH_SIZE = 500
+
+# アーカイブDB側のトリガーで数え直す列（コピーしない）
+_RECOUNTED_COLUMNS = {'answer_count'}
+
+# アーカイブDBへ移す質問の候補（最終アクティビティの古い順、(last_activity_ts, id) のキーセットで進める）
+_CANDIDATES_SQL = '''SELECT id, last_activity_ts FROM questions
+                     WHERE resolved = 1 AND last_activity_ts < ?
+                       AND (last_activity_ts, id) > (?, ?)
+                     ORDER BY last_activity_ts, id
+                     LIMIT ?'''
+
+# 本体とアーカイブDBの内容が食い違う質問（コピーしてから本体で更新された、またはコピーが無い）
+_MISMATCH_SQL = '''SELECT id FROM (SELECT {question_columns} FROM main.questions WHERE id IN ({placeholders})
+                                   EXCEPT
+                                   SELECT {question_columns} FROM {schema}.questions WHERE id IN ({placeholders}))
+                   UNION
+                   SELECT question_id FROM (SELECT {answer_columns} FROM main.answers WHERE question_id IN ({placeholders})
+                                            EXCEPT
+                                            SELECT {answer_columns} FROM {schema}.answers WHERE question_id IN ({placeholders}))
+                   UNION
+                   SELECT question_id FROM (SELECT {answer_columns} FROM {schema}.answers WHERE question_id IN ({placeholders})
+                                            EXCEPT
+                                            SELECT {answer_columns} FROM main.answers WHERE question_id IN ({placeholders}))'''
+
+
+def cutoff_ts(days=None, now=None):
+    """この時刻より前に最終アクティビティがあった質問が対象（UNIX時刻）"""
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    return int((now or time.time()) - days * 86400)
+
+
+def ensure_archive(pool=None):
+    """アーカイブDBを作成し、本体と同じスキーマに揃える"""
+    pool = pool or db_pool.get_pool()
+    conn = sqlite3.connect(pool.archive_path, timeout=pool.timeout)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL").fetchall()
+        upgrade_connection(conn)
+    finally:
+        conn.close()
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")
+            if row[1] not in _RECOUNTED_COLUMNS]
+
+
+def _delete_copies(c, schema, question_ids):
+    placeholders = ','.join('?' * len(question_ids))
+    c.execute(f"DELETE FROM {schema}.answers WHERE question_id IN ({placeholders})", question_ids)
+    c.execute(f"DELETE FROM {schema}.questions WHERE id IN ({placeholders})", question_ids)
+
+
+def _clear_change_log(c):
+    # アーカイブDBのトリガーが記録した変更履歴は読まれないので残さない
+    c.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.changes")
+
+
+def _discard_stale_copies(conn):
+    """前回の移動が途中で止まり、本体にも残っている質問のアーカイブDB側のコピーを消す"""
+    c = conn.cursor()
+    db_pool.attach_archive(conn)
+    stale = [row[0] for row in c.execute(
+        f"SELECT id FROM {ARCHIVE_SCHEMA}.questions WHERE id IN (SELECT id FROM main.questions)")]
+    for start in range(0, len(stale), BATCH_SIZE):
+        _delete_copies(c, ARCHIVE_SCHEMA, stale[start:start + BATCH_SIZE])
+    _clear_change_log(c)
+    return len(stale)
+
+
+def _copy_batch(question_ids):
+    """1段目: 質問と回答をアーカイブDBへコピーする（書き込むのはアーカイブDBだけ）"""
+    def _op(conn):
+        c = conn.cursor()
+        db_pool.attach_archive(conn)
+        placeholders = ','.join('?' * len(question_ids))
+        _delete_copies(c, ARCHIVE_SCHEMA, question_ids)
+        question_columns = ', '.join(_columns(conn, 'questions'))
+        answer_columns = ', '.join(_columns(conn, 'answers'))
+        c.execute(f'''INSERT INTO {ARCHIVE_SCHEMA}.questions ({question_columns})
+                      SELECT {question_columns} FROM main.questions WHERE id IN ({placeholders})''', question_ids)
+        c.execute(f'''INSERT INTO {ARCHIVE_SCHEMA}.answers ({answer_columns})
+                      SELECT {answer_columns} FROM main.answers WHERE question_id IN ({placeholders})
+                      ORDER BY id''', question_ids)
+        _clear_change_log(c)
+    run_write(_op)
+
+
+def _remove_batch(question_ids):
+    """2段目: コピーと一致する質問だけを本体から消す
+
+    コピーの後に本体で更新された質問は本体に残し、アーカイブDB側のコピーを消す。
+    戻り値: (移した質問ID, 本体に残した質問ID)
+    """
+    def _op(conn):
+        c = conn.cursor()
+        db_pool.attach_archive(conn)
+        placeholders = ','.join('?' * len(question_ids))
+        sql = _MISMATCH_SQL.format(question_columns=', '.join(_columns(conn, 'questions')),
+                                   answer_columns=', '.join(_columns(conn, 'answers')),
+                                   schema=ARCHIVE_SCHEMA, placeholders=placeholders)
+        changed = {row[0] for row in c.execute(sql, list(question_ids) * 6)}
+        moved = [qid for qid in question_ids if qid not in changed]
+        kept = [qid for qid in question_ids if qid in changed]
+        if kept:
+            _delete_copies(c, ARCHIVE_SCHEMA, kept)
+            _clear_change_log(c)
+        if moved:
+            # 本体から消すとトリガーが user_stats から引くので、移した分を加え直す
+            _delete_copies(c, 'main', moved)
+            restore_archived_user_stats(c, ARCHIVE_SCHEMA, moved)
+        return moved, kept
+    return run_write(_op)
+
+
+def archive_questions(days=None, batch_size=BATCH_SIZE, dry_run=False):
+    """最終アクティビティの古い解決済みの質問を、回答ごとアーカイブDBへ移す
+
+    本体とアーカイブDBをまたぐコミットは（WALモードでは）まとめて確定できないので、
+    コピーとコピーを確かめてからの削除を別々のトランザクションで行う。
+    途中で止まっても質問が失われることはなく、本体に残った分は次回やり直す。
+    戻り値: {'candidates', 'moved', 'kept', 'stale', 'seconds'}
+    """
+    started = time.perf_counter()
+    cutoff = cutoff_ts(days)
+    result = {'candidates': 0, 'moved': 0, 'kept': 0, 'stale': 0, 'seconds': 0.0}
+
+    if not dry_run:
+        ensure_archive()
+        result['stale'] = run_write(_discard_stale_copies)
+
+    position = (-1, -1)
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(_CANDIDATES_SQL, (cutoff, position[0], position[1], batch_size)).fetchall()
+        if not rows:
+            break
+        position = (rows[-1][1], rows[-1][0])
+        question_ids = [row[0] for row in rows]
+        result['candidates'] += len(question_ids)
+        if dry_run:
+            continue
+
+        _copy_batch(question_ids)
+        moved, kept = _remove_batch(question_ids)
+        read_cache.invalidate(moved)
+        result['moved'] += len(moved)
+        result['kept'] += len(kept)
+        if kept:
+            logger.info("コピーの後に更新された %d件の質問は本体に残しました", len(kept))
+
+    result['seconds'] = time.perf_counter() - started
+    if result['moved']:
+        logger.info("%d件の質問をアーカイブDBへ移しました (%.1fs)", result['moved'], result['seconds'])
+    return result
+
+
+def status(days=None):
+    """本体・アーカイブDBの質問数と、次回移す候補の数"""
+    pool = db_pool.get_pool()
+    with get_connection() as conn:
+        hot = conn.execute("SELECT COUNT(*) FROM main.questions").fetchone()[0]
+        candidates = conn.execute("SELECT COUNT(*) FROM questions WHERE resolved = 1 AND last_activity_ts < ?",
+                                  (cutoff_ts(days),)).fetchone()[0]
+        archived = None
+        if pool.attach_archive(conn):
+            archived = conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.questions").fetchone()[0]
+    return {'archive_path': pool.archive_path, 'hot': hot, 'archived': archived, 'candidates': candidates}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="古い解決済みの質問をアーカイブDBへ移す")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    parser.add_argument("--archive", help="アーカイブDBのパス（既定: QA_APP_ARCHIVE_DB または <DB名>.archive.db）")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"最終アクティビティからの日数（既定: QA_APP_ARCHIVE_AFTER_DAYS または {ARCHIVE_AFTER_DAYS}）")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="1回の書き込みで移す質問数")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--dry-run", action="store_true", help="移す候補の数だけを表示する")
+    group.add_argument("--status", action="store_true", help="本体・アーカイブDBの質問数を表示する")
+    args = parser.parse_args(argv)
+
+    if args.db or args.archive:
+        db_pool.configure(args.db, archive_path=args.archive)
+
+    if args.status:
+        info = status(args.older_than_days)
+        print(f"アーカイブDB: {info['archive_path']}")
+        print(f"本体の質問: {info['hot']}件 / アーカイブ済み: "
+              f"{'未作成' if info['archived'] is None else str(info['archived']) + '件'}")
+        print(f"{args.older_than_days}日より前に動きの止まった解決済みの質問: {info['candidates']}件")
+        return 0
+
+    try:
+        result = archive_questions(args.older_than_days, args.batch_size, args.dry_run)
+    except sqlite3.Error as e:
+        print(f"アーカイブに失敗しました: {e}")
+        return 1
+    if args.dry_run:
+        print(f"移す候補: {result['candidates']}件")
+        return 0
+    if result['stale']:
+        print(f"前回の途中までのコピー {result['stale']}件を片付けました")
+    print(f"{result['moved']}件の質問をアーカイブDBへ移しました"
+          f"（本体に残した質問 {result['kept']}件, {result['seconds']:.1f}s）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
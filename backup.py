@@ -0,0 +1,309 @@
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import db_pool
+from log_config import get_logger
+
+logger = get_logger('backup')
+
+# スナップショットの保存先（環境変数 QA_APP_BACKUP_DIR で変更可能、既定はDBファイルの隣の backups/）
+BACKUP_DIR = os.environ.get('QA_APP_BACKUP_DIR')
+
+# 残すスナップショットの数（古いものから消す、環境変数 QA_APP_BACKUP_KEEP で変更可能）
+BACKUP_KEEP = int(os.environ.get('QA_APP_BACKUP_KEEP', '7'))
+
+# 1ステップでコピーするページ数（4KBページで約1MB）と、ステップの間に書き込みへ譲る秒数
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+
+# コピー中に他の接続の書き込みでバックアップが最初からやり直しになった回数の上限
+# 超えたら1ステップで（読み取りトランザクション1回で）コピーする。WALモードなら書き込みは止まらない
+MAX_RESTARTS = 3
+
+# 最新のスナップショットを重い読み取り（検索・全件の逐次取得）用の読み取り専用レプリカにする（QA_APP_READ_REPLICA=1）
+REPLICA_ENABLED = os.environ.get('QA_APP_READ_REPLICA', '') not in ('', '0')
+
+# 新しいスナップショットができたかを確かめる間隔（秒）
+REPLICA_CHECK_INTERVAL = 60.0
+
+# レプリカの接続に適用するPRAGMA（スナップショットは書き換えないので journal_mode などは設定しない）
+REPLICA_PRAGMAS = {
+    'query_only': 1,
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+}
+
+_SNAPSHOT_NAME = re.compile(r'^\d{8}-\d{6}(?:-\d+)?$')
+_PARTIAL_SUFFIX = '.partial'
+
+
+class BackupVerificationError(sqlite3.DatabaseError):
+    """作成したスナップショットが PRAGMA integrity_check を通らなかった"""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def default_backup_dir(db_path):
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+
+
+def copy_database(src_path, dest_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """オンラインバックアップAPIで src を dest に複製する
+
+    pages ページずつコピーし、ステップの間は sleep 秒だけ読み取りロックを手放す。
+    コピー中の書き込みでやり直しが MAX_RESTARTS 回を超えたら、1ステップでコピーし直す。
+    戻り値: (ページ数, やり直した回数)
+    """
+    restarts = 0
+    remaining_before = [None]
+
+    def _progress(status, remaining, total):
+        nonlocal restarts
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        remaining_before[0] = remaining
+        if remaining:
+            time.sleep(sleep)
+
+    src = sqlite3.connect(src_path, timeout=db_pool.get_pool().timeout)
+    dest = sqlite3.connect(dest_path)
+    try:
+        try:
+            src.backup(dest, pages=pages, progress=_progress)
+        except _TooManyRestarts:
+            logger.info("書き込みが続いているため1ステップでコピーします: %s", src_path)
+            src.backup(dest)
+        # 読み取り専用で単体のファイルとして開けるよう、ロールバックジャーナルに戻す
+        dest.execute("PRAGMA journal_mode = DELETE").fetchall()
+        return dest.execute("PRAGMA page_count").fetchone()[0], restarts
+    finally:
+        dest.close()
+        src.close()
+
+
+def integrity_problems(path):
+    """PRAGMA integrity_check の結果（問題が無ければ空のリスト）"""
+    conn = sqlite3.connect(db_pool.read_only_uri(path), uri=True)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def list_snapshots(backup_dir):
+    """作成済みのスナップショットのディレクトリ（古い順）"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir)
+             if _SNAPSHOT_NAME.match(name) and os.path.isdir(os.path.join(backup_dir, name))]
+    # 同じ秒に作った '-1', '-2', ... を数値の順に並べる
+    names.sort(key=lambda name: [int(part) for part in name.split('-')])
+    return [os.path.join(backup_dir, name) for name in names]
+
+
+def latest_snapshot(backup_dir):
+    snapshots = list_snapshots(backup_dir)
+    return snapshots[-1] if snapshots else None
+
+
+def snapshot_files(snapshot, pool=None):
+    """スナップショット内の (本体, アーカイブDB) のパス（アーカイブDBが無ければ None）"""
+    pool = pool or db_pool.get_pool()
+    db_file = os.path.join(snapshot, os.path.basename(pool.db_path))
+    archive_file = os.path.join(snapshot, os.path.basename(pool.archive_path))
+    return db_file, archive_file if os.path.exists(archive_file) else None
+
+
+def verify_snapshot(snapshot, pool=None):
+    """スナップショットのファイルごとの問題 {ファイル: [integrity_check の結果]}（問題が無ければ空）"""
+    problems = {}
+    for path in snapshot_files(snapshot, pool):
+        if path is None:
+            continue
+        if not os.path.exists(path):
+            problems[path] = ['ファイルがありません']
+            continue
+        found = integrity_problems(path)
+        if found:
+            problems[path] = found
+    return problems
+
+
+def rotate(backup_dir, keep=BACKUP_KEEP):
+    """新しい keep 個を残して古いスナップショットを消す（戻り値: 消したディレクトリ）"""
+    removed = []
+    for snapshot in list_snapshots(backup_dir)[:-keep] if keep > 0 else []:
+        try:
+            shutil.rmtree(snapshot)
+            removed.append(snapshot)
+        except OSError as e:
+            # レプリカが開いているなどで消せなければ次回に回す
+            logger.warning("古いスナップショットを削除できません: %s: %s", snapshot, e)
+    return removed
+
+
+def _new_snapshot_path(backup_dir):
+    base = os.path.join(backup_dir, datetime.now().strftime('%Y%m%d-%H%M%S'))
+    path, n = base, 1
+    while os.path.exists(path) or os.path.exists(path + _PARTIAL_SUFFIX):
+        path = f"{base}-{n}"
+        n += 1
+    return path
+
+
+def take_snapshot(backup_dir=None, keep=BACKUP_KEEP, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """本体（とアーカイブDB）のスナップショットを作って検査し、古いものを消す
+
+    作成中は <名前>.partial に書き、integrity_check を通ってから名前を付け替えるので、
+    一覧やレプリカが途中のスナップショットを使うことはない。
+    戻り値: {'path', 'pages', 'restarts', 'removed', 'seconds'}
+    """
+    started = time.perf_counter()
+    pool = db_pool.get_pool()
+    backup_dir = backup_dir or default_backup_dir(pool.db_path)
+    os.makedirs(backup_dir, exist_ok=True)
+    # 前回の途中で止まった作成中のディレクトリを片付ける
+    for name in os.listdir(backup_dir):
+        if name.endswith(_PARTIAL_SUFFIX):
+            shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+
+    path = _new_snapshot_path(backup_dir)
+    partial = path + _PARTIAL_SUFFIX
+    os.makedirs(partial)
+    try:
+        total_pages, restarts = 0, 0
+        sources = [pool.db_path] + ([pool.archive_path] if os.path.exists(pool.archive_path) else [])
+        for source in sources:
+            copied, restarted = copy_database(source, os.path.join(partial, os.path.basename(source)), pages, sleep)
+            total_pages += copied
+            restarts += restarted
+        problems = verify_snapshot(partial, pool)
+        if problems:
+            raise BackupVerificationError(
+                "; ".join(f"{os.path.basename(p)}: {', '.join(rows[:3])}" for p, rows in problems.items()))
+        os.replace(partial, path)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+    result = {'path': path, 'pages': total_pages, 'restarts': restarts,
+              'removed': rotate(backup_dir, keep), 'seconds': time.perf_counter() - started}
+    logger.info("スナップショットを作成しました: %s (%dページ, %.1fs)", path, total_pages, result['seconds'])
+    return result
+
+
+_replica = None          # (スナップショット, 本体のパス, プール)
+_replica_checked_at = 0.0
+_replica_lock = threading.Lock()
+
+
+def get_replica_pool():
+    """最新のスナップショットを読む読み取り専用のプール（無効かスナップショットが無ければ None）"""
+    global _replica, _replica_checked_at
+    if not REPLICA_ENABLED:
+        return None
+    primary = db_pool.get_pool()
+    replica = _replica
+    if (replica is not None and replica[1] == primary.db_path
+            and time.monotonic() - _replica_checked_at < REPLICA_CHECK_INTERVAL):
+        return replica[2]
+    with _replica_lock:
+        _replica_checked_at = time.monotonic()
+        snapshot = latest_snapshot(default_backup_dir(primary.db_path))
+        if snapshot is None:
+            return None
+        if _replica is None or _replica[0] != snapshot or _replica[1] != primary.db_path:
+            # アーカイブDBのスナップショットが無ければ、存在しないパスを渡して ATTACH させない
+            pool = db_pool.ConnectionPool(os.path.join(snapshot, os.path.basename(primary.db_path)),
+                                          max_connections=4, pragmas=REPLICA_PRAGMAS, timeout=primary.timeout,
+                                          archive_path=os.path.join(snapshot, os.path.basename(primary.archive_path)),
+                                          read_only=True)
+            if _replica is not None:
+                _replica[2].close()
+            _replica = (snapshot, primary.db_path, pool)
+            logger.info("読み取りレプリカを切り替えました: %s", snapshot)
+        return _replica[2]
+
+
+def get_read_connection(streaming=False):
+    """重い読み取り用の接続: with get_read_connection() as conn: ...
+
+    レプリカが有効で最新のスナップショットがあればそちら（最後のバックアップ時点の内容）、無ければ本体を使う。
+    streaming ならジェネレーター用の接続（ConnectionPool.streaming_connection）を借りる。
+    """
+    pool = get_replica_pool() or db_pool.get_pool()
+    return pool.streaming_connection() if streaming else pool.connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="オンラインバックアップ（スナップショットの作成・検査・世代管理）")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    parser.add_argument("--dir", help="スナップショットの保存先（既定: QA_APP_BACKUP_DIR または DBファイルの隣の backups/）")
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP,
+                        help=f"残すスナップショットの数（既定: QA_APP_BACKUP_KEEP または {BACKUP_KEEP}）")
+    parser.add_argument("--pages", type=int, default=PAGES_PER_STEP, help="1ステップでコピーするページ数")
+    parser.add_argument("--every", type=float, help="指定した分ごとに繰り返し作成する（Ctrl+C で終了）")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--list", action="store_true", help="スナップショットの一覧を表示する")
+    group.add_argument("--verify", nargs="?", const="latest", help="スナップショットを検査する（既定: 最新）")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db_pool.configure(args.db)
+    backup_dir = args.dir or default_backup_dir(db_pool.get_pool().db_path)
+
+    if args.list:
+        snapshots = list_snapshots(backup_dir)
+        for snapshot in snapshots:
+            size = sum(os.path.getsize(os.path.join(snapshot, name)) for name in os.listdir(snapshot))
+            print(f"{snapshot}  {size / 1024 / 1024:.1f}MB")
+        print(f"{len(snapshots)}件")
+        return 0
+
+    if args.verify:
+        snapshot = latest_snapshot(backup_dir) if args.verify == "latest" else args.verify
+        if snapshot is None:
+            print("スナップショットがありません")
+            return 1
+        problems = verify_snapshot(snapshot)
+        if problems:
+            print(f"{snapshot} に問題があります:")
+            for path, rows in problems.items():
+                for row in rows[:20]:
+                    print(f"  {os.path.basename(path)}: {row}")
+            return 1
+        print(f"{snapshot} は正常です")
+        return 0
+
+    while True:
+        try:
+            result = take_snapshot(backup_dir, args.keep, args.pages)
+        except (sqlite3.Error, OSError) as e:
+            print(f"バックアップに失敗しました: {e}")
+            if args.every is None:
+                return 1
+        else:
+            print(f"スナップショットを作成しました: {result['path']} "
+                  f"({result['pages']}ページ, {result['seconds']:.1f}s, 削除 {len(result['removed'])}件)")
+        if args.every is None:
+            return 0
+        try:
+            time.sleep(args.every * 60)
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import backup
+import db_pool
+import data_handler
+import dummy_data
+import similarity
+from db_init import ensure_schema
+from log_config import configure_logging
+from query_cache import read_cache
+from time_utils import fiscal_year, fiscal_year_of, last_days
+
+# 既定のフィクスチャ規模（質問数）
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# この件数を超えるフィクスチャでは全件取得の get_questions を計測しない
+FULL_LIST_LIMIT = 100000
+
+# ベースラインから p95 がこの割合以上、かつ MIN_DELTA_MS 以上悪化したら失敗とする
+# （1ms未満の操作は揺らぎが大きいため絶対値の下限も設ける）
+DEFAULT_TOLERANCE = 0.20
+MIN_DELTA_MS = 1.0
+
+SEARCH_WORDS = dummy_data.EQUIPMENT + dummy_data.ISSUES + dummy_data.PHASES
+
+
+def fixture_path(fixture_dir, size, seed):
+    return os.path.join(fixture_dir, f"bench_{size}_seed{seed}.db")
+
+
+def fixture_meta_path(fixture_dir, size, seed):
+    return os.path.join(fixture_dir, f"bench_{size}_seed{seed}.json")
+
+
+# フィクスチャDB（テンプレート）の作成（既にあれば再利用する）
+# テンプレートは計測で書き換えず、実行ごとに copy_fixture() で複製して計測する。
+# 投稿日時は作成時の基準日時 anchor から遡って生成し、anchor をフィクスチャと一緒に保存するので、
+# 後日の実行でも期間で絞り込む操作は同じ行を返す。戻り値: (パス, 基準日時)
+def build_fixture(fixture_dir, size, seed):
+    path = fixture_path(fixture_dir, size, seed)
+    meta_path = fixture_meta_path(fixture_dir, size, seed)
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            anchor = datetime.fromisoformat(json.load(f)['anchor'])
+        db_pool.configure(path)
+        # スキーマのマイグレーションだけを適用する（データは変えない）
+        ensure_schema()
+    else:
+        # 基準日時の記録が無いフィクスチャ（書き込みの計測で変化した旧形式）は作り直す
+        for stale in (path, path + '-wal', path + '-shm', similarity.default_index_path(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        os.makedirs(fixture_dir, exist_ok=True)
+        print(f"フィクスチャを作成します: {path}")
+        anchor = datetime.now().replace(microsecond=0)
+        db_pool.configure(path)
+        dummy_data.generate_synthetic_data(
+            num_users=max(50, size // 100), num_questions=size, answers_per_question=3,
+            seed=seed, chunk_size=10000, progress=size >= 100000, now=anchor)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({'size': size, 'seed': seed, 'anchor': anchor.isoformat(sep=' ')}, f, ensure_ascii=False)
+    # 類似質問インデックスもテンプレートの隣に保存しておき、複製と一緒にコピーする
+    similarity.get_index()
+    return path, anchor
+
+
+# テンプレートを work_dir に複製し、共通プールを複製に向ける（書き込みの計測で変わるのは複製だけ）
+def copy_fixture(template, work_dir):
+    path = os.path.join(work_dir, os.path.basename(template))
+    backup.copy_database(template, path)
+    index_path = similarity.default_index_path(template)
+    if os.path.exists(index_path):
+        shutil.copyfile(index_path, similarity.default_index_path(path))
+    db_pool.configure(path)
+    read_cache.clear()
+    return path
+
+
+def _percentile(ordered, p):
+    index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(func, iterations, use_cache=False):
+    """func を iterations 回呼び、レイテンシの統計を返す（func は呼び出し番号を受け取る）"""
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        if not use_cache:
+            read_cache.clear()
+        t0 = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    total = time.perf_counter() - started
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total if total else 0.0,
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': _percentile(samples, 50),
+        'p95_ms': _percentile(samples, 95),
+        'p99_ms': _percentile(samples, 99),
+        'max_ms': samples[-1],
+    }
+
+
+def _sample_ids(count, rng):
+    with db_pool.get_connection() as conn:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM questions").fetchone()[0]
+        users = [r[0] for r in conn.execute("SELECT ldap_id FROM users LIMIT 1000")]
+    return [rng.randint(1, max_id) for _ in range(count)], users
+
+
+# 計測対象の操作一覧: (名前, 呼び出し関数)。書き込み系はデータを変更するので最後に並べる
+# 期間の絞り込みは今日ではなくフィクスチャの基準日時 anchor を起点にする
+def build_operations(size, rng, iterations, full_list_limit, anchor):
+    question_ids, users = _sample_ids(iterations * 4, rng)
+    tag_sets = [[rng.choice(dummy_data.EQUIPMENT), rng.choice(dummy_data.ISSUES)] for _ in range(iterations)]
+    keyword_sets = {n: [" ".join(rng.sample(SEARCH_WORDS, n)) for _ in range(iterations)] for n in range(1, 6)}
+
+    first_page, cursor = data_handler.get_question_page(resolved_filter=False)
+    deep_cursor = cursor
+    for _ in range(5):
+        if deep_cursor is None:
+            break
+        _, deep_cursor = data_handler.get_question_page(resolved_filter=False, cursor=deep_cursor)
+    page_ids = [q.id for q in first_page]
+    anchor_day = anchor.date()
+    last_30_days = last_days(30, anchor_day)
+    last_fiscal_year = fiscal_year(fiscal_year_of(anchor_day) - 1)
+    # 差分取得は直近の変更の件数だけに比例する（DBの大きさによらない）
+    latest_seq = data_handler.latest_change_seq()
+
+    ops = [
+        ('get_question_page(open)', lambda i: data_handler.get_question_page(resolved_filter=False)),
+        ('get_question_page(resolved)', lambda i: data_handler.get_question_page(resolved_filter=True)),
+        ('get_question_page(activity)', lambda i: data_handler.get_question_page(resolved_filter=False, sort='activity')),
+        ('get_question_page(page6)', lambda i: data_handler.get_question_page(resolved_filter=False, cursor=deep_cursor)),
+        ('get_question_page(30days)', lambda i: data_handler.get_question_page(resolved_filter=False, period=last_30_days)),
+        ('get_question_page(fiscal_year)', lambda i: data_handler.get_question_page(resolved_filter=True, period=last_fiscal_year)),
+        ('get_questions_by_tags(and)', lambda i: data_handler.get_questions_by_tags(tag_sets[i], 'and')),
+        ('get_questions_by_tags(or)', lambda i: data_handler.get_questions_by_tags(tag_sets[i], 'or')),
+        ('get_tag_counts', lambda i: data_handler.get_tag_counts(50)),
+        ('get_leaderboard', lambda i: data_handler.get_leaderboard('best_answers', 10)),
+        ('get_user_stats', lambda i: data_handler.get_user_stats(users[i % len(users)])),
+        ('get_question_details', lambda i: data_handler.get_question_details(question_ids[i:i + 3])),
+        ('get_answers', lambda i: data_handler.get_answers(question_ids[i])),
+        ('get_answers_for_questions(page)', lambda i: data_handler.get_answers_for_questions(page_ids)),
+        ('login', lambda i: data_handler.login(users[i % len(users)])),
+        ('get_user_name', lambda i: data_handler.get_user_name(users[i % len(users)])),
+        ('latest_change_seq', lambda i: data_handler.latest_change_seq()),
+        ('get_changes_since(0件)', lambda i: data_handler.get_changes_since(latest_seq)),
+        ('get_changes_since(20件)', lambda i: data_handler.get_changes_since(max(latest_seq - 20, 0))),
+    ]
+    if size <= full_list_limit:
+        ops.append(('get_questions(all)', lambda i: data_handler.get_questions()))
+    for n in range(1, 6):
+        ops.append((f'search_questions({n}語)', lambda i, n=n: data_handler.search_questions(keyword_sets[n][i])))
+
+    # 類似質問インデックスの読み込み・構築は計測に含めない
+    similarity.get_index()
+    similar_titles = [f"{tags[0]}の{tags[1]}について教えてください" for tags in tag_sets]
+    ops.append(('find_similar_questions', lambda i: data_handler.find_similar_questions(similar_titles[i])))
+
+    def add_answer(i):
+        data_handler.add_answer(question_ids[i], "ベンチマーク用の回答です。", users[i % len(users)])
+
+    def update_answer(i):
+        with db_pool.get_connection() as conn:
+            row = conn.execute("SELECT id FROM answers WHERE question_id = ? LIMIT 1", (question_ids[i],)).fetchone()
+        if row:
+            data_handler.update_answer(row[0], f"ベンチマークで更新した回答 {i}")
+
+    def delete_answer(i):
+        with db_pool.get_connection() as conn:
+            row = conn.execute("SELECT MAX(id) FROM answers").fetchone()
+        data_handler.delete_answer(row[0])
+
+    def set_best_answer(i):
+        qid = question_ids[iterations + i]
+        answers = data_handler.get_answers(qid)
+        if answers:
+            data_handler.set_best_answer(qid, answers[-1].id)
+
+    def resolve_question(i):
+        qid = question_ids[iterations + i]
+        answers = data_handler.get_answers(qid)
+        data_handler.resolve_question(qid, answers[0].id if answers else None, "ありがとうございました")
+
+    ops += [
+        ('save_question', lambda i: data_handler.save_question(
+            "ベンチマーク質問", "ベンチマーク用の質問本文です。", dummy_data.CATEGORIES[0], ["配管"], users[i % len(users)])),
+        ('add_answer', add_answer),
+        ('update_answer', update_answer),
+        ('delete_answer', delete_answer),
+        ('set_best_answer', set_best_answer),
+        ('mark_question_resolved', lambda i: data_handler.mark_question_resolved(question_ids[2 * iterations + i], "ありがとうございました")),
+        ('mark_question_unresolved', lambda i: data_handler.mark_question_unresolved(question_ids[2 * iterations + i])),
+        ('resolve_question', resolve_question),
+        ('unresolve_question', lambda i: data_handler.unresolve_question(question_ids[iterations + i])),
+    ]
+    return ops
+
+
+def run(sizes, iterations, seed, fixture_dir, use_cache=False, full_list_limit=FULL_LIST_LIMIT, only=None):
+    results = {
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'iterations': iterations,
+        'seed': seed,
+        'use_cache': use_cache,
+        'fixtures': {},
+        'sizes': {},
+    }
+    # 毎回テンプレートの複製を計測するので、どの実行も同じデータから始まる
+    with tempfile.TemporaryDirectory(prefix="qa_bench_") as work_dir:
+        for size in sizes:
+            template, anchor = build_fixture(fixture_dir, size, seed)
+            copy_fixture(template, work_dir)
+            rng = random.Random(seed)
+            print(f"\n== 質問数 {size:,} 件 ==")
+            print(f"{'操作':<36}{'ops/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+            size_results = {}
+            for name, func in build_operations(size, rng, iterations, full_list_limit, anchor):
+                if only and not any(word in name for word in only):
+                    continue
+                stats = measure(func, iterations, use_cache)
+                size_results[name] = stats
+                print(f"{name:<36}{stats['ops_per_sec']:>10.1f}{stats['p50_ms']:>10.2f}"
+                      f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+            results['fixtures'][str(size)] = {'path': template, 'anchor': anchor.isoformat(sep=' ')}
+            results['sizes'][str(size)] = size_results
+        db_pool.get_pool().close()
+    return results
+
+
+# ベースラインとの比較（悪化した操作の一覧を返す）
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, metric='p95_ms', min_delta_ms=MIN_DELTA_MS):
+    regressions = []
+    for size, ops in results['sizes'].items():
+        for name, stats in ops.items():
+            base = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not base or not base.get(metric):
+                continue
+            ratio = stats[metric] / base[metric]
+            if ratio > 1.0 + tolerance and stats[metric] - base[metric] >= min_delta_ms:
+                regressions.append({'size': size, 'operation': name, 'baseline': base[metric],
+                                    'current': stats[metric], 'ratio': ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="data_handler の性能ベンチマーク")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="フィクスチャの質問数（カンマ区切り、既定: 1000,100000,1000000）")
+    parser.add_argument("--iterations", type=int, default=50, help="操作ごとの試行回数")
+    parser.add_argument("--seed", type=int, default=42, help="フィクスチャとパラメータの乱数シード")
+    parser.add_argument("--fixtures", default="bench_fixtures", help="フィクスチャDBの保存先ディレクトリ")
+    parser.add_argument("--only", help="計測する操作名の一部（カンマ区切り）")
+    parser.add_argument("--with-cache", action="store_true", help="読み取りキャッシュを有効にしたまま計測する")
+    parser.add_argument("--output", default="bench_results.json", help="結果のJSON出力先")
+    parser.add_argument("--baseline", help="比較するベースラインのJSON")
+    parser.add_argument("--save-baseline", help="今回の結果をベースラインとして保存するパス")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="許容する p95 の悪化率（既定: 0.20 = 20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_MS,
+                        help="劣化とみなす p95 の最小悪化幅（ミリ秒）")
+    args = parser.parse_args(argv)
+
+    # 計測中の遅いクエリ警告で出力が埋もれないようにする
+    configure_logging(level="ERROR")
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = [w.strip() for w in args.only.split(",")] if args.only else None
+    results = run(sizes, args.iterations, args.seed, args.fixtures, args.with_cache, only=only)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"ベースラインを保存しました: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, min_delta_ms=args.min_delta_ms)
+        if regressions:
+            print(f"\n性能劣化を検出しました（p95 が {args.tolerance:.0%} 以上悪化）:")
+            for r in regressions:
+                print(f"  [{r['size']}] {r['operation']}: {r['baseline']:.2f}ms -> {r['current']:.2f}ms "
+                      f"(x{r['ratio']:.2f})")
+            return 1
+        print("\nベースラインからの性能劣化はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
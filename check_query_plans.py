@@ -0,0 +1,230 @@
+import argparse
+import inspect
+import os
+import re
+import sys
+import tempfile
+
+import archive
+import db_pool
+import data_handler
+import dummy_data
+import maintenance
+import query_stats
+from log_config import configure_logging
+from query_cache import read_cache
+from time_utils import fiscal_year, fiscal_year_of, last_days
+
+# 検査用データベースの既定の質問数と乱数シード
+DEFAULT_QUESTIONS = 2000
+DEFAULT_SEED = 1
+
+# 実行計画で検出するもの
+_FULL_SCAN = re.compile(r'^SCAN (\w+)\b(?! USING (?:COVERING )?INDEX| USING INTEGER PRIMARY KEY| VIRTUAL TABLE)')
+# FROM句の副問い合わせ（走査しても全件スキャンではない）
+_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+# 仮想テーブル（FTS5）の絞り込み条件なしの走査
+_FULL_VIRTUAL_SCAN = re.compile(r'^SCAN \w+ VIRTUAL TABLE INDEX \d+:$')
+_TEMP_BTREE = re.compile(r'USE TEMP B-TREE')
+
+# 意図的に許容するもの: (関数名, 実行計画の正規表現, 理由)
+ALLOWED = [
+    ('search_questions', r'USE TEMP B-TREE FOR ORDER BY',
+     'bm25のスコア順はヒットした行を並べ替えるしかない（LIMITで件数を抑えている）'),
+    ('search_questions', r'^SCAN f VIRTUAL TABLE INDEX \d+:$',
+     '3文字未満の語だけの検索はtrigramで絞り込めないため、全文検索テーブル全体へのLIKEになる'),
+    ('iter_search_questions', r'USE TEMP B-TREE FOR ORDER BY',
+     'search_questions と同じ（bm25のスコア順）'),
+    ('iter_search_questions', r'^SCAN f VIRTUAL TABLE INDEX \d+:$',
+     'search_questions と同じ（3文字未満の語だけの検索）'),
+    ('latest_change_seq', r'^SCAN sqlite_sequence$',
+     'sqlite_sequence は AUTOINCREMENT のテーブルごとに1行だけ（3行）'),
+    ('get_changes_since', r'^SCAN sqlite_sequence$',
+     'latest_change_seq と同じ（最新の変更番号）'),
+]
+
+
+def _is_allowed(function, detail):
+    return any(function == name and re.search(pattern, detail) for name, pattern, _ in ALLOWED)
+
+
+def public_functions():
+    """data_handler の計測対象（@instrumented）関数名"""
+    return sorted(name for name, func in inspect.getmembers(data_handler, inspect.isfunction)
+                  if func.__module__ == 'data_handler' and hasattr(func, '__wrapped__'))
+
+
+def run_scenarios():
+    """data_handler の公開関数を分岐ごとに呼び出し、実行されたSQLを記録する"""
+    with db_pool.get_connection() as conn:
+        question_id, ldap_id = conn.execute(
+            "SELECT id, ldap_id FROM questions WHERE answer_count > 1 ORDER BY id LIMIT 1").fetchone()
+        db_pool.attach_archive(conn)
+        archived_id = conn.execute(
+            f"SELECT id FROM {db_pool.ARCHIVE_SCHEMA}.questions WHERE answer_count > 0 ORDER BY id LIMIT 1").fetchone()[0]
+    word = dummy_data.EQUIPMENT[0]
+    tags = [word, dummy_data.ISSUES[0]]
+    # 直近30日（開始のみ）と年度（開始と終了）
+    periods = [last_days(30), fiscal_year(fiscal_year_of() - 1)]
+
+    with query_stats.capture_queries() as captured:
+        for resolved in (None, True, False):
+            data_handler.get_questions(resolved)
+            for sort in data_handler.QUESTION_SORT_COLUMNS:
+                _, cursor = data_handler.get_question_page(resolved, sort=sort)
+                data_handler.get_question_page(resolved, cursor=cursor, sort=sort)
+                for period in periods:
+                    _, cursor = data_handler.get_question_page(resolved, sort=sort, period=period)
+                    data_handler.get_question_page(resolved, cursor=cursor, sort=sort, period=period)
+            data_handler.get_questions(resolved, period=periods[1])
+            # アーカイブDBを含める一覧（本体とアーカイブDBの UNION ALL）
+            data_handler.get_questions(resolved, include_archive=True)
+            _, cursor = data_handler.get_question_page(resolved, include_archive=True)
+            data_handler.get_question_page(resolved, cursor=cursor, period=periods[1], include_archive=True)
+        for mode in ('and', 'or'):
+            _, cursor = data_handler.get_questions_by_tags(tags, mode, resolved_filter=False)
+            data_handler.get_questions_by_tags(tags, mode, resolved_filter=False, cursor=cursor)
+            data_handler.get_questions_by_tags(tags, mode, period=periods[1])
+            for sort in data_handler.QUESTION_SORT_COLUMNS:
+                _, cursor = data_handler.get_questions_by_tags(tags[:1], mode, sort=sort)
+                data_handler.get_questions_by_tags(tags[:1], mode, cursor=cursor, sort=sort)
+                data_handler.get_questions_by_tags(tags, mode, resolved_filter=True, sort=sort, period=periods[0])
+        data_handler.get_tag_counts(30)
+        for metric in data_handler.LEADERBOARD_METRICS:
+            data_handler.get_leaderboard(metric, 5)
+        data_handler.get_leaderboard('answers', 5, category=dummy_data.CATEGORIES[0])
+        data_handler.get_user_stats(ldap_id)
+        data_handler.get_question_details([question_id, question_id + 1])
+        data_handler.get_answers(question_id)
+        data_handler.get_answers_for_questions([question_id, question_id + 1, question_id + 2])
+        # アーカイブDBへ移した質問の詳細・回答（本体に無いのでアーカイブDBを引く）
+        data_handler.get_question_details([archived_id])
+        data_handler.get_answers(archived_id)
+        data_handler.get_answers_for_questions([archived_id])
+        list(data_handler.iter_answers(archived_id))
+        data_handler.get_user_name(ldap_id)
+        data_handler.login(ldap_id)
+        data_handler.signup('99999999', '実行計画 検査')
+        # 長い語のみ・長い語と短い語・短い語のみ
+        data_handler.search_questions(word)
+        data_handler.search_questions(f"{word} 点")
+        data_handler.search_questions("点")
+        for period in periods:
+            data_handler.search_questions(word, period=period)
+            data_handler.search_questions(word, period=period, sort='created')
+            data_handler.search_questions("点", period=period)
+        data_handler.find_similar_questions(f"{word}の{dummy_data.ISSUES[0]}について")
+        # 逐次取得版（一覧・回答・検索と同じSQL）
+        for resolved in (None, True):
+            next(data_handler.iter_questions(resolved), None)
+        list(data_handler.iter_answers(question_id))
+        list(data_handler.iter_search_questions(word, limit=10))
+
+        new_id = data_handler.save_question("実行計画の検査", "検査用の質問です。", dummy_data.CATEGORIES[0],
+                                            ["検査"], ldap_id)
+        data_handler.add_answer(new_id, "検査用の回答です。", ldap_id)
+        answer_id = data_handler.get_answers(new_id)[0].id
+        data_handler.update_answer(answer_id, "更新した回答です。")
+        data_handler.set_best_answer(new_id, answer_id)
+        data_handler.mark_question_resolved(new_id, "ありがとうございました")
+        data_handler.mark_question_unresolved(new_id)
+        data_handler.resolve_question(new_id, answer_id, "ありがとうございました")
+        data_handler.unresolve_question(new_id)
+        data_handler.remove_answer(answer_id)
+        data_handler.add_answer(new_id, "検査用の回答です。", ldap_id)
+        data_handler.delete_answer(data_handler.get_answers(new_id)[0].id)
+        # 変更履歴（上の書き込みで記録された分の差分と、上限超え・古い履歴の削除）
+        data_handler.latest_change_seq()
+        data_handler.get_changes_since(0)
+        data_handler.get_changes_since(0, limit=1)
+        data_handler.prune_changes()
+    return captured
+
+
+def explain(sql, params):
+    with db_pool.get_connection() as conn:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check(verbose=False):
+    """違反の一覧 [(関数名, SQL, 実行計画の行)] と未検査の関数名を返す"""
+    read_cache.clear()
+    captured = run_scenarios()
+
+    violations = []
+    seen = set()
+    for function, sql, params in captured:
+        key = (function, query_stats.fingerprint(sql))
+        if key in seen:
+            continue
+        seen.add(key)
+        plan = explain(sql, params)
+        if verbose:
+            print(f"[{function}] {key[1]}")
+            for detail in plan:
+                print(f"    {detail}")
+        subqueries = {m.group(1) for m in map(_SUBQUERY.search, plan) if m}
+        for detail in plan:
+            scan = _FULL_SCAN.search(detail)
+            if scan and scan.group(1) in subqueries:
+                continue
+            problem = scan or _FULL_VIRTUAL_SCAN.search(detail) or _TEMP_BTREE.search(detail)
+            if problem and not _is_allowed(function, detail):
+                violations.append((function, key[1], detail))
+
+    covered = {function for function, _, _ in captured}
+    missing = [name for name in public_functions() if name not in covered]
+    return violations, missing
+
+
+def build_database(path, questions=DEFAULT_QUESTIONS, seed=DEFAULT_SEED):
+    """共通プールを path に向け、検査用のデータベースを作る"""
+    db_pool.configure(path)
+    dummy_data.generate_synthetic_data(num_users=50, num_questions=questions, seed=seed, progress=False)
+    # 古い解決済みの質問をアーカイブDBへ移し、アーカイブDBも引く経路を検査する
+    archive.archive_questions()
+    # 運用中と同じく、メンテナンスの ANALYZE で集めた統計がある状態の実行計画を検査する
+    maintenance.optimize()
+
+
+def run_check(questions=DEFAULT_QUESTIONS, seed=DEFAULT_SEED, verbose=False):
+    """一時ディレクトリに検査用のデータベースを作って check() する（tests/test_query_plans.py と main() で使う）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        build_database(os.path.join(tmp, "plans.db"), questions, seed)
+        try:
+            return check(verbose)
+        finally:
+            db_pool.get_pool().close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="data_handler のクエリの実行計画を検査する（全件スキャンや一時B-treeでの並べ替えを検出）")
+    parser.add_argument("--questions", type=int, default=DEFAULT_QUESTIONS, help="検査用データベースの質問数")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="検査用データの乱数シード")
+    parser.add_argument("--verbose", action="store_true", help="すべてのクエリの実行計画を表示する")
+    args = parser.parse_args(argv)
+
+    configure_logging(level="ERROR")
+
+    violations, missing = run_check(args.questions, args.seed, args.verbose)
+
+    failed = False
+    if violations:
+        failed = True
+        print(f"インデックスを使わない実行計画が {len(violations)} 件あります:")
+        for function, sql, detail in violations:
+            print(f"  [{function}] {detail}\n      {sql}")
+    if missing:
+        failed = True
+        print("検査シナリオで呼ばれていない関数があります（run_scenarios に追加してください）:")
+        for name in missing:
+            print(f"  {name}")
+    if failed:
+        return 1
+    print("すべてのクエリがインデックスを使用しています")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
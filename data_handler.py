@@ -1,360 +1,1021 @@
 import sqlite3
 import os
-from datetime import datetime
-from db_init import init_db
+import threading
+from db_pool import ARCHIVE_SCHEMA, attach_archive, get_connection, get_streaming_connection
+from query_cache import read_cache
+from log_config import get_logger
+from query_stats import instrumented, run_query
+from records import Answer, ChangeSet, LeaderboardEntry, Question, record_cursor
+from backup import get_read_connection
+import similarity
+from tag_utils import join_tags, normalize_tags
+from time_utils import now_stamp, period_conditions
+from write_queue import run_write
+
+logger = get_logger('data_handler')
 
 # 質問保存
+@instrumented
 def save_question(title, content, category, tags, ldap_id):
     try:
-        print(f"保存試行 - タイトル: {title}, カテゴリ: {category}, ユーザー: {ldap_id}")  # デバッグ用
-        init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        tags_str = ",".join(tags) if tags else ""
-        
-        c.execute('''INSERT INTO questions 
-                    (title, content, category, tags, ldap_id, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                 (title, content, category, tags_str, ldap_id, 
-                  datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        
-        conn.commit()
-        question_id = c.lastrowid
-        print(f"保存成功 - 質問ID: {question_id}")  # デバッグ用
+        logger.debug("保存試行 - タイトル: %s, カテゴリ: %s, ユーザー: %s", title, category, ldap_id)
+        tags_str = join_tags(tags)
+        created_at, created_ts = now_stamp()
+
+        def _op(conn):
+            c = conn.cursor()
+            run_query(c, '''INSERT INTO questions
+                        (title, content, category, tags, ldap_id, created_at, created_ts, last_activity_ts)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (title, content, category, tags_str, ldap_id, created_at, created_ts, created_ts), fetch=None)
+            return c.lastrowid
+
+        question_id = run_write(_op)
+        read_cache.invalidate([question_id])
+        try:
+            similarity.add_question(question_id, title, content)
+        except Exception as e:
+            # 類似質問インデックスは次回の同期で追いつくので、保存自体は成功とする
+            logger.warning("類似質問インデックスへの追加に失敗しました: %s", e)
+        logger.info("質問を保存しました - 質問ID: %s", question_id)
         return question_id
     except Exception as e:
-        print(f"保存エラー: {str(e)}")  # 詳細なエラー出力
+        logger.exception("保存エラー: %s", e)
         return None
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # 回答追加
+@instrumented
 def add_answer(question_id, content, ldap_id):
     try:
-        print(f"回答追加試行 - 質問ID: {question_id}, ユーザー: {ldap_id}, 内容長: {len(content)}")  # デバッグ用
-        init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        c.execute('''INSERT INTO answers
-                    (question_id, content, ldap_id, posted_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?)''',
-                 (question_id, content, ldap_id, now, now))
-        
-        conn.commit()
-        print(f"回答追加成功 - 質問ID: {question_id}")
+        logger.debug("回答追加試行 - 質問ID: %s, ユーザー: %s, 内容長: %d", question_id, ldap_id, len(content))
+        now, now_ts = now_stamp()
+
+        def _op(conn):
+            c = conn.cursor()
+            run_query(c, '''INSERT INTO answers
+                        (question_id, content, ldap_id, posted_at, updated_at, posted_ts, updated_ts)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (question_id, content, ldap_id, now, now, now_ts, now_ts), fetch=None)
+
+        run_write(_op)
+        read_cache.invalidate([question_id])
+        logger.info("回答を追加しました - 質問ID: %s", question_id)
         return True
     except Exception as e:
-        print(f"回答の保存に失敗しました: {str(e)}")  # 詳細なエラー出力
+        logger.exception("回答の保存に失敗しました: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+# 回答が属する質問ID（キャッシュ無効化用）
+def _answer_question_id(c, answer_id):
+    row = run_query(c, 'SELECT question_id FROM answers WHERE id = ?', (answer_id,), fetch='one')
+    return row[0] if row else None
 
 # 回答更新
+@instrumented
 def update_answer(answer_id, new_content):
     try:
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        c.execute('''
-            UPDATE answers 
-            SET content = ?, updated_at = ?
-            WHERE id = ?
-        ''', (new_content, now, answer_id))
-        conn.commit()
+        now, now_ts = now_stamp()
+
+        def _op(conn):
+            c = conn.cursor()
+            question_id = _answer_question_id(c, answer_id)
+            run_query(c, '''
+                UPDATE answers
+                SET content = ?, updated_at = ?, updated_ts = ?
+                WHERE id = ?
+            ''', (new_content, now, now_ts, answer_id), fetch=None)
+            return question_id
+
+        question_id = run_write(_op)
+        read_cache.invalidate([question_id])
         return True
     except Exception as e:
-        print(f"回答更新エラー: {e}")
+        logger.exception("回答更新エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # 回答削除
+@instrumented
 def delete_answer(answer_id):
     try:
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM answers WHERE id = ?', (answer_id,))
-        conn.commit()
+        question_id = run_write(lambda conn: _delete_answer(conn.cursor(), answer_id))
+        read_cache.invalidate([question_id])
         return True
     except Exception as e:
-        print(f"回答削除エラー: {e}")
+        logger.exception("回答削除エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-# 質問一覧取得
-def get_questions(resolved_filter=None):
+# ---- アーカイブDB（archive.py が古い解決済み質問を移す先）----
+# 一覧は既定で本体だけを読み、include_archive=True のときと検索ではアーカイブDBにも同じSQLを発行して
+# UNION ALL でまとめる（各SELECTがインデックス順に返すので、並べ替えは両者のマージで済む）
+
+# 移動の途中で本体とアーカイブDBの両方にある質問は本体の方を使う
+_NOT_IN_HOT = "q.id NOT IN (SELECT id FROM main.questions)"
+
+def _fan_out(select, conditions, params, archive):
+    """{schema}（main / archive）と {archived}（0 / 1）を含むSELECTを、本体と（archive なら）アーカイブDBについてまとめる"""
+    targets = [('main', 0)] + ([(ARCHIVE_SCHEMA, 1)] if archive else [])
+    parts, all_params = [], []
+    for schema, archived in targets:
+        where = conditions + ([_NOT_IN_HOT] if archived else [])
+        part = select.format(schema=schema, archived=archived)
+        if where:
+            part += " WHERE " + " AND ".join(where)
+        parts.append(part)
+        all_params.extend(params)
+    return " UNION ALL ".join(parts), all_params
+
+def _use_archive(conn, include_archive):
+    return include_archive and attach_archive(conn)
+
+# 質問一覧のSQL（新着順、period は投稿日時の期間 (開始, 終了)）
+def _questions_query(resolved_filter, period=None, archive=False):
+    # 回答数は answers のトリガーで集計済みの列を使う
+    select = '''
+        SELECT q.id AS id, q.title, q.content, q.tags, q.ldap_id,
+               q.created_at, q.created_ts AS created_ts, q.resolved, q.best_answer_id, q.thank_message,
+               COALESCE(u.name, 'Unknown') AS user_name, q.answer_count, q.last_activity_at, q.last_activity_ts,
+               {archived} AS archived
+        FROM {schema}.questions q
+        JOIN users u ON q.ldap_id = u.ldap_id
+    '''
+
+    conditions, params = period_conditions("q.created_ts", period)
+    if resolved_filter is not None:
+        conditions.append("q.resolved = ?")
+        params.append(1 if resolved_filter else 0)
+
+    query, params = _fan_out(select, conditions, params, archive)
+    # 並べ替えは結果の列名で指定する（UNION ALL でまとめた場合も同じ）
+    query += " ORDER BY created_ts DESC, id DESC"
+    return query, params
+
+# 質問一覧取得（include_archive=True でアーカイブDBの質問も含める）
+@instrumented
+def get_questions(resolved_filter=None, period=None, include_archive=False):
+    key = ('get_questions', resolved_filter, tuple(period) if period else None, include_archive)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
     try:
-        init_db()  # Added init_db call for consistency
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        # Improved query with subquery for answer count (works across databases)
-        query = '''
-            SELECT q.id, q.title, q.content, q.tags, q.ldap_id, 
-                   q.created_at, q.resolved, q.best_answer_id, q.thank_message,
-                   u.name as user_name,
-                   (SELECT COUNT(*) FROM answers a WHERE a.question_id = q.id) as answer_count
-            FROM questions q
-            JOIN users u ON q.ldap_id = u.ldap_id
-        '''
-        
-        if resolved_filter is not None:
-            query += f" WHERE q.resolved = {1 if resolved_filter else 0}"
-            
-        query += " ORDER BY q.created_at DESC"
-        
-        c.execute(query)
-        
-        questions = []
-        for row in c.fetchall():
-            questions.append({
-                'id': row[0],
-                'title': row[1],
-                'content': row[2],
-                'tags': row[3],
-                'ldap_id': row[4],
-                'created_at': row[5],
-                'resolved': row[6],
-                'best_answer_id': row[7],
-                'thank_message': row[8],
-                'user_name': row[9] if row[9] else "Unknown",  # Handle NULL user_name
-                'answer_count': row[10]
-            })
-        
-        return questions
+        with get_connection() as conn:
+            query, params = _questions_query(resolved_filter, period, _use_archive(conn, include_archive))
+            questions = run_query(record_cursor(conn, Question), query, params)
+        return read_cache.store(key, stamp, questions)
     except Exception as e:
-        print(f"質問取得エラー: {e}")
+        logger.exception("質問取得エラー: %s", e)
         return []
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-# 回答取得
-def get_answers(question_id):
+# 質問一覧を1件ずつ返す（全件をリストにしない、キャッシュもしない）
+# 読み終えるか close() するまで接続を1本占有する（スレッドごとの接続とは別、レプリカが有効なら最新のスナップショットを読む）
+@instrumented
+def iter_questions(resolved_filter=None, period=None, include_archive=False):
+    with get_read_connection(streaming=True) as conn:
+        query, params = _questions_query(resolved_filter, period, _use_archive(conn, include_archive))
+        yield from run_query(record_cursor(conn, Question), query, params, fetch='iter')
+
+# 一覧1ページあたりの件数
+QUESTION_PAGE_SIZE = 20
+
+# 一覧の並び順: {名前: 並べ替えに使う列（UNIX時刻）}
+QUESTION_SORT_COLUMNS = {
+    'created': 'created_ts',        # 新着順
+    'activity': 'last_activity_ts', # 最近回答・更新があった順
+}
+
+# 一覧の1行に表示する列（本文を含まない、q は質問・u はユーザー）
+_QUESTION_SUMMARY_COLUMNS = '''q.id AS id, q.title, q.category, q.tags, q.ldap_id,
+               q.created_at, q.created_ts AS created_ts, q.resolved, q.best_answer_id,
+               COALESCE(u.name, 'Unknown') AS user_name, q.answer_count, q.last_activity_at,
+               q.last_activity_ts AS last_activity_ts'''
+
+# 一覧表示用の列を (並べ替え列, id) のキーセット方式で1ページ分取得する
+# source は questions を q として含むFROM句
+# period (開始, 終了) は並べ替え列の期間（新着順なら投稿日時、最近の動き順なら最終アクティビティ）で、
+# 並べ替えと同じインデックスの範囲検索になる
+# archive なら source の {schema} を main / archive に置き換えてアーカイブDBの質問も含める
+def _fetch_question_page(c, source, source_params, resolved_filter, cursor, page_size, column, period=None,
+                         archive=False):
+    conditions, params = period_conditions(f"q.{column}", period)
+    if resolved_filter is not None:
+        conditions.append("q.resolved = ?")
+        params.append(1 if resolved_filter else 0)
+    if cursor is not None:
+        conditions.append(f"(q.{column}, q.id) < (?, ?)")
+        params.extend(cursor)
+
+    select = f'''
+        SELECT {_QUESTION_SUMMARY_COLUMNS}, {{archived}} AS archived
+        FROM {source}
+        JOIN users u ON q.ldap_id = u.ldap_id
+    '''
+    query, params = _fan_out(select, conditions, list(source_params) + params, archive)
+    # 次ページの有無を判定するため1件多く取得する
+    query += f" ORDER BY {column} DESC, id DESC LIMIT ?"
+    params.append(page_size + 1)
+
+    rows = run_query(c, query, params)
+    questions = rows[:page_size]
+
+    next_cursor = None
+    if len(rows) > page_size:
+        last = questions[-1]
+        next_cursor = (getattr(last, column), last.id)
+    return questions, next_cursor
+
+# 質問一覧のページ取得（include_archive=True でアーカイブDBの質問も含める）
+# 戻り値: (質問リスト, 次ページのカーソル or None)
+@instrumented
+def get_question_page(resolved_filter=None, cursor=None, page_size=QUESTION_PAGE_SIZE, sort='created',
+                      period=None, include_archive=False):
+    column = QUESTION_SORT_COLUMNS[sort]
+    key = ('get_question_page', resolved_filter, tuple(cursor) if cursor else None, page_size, sort,
+           tuple(period) if period else None, include_archive)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
+    try:
+        with get_connection() as conn:
+            c = record_cursor(conn, Question)
+            page = _fetch_question_page(c, "{schema}.questions q", (), resolved_filter, cursor, page_size, column,
+                                        period, _use_archive(conn, include_archive))
+        return read_cache.store(key, stamp, page)
+    except Exception as e:
+        logger.exception("質問ページ取得エラー: %s", e)
+        return [], None
+
+# タグで絞り込んだ質問一覧のページ取得
+# mode: 'and' はすべてのタグ、'or' はいずれかのタグが付いた質問
+# 戻り値: (質問リスト, 次ページのカーソル or None)
+@instrumented
+def get_questions_by_tags(tags, mode='and', resolved_filter=None, cursor=None,
+                          page_size=QUESTION_PAGE_SIZE, sort='created', period=None):
+    if mode not in ('and', 'or'):
+        raise ValueError(f"mode は 'and' か 'or' を指定してください: {mode}")
+    tags = sorted(normalize_tags(tags))
+    if not tags:
+        return [], None
+    column = QUESTION_SORT_COLUMNS[sort]
+    key = ('get_questions_by_tags', tuple(tags), mode, resolved_filter,
+           tuple(cursor) if cursor else None, page_size, sort, tuple(period) if period else None)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
+    try:
+        with get_connection() as conn:
+            page = _fetch_tag_page(conn, tags, mode, resolved_filter, cursor, page_size, column, period)
+        return read_cache.store(key, stamp, page)
+    except Exception as e:
+        logger.exception("タグ別質問取得エラー: %s", e)
+        return [], None
+
+# タグ別一覧の1ページ（タグ一覧は本体の質問だけを対象にする、アーカイブした質問は検索から辿る）
+# question_tags の (タグ, 解決状態, 並べ替え列, 質問ID) のインデックスを降順に辿り、
+# タグ・解決状態ごとの範囲検索を並べ替えキーの順にマージして先頭の1ページ分だけ読む
+# AND は質問数が最も少ないタグを辿り、残りのタグは主キーで有無だけ確かめる
+def _fetch_tag_page(conn, tags, mode, resolved_filter, cursor, page_size, column, period=None):
+    if mode == 'and':
+        placeholders = ",".join("?" * len(tags))
+        query = f"SELECT tag, question_count FROM tag_counts WHERE tag IN ({placeholders})"
+        counts = dict(run_query(conn.cursor(), query, tags))
+        if len(counts) < len(tags):
+            return [], None
+        driver = min(tags, key=lambda tag: (counts[tag], tag))
+        drivers, probes = [driver], [tag for tag in tags if tag != driver]
+    else:
+        drivers, probes = tags, []
+
+    conditions, condition_params = period_conditions(f"t.{column}", period)
+    if cursor is not None:
+        conditions.append(f"(t.{column}, t.question_id) < (?, ?)")
+        condition_params.extend(cursor)
+    conditions += ["EXISTS (SELECT 1 FROM question_tags o WHERE o.tag = ? AND o.question_id = t.question_id)"] * len(probes)
+    condition_params += probes
+    states = [0, 1] if resolved_filter is None else [1 if resolved_filter else 0]
+
+    parts, params = [], []
+    for tag in drivers:
+        for state in states:
+            where = ["t.tag = ?", "t.resolved = ?"] + conditions
+            parts.append(f"SELECT t.{column} AS sort_key, t.question_id AS question_id FROM question_tags t "
+                         f"WHERE {' AND '.join(where)}")
+            params += [tag, state] + condition_params
+    # OR で複数のタグが付いた質問は UNION で1件にまとめる
+    # 次ページの有無を判定するため1件多く取得する
+    query = f'''
+        SELECT {_QUESTION_SUMMARY_COLUMNS}, 0 AS archived
+        FROM ({" UNION ".join(parts)} ORDER BY sort_key DESC, question_id DESC LIMIT ?) m
+        CROSS JOIN questions q ON q.id = m.question_id
+        JOIN users u ON q.ldap_id = u.ldap_id
+    '''
+    params.append(page_size + 1)
+
+    # 外側で ORDER BY すると1ページ分でも一時B-treeになるので、並べ替えキーの降順は Python 側で揃える
+    rows = run_query(record_cursor(conn, Question), query, params)
+    rows.sort(key=lambda q: (getattr(q, column) is not None, getattr(q, column) or 0, q.id), reverse=True)
+    questions = rows[:page_size]
+
+    next_cursor = None
+    if len(rows) > page_size:
+        last = questions[-1]
+        next_cursor = (getattr(last, column), last.id)
+    return questions, next_cursor
+
+# タグごとの質問数（多い順、[(タグ, 質問数)]）
+@instrumented
+def get_tag_counts(limit=None):
+    key = ('get_tag_counts', limit)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
+    try:
+        query = "SELECT tag, question_count FROM tag_counts ORDER BY question_count DESC, tag"
+        params = []
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with get_connection() as conn:
+            c = conn.cursor()
+            rows = run_query(c, query, params)
+        return read_cache.store(key, stamp, [(row[0], row[1]) for row in rows])
+    except Exception as e:
+        logger.exception("タグ集計取得エラー: %s", e)
+        return []
+
+# ランキングの指標: 名前 -> user_stats の列（列ごとに (category, 列 DESC, ldap_id) のインデックスがある）
+LEADERBOARD_METRICS = {
+    'answers': 'answer_count',
+    'best_answers': 'best_answer_count',
+    'resolved_questions': 'resolved_question_count',
+}
+
+# カテゴリごとの上位ユーザー（{カテゴリ: [LeaderboardEntry, ...]}、カテゴリ順）
+@instrumented
+def get_leaderboard(metric='best_answers', limit=10, category=None):
+    column = LEADERBOARD_METRICS[metric]
+    key = ('get_leaderboard', metric, limit, category)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
     try:
-        print(f"[DEBUG] 回答取得開始 - 質問ID: {question_id}")  # デバッグ用出力
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        sql = '''
-            SELECT a.id, a.content, a.posted_at, a.updated_at, u.name as user_name, a.is_best, a.ldap_id
-            FROM answers a
-            JOIN users u ON a.ldap_id = u.ldap_id
-            WHERE a.question_id = ?
-            ORDER BY a.is_best DESC, a.posted_at
+        conditions = [f'{column} > 0']
+        params = []
+        if category is not None:
+            conditions.append('category = ?')
+            params.append(category)
+        params.append(limit)
+        # 順位付けの並べ替えはインデックスの順序で済ませ、結果の並べ替え（カテゴリ数×limit 行）はPython側で行う
+        query = f'''
+            SELECT r.category, r.rank, r.ldap_id, COALESCE(u.name, 'Unknown') AS user_name, r.value
+            FROM (SELECT category, ldap_id, {column} AS value,
+                         ROW_NUMBER() OVER (PARTITION BY category ORDER BY {column} DESC, ldap_id) AS rank
+                  FROM user_stats
+                  WHERE {' AND '.join(conditions)}) r
+            LEFT JOIN users u ON u.ldap_id = r.ldap_id
+            WHERE r.rank <= ?
         '''
-        print(f"[DEBUG] 実行SQL:\n{sql}")  # デバッグ用SQL出力
-        print(f"[DEBUG] パラメータ: {question_id}")  # デバッグ用パラメータ出力
-        
-        c.execute(sql, (question_id,))
-        
-        answers = []
-        rows = c.fetchall()
-        print(f"[DEBUG] 取得行数: {len(rows)}")  # デバッグ用取得件数出力
-        
+        with get_connection() as conn:
+            rows = run_query(record_cursor(conn, LeaderboardEntry), query, params)
+
+        leaderboard = {}
+        for entry in sorted(rows, key=lambda e: (e.category, e.rank)):
+            leaderboard.setdefault(entry.category, []).append(entry)
+        return read_cache.store(key, stamp, leaderboard)
+    except Exception as e:
+        logger.exception("ランキング取得エラー: %s", e)
+        return {}
+
+# ユーザーの回答数・ベストアンサー数・解決済み質問数（合計とカテゴリ別）
+@instrumented
+def get_user_stats(ldap_id):
+    key = ('get_user_stats', ldap_id)
+    hit, cached, stamp = read_cache.lookup(key)
+    if hit:
+        return cached
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            rows = run_query(c, '''
+                SELECT category, answer_count, best_answer_count, resolved_question_count
+                FROM user_stats
+                WHERE ldap_id = ?
+                ORDER BY category
+            ''', (ldap_id,))
+
+        stats = {'answer_count': 0, 'best_answer_count': 0, 'resolved_question_count': 0, 'categories': {}}
         for row in rows:
-            answers.append({
-                'id': row[0],
-                'content': row[1],
-                'posted_at': row[2],
-                'updated_at': row[3],
-                'user_name': row[4] if row[4] else "Unknown",
-                'is_best': row[5],
-                'ldap_id': row[6],
-                'question_id': question_id  # 明示的にquestion_idを追加
-            })
-        
-        print(f"[DEBUG] 回答データ: {answers}")  # デバッグ用回答データ出力
-        return answers
+            stats['categories'][row[0]] = {
+                'answer_count': row[1],
+                'best_answer_count': row[2],
+                'resolved_question_count': row[3]
+            }
+            stats['answer_count'] += row[1]
+            stats['best_answer_count'] += row[2]
+            stats['resolved_question_count'] += row[3]
+        return read_cache.store(key, stamp, stats)
     except Exception as e:
-        print(f"[DEBUG] 回答取得エラー: {e}")  # 詳細なエラー出力
+        logger.exception("ユーザー集計取得エラー: %s", e)
+        return None
+
+# 質問の詳細（本文を含む）
+_QUESTION_DETAIL_SQL = '''
+    SELECT q.id, q.title, q.content, q.category, q.tags, q.ldap_id,
+           q.created_at, q.created_ts, q.resolved, q.best_answer_id, q.thank_message,
+           COALESCE(u.name, 'Unknown') AS user_name, q.answer_count, q.last_activity_at, q.last_activity_ts,
+           {archived} AS archived
+    FROM {schema}.questions q
+    LEFT JOIN users u ON q.ldap_id = u.ldap_id
+'''
+QUESTION_DETAIL_SQL = _QUESTION_DETAIL_SQL.format(schema='main', archived=0)
+ARCHIVE_QUESTION_DETAIL_SQL = _QUESTION_DETAIL_SQL.format(schema=ARCHIVE_SCHEMA, archived=1)
+
+# 質問本文を含む詳細の一括取得（{質問ID: 質問}、本体に無い質問はアーカイブDBから読む）
+@instrumented
+def get_question_details(question_ids):
+    question_ids = list(dict.fromkeys(question_ids))
+    if not question_ids:
+        return {}
+    key = ('get_question_details', tuple(question_ids))
+    hit, cached, stamp = read_cache.lookup(key, question_ids)
+    if hit:
+        return cached
+    try:
+        placeholders = ",".join("?" * len(question_ids))
+        with get_connection() as conn:
+            c = record_cursor(conn, Question)
+            details = {q.id: q for q in run_query(
+                c, QUESTION_DETAIL_SQL + f" WHERE q.id IN ({placeholders})", question_ids)}
+            missing = [qid for qid in question_ids if qid not in details]
+            if missing and attach_archive(conn):
+                placeholders = ",".join("?" * len(missing))
+                details.update((q.id, q) for q in run_query(
+                    c, ARCHIVE_QUESTION_DETAIL_SQL + f" WHERE q.id IN ({placeholders})", missing))
+
+        return read_cache.store(key, stamp, details)
+    except Exception as e:
+        logger.exception("質問詳細取得エラー: %s", e)
+        return {}
+
+# 1つの質問の回答（ベストアンサーを先頭に投稿順）
+_ANSWER_THREAD_SQL = '''
+    SELECT a.id, a.content, a.posted_at, a.updated_at, a.posted_ts, a.updated_ts,
+           COALESCE(u.name, 'Unknown') AS user_name, a.is_best, a.ldap_id, a.question_id
+    FROM {schema}.answers a
+    JOIN users u ON a.ldap_id = u.ldap_id
+    WHERE a.question_id = ?
+    ORDER BY a.is_best DESC, a.posted_ts, a.id
+'''
+ANSWER_THREAD_SQL = _ANSWER_THREAD_SQL.format(schema='main')
+ARCHIVE_ANSWER_THREAD_SQL = _ANSWER_THREAD_SQL.format(schema=ARCHIVE_SCHEMA)
+
+def _read_answers(conn, question_id):
+    return run_query(record_cursor(conn, Answer), ANSWER_THREAD_SQL, (question_id,))
+
+# 本体に回答が無ければアーカイブDBの回答（アーカイブへ移した質問のスレッド）
+def _read_answers_with_archive(conn, question_id):
+    answers = _read_answers(conn, question_id)
+    if not answers and attach_archive(conn):
+        answers = run_query(record_cursor(conn, Answer), ARCHIVE_ANSWER_THREAD_SQL, (question_id,))
+    return answers
+
+# 回答取得
+@instrumented
+def get_answers(question_id):
+    key = ('get_answers', question_id)
+    hit, cached, stamp = read_cache.lookup(key, [question_id])
+    if hit:
+        return cached
+    try:
+        logger.debug("回答取得開始 - 質問ID: %s", question_id)
+        with get_connection() as conn:
+            logger.debug("実行SQL: %s パラメータ: %s", ANSWER_THREAD_SQL, question_id)
+            answers = _read_answers_with_archive(conn, question_id)
+
+        logger.debug("取得行数: %d", len(answers))
+
+        logger.debug("回答データ: %r", answers)
+        return read_cache.store(key, stamp, answers)
+    except Exception as e:
+        logger.exception("回答取得エラー: %s", e)
         return []
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+# 回答を1件ずつ返す（キャッシュしない、読み終えるまで接続を1本占有する、スレッドごとの接続とは別）
+@instrumented
+def iter_answers(question_id):
+    with get_streaming_connection() as conn:
+        c = record_cursor(conn, Answer)
+        found = False
+        for answer in run_query(c, ANSWER_THREAD_SQL, (question_id,), fetch='iter'):
+            found = True
+            yield answer
+        if not found and attach_archive(conn):
+            yield from run_query(c, ARCHIVE_ANSWER_THREAD_SQL, (question_id,), fetch='iter')
+
+# IN句1回あたりのパラメータ数（SQLiteの変数上限より十分小さくする）
+ANSWER_BATCH_SIZE = 500
+
+_ANSWERS_FOR_QUESTIONS_SQL = '''
+    SELECT a.id, a.content, a.posted_at, a.updated_at, a.posted_ts, a.updated_ts,
+           COALESCE(u.name, 'Unknown') AS user_name, a.is_best, a.ldap_id, a.question_id
+    FROM {schema}.answers a
+    JOIN users u ON a.ldap_id = u.ldap_id
+    WHERE a.question_id IN ({placeholders})
+    ORDER BY a.question_id, a.is_best DESC, a.posted_ts, a.id
+'''
+
+def _read_answers_for_questions(c, schema, question_ids):
+    rows = []
+    for start in range(0, len(question_ids), ANSWER_BATCH_SIZE):
+        chunk = question_ids[start:start + ANSWER_BATCH_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        rows.extend(run_query(c, _ANSWERS_FOR_QUESTIONS_SQL.format(schema=schema, placeholders=placeholders),
+                              chunk))
+    return rows
+
+# 複数質問の回答を一括取得（{質問ID: 回答リスト}、本体に回答の無い質問はアーカイブDBも見る）
+@instrumented
+def get_answers_for_questions(question_ids):
+    question_ids = list(dict.fromkeys(question_ids))
+    grouped = {qid: [] for qid in question_ids}
+    if not question_ids:
+        return grouped
+    key = ('get_answers_for_questions', tuple(question_ids))
+    hit, cached, stamp = read_cache.lookup(key, question_ids)
+    if hit:
+        return cached
+    try:
+        with get_connection() as conn:
+            c = record_cursor(conn, Answer)
+            for answer in _read_answers_for_questions(c, 'main', question_ids):
+                grouped.setdefault(answer.question_id, []).append(answer)
+            missing = [qid for qid in question_ids if not grouped[qid]]
+            if missing and attach_archive(conn):
+                for answer in _read_answers_for_questions(c, ARCHIVE_SCHEMA, missing):
+                    grouped[answer.question_id].append(answer)
+
+        return read_cache.store(key, stamp, grouped)
+    except Exception as e:
+        logger.exception("回答一括取得エラー: %s", e)
+        return grouped
 
 # ユーザー名取得
+@instrumented
 def get_user_name(ldap_id):
     try:
-        init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        c.execute("SELECT name FROM users WHERE ldap_id=?", (ldap_id,))
-        result = c.fetchone()
+        with get_connection() as conn:
+            c = conn.cursor()
+            result = run_query(c, "SELECT name FROM users WHERE ldap_id=?", (ldap_id,), fetch='one')
         return result[0] if result else None
     except Exception as e:
-        print(f"ユーザー名の取得に失敗しました: {e}")
+        logger.exception("ユーザー名の取得に失敗しました: %s", e)
         return None
-    finally:
-        conn.close()
 
 # ユーザー登録
+@instrumented
 def signup(ldap_id, name):
     try:
-        init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        c.execute('''INSERT INTO users (ldap_id, name, created_at)
-                     VALUES (?, ?, ?)''',
-                 (ldap_id, name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        
-        conn.commit()
+        created_at, created_ts = now_stamp()
+
+        def _op(conn):
+            run_query(conn.cursor(), '''INSERT INTO users (ldap_id, name, created_at, created_ts)
+                         VALUES (?, ?, ?, ?)''',
+                     (ldap_id, name, created_at, created_ts), fetch=None)
+
+        run_write(_op)
         return True
     except sqlite3.IntegrityError:
         return False
     except Exception as e:
-        print(f"ユーザー登録エラー: {e}")  # Improved error logging
+        logger.exception("ユーザー登録エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # ログイン確認
+@instrumented
 def login(ldap_id):
     try:
-        init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        c.execute("SELECT name FROM users WHERE ldap_id=?", (ldap_id,))
-        result = c.fetchone()
+        with get_connection() as conn:
+            c = conn.cursor()
+
+            result = run_query(c, "SELECT name FROM users WHERE ldap_id=?", (ldap_id,), fetch='one')
         return result is not None
     except Exception as e:
-        print(f"ログイン確認に失敗しました: {e}")
+        logger.exception("ログイン確認に失敗しました: %s", e)
         return False
-    finally:
-        conn.close()
 
 # 質問を解決済みにする
+@instrumented
 def mark_question_resolved(question_id, thank_message=None):
     try:
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        c.execute('''
-            UPDATE questions 
-            SET resolved = 1, thank_message = ?
-            WHERE id = ?
-        ''', (thank_message, question_id))
-        conn.commit()
+        def _op(conn):
+            run_query(conn.cursor(), '''
+                UPDATE questions
+                SET resolved = 1, thank_message = ?
+                WHERE id = ?
+            ''', (thank_message, question_id), fetch=None)
+
+        run_write(_op)
+        read_cache.invalidate([question_id])
         return True
     except Exception as e:
-        print(f"質問解決済み設定エラー: {e}")
+        logger.exception("質問解決済み設定エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # 質問を未解決に戻す
+@instrumented
 def mark_question_unresolved(question_id):
     try:
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        c.execute('''
-            UPDATE questions 
-            SET resolved = 0, best_answer_id = NULL, thank_message = NULL
-            WHERE id = ?
-        ''', (question_id,))
-        conn.commit()
+        run_write(lambda conn: _clear_resolution(conn.cursor(), question_id))
+        read_cache.invalidate([question_id])
         return True
     except Exception as e:
-        print(f"質問未解決設定エラー: {e}")
+        logger.exception("質問未解決設定エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # ベストアンサー設定
+@instrumented
 def set_best_answer(question_id, answer_id):
     try:
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
-        # 既存のベストアンサーをリセット
-        c.execute('''
-            UPDATE answers 
-            SET is_best = 0 
-            WHERE question_id = ?
-        ''', (question_id,))
-        
-        # 新しいベストアンサーを設定
-        c.execute('''
-            UPDATE answers 
-            SET is_best = 1 
-            WHERE id = ?
-        ''', (answer_id,))
-        
-        # 質問にベストアンサーIDを記録
-        c.execute('''
-            UPDATE questions 
-            SET best_answer_id = ? 
-            WHERE id = ?
-        ''', (answer_id, question_id))
-        
-        conn.commit()
+        def _op(conn):
+            c = conn.cursor()
+
+            # 既存のベストアンサーをリセット
+            run_query(c, '''
+                UPDATE answers
+                SET is_best = 0
+                WHERE question_id = ?
+            ''', (question_id,), fetch=None)
+
+            # 新しいベストアンサーを設定
+            run_query(c, '''
+                UPDATE answers
+                SET is_best = 1
+                WHERE id = ?
+            ''', (answer_id,), fetch=None)
+
+            # 質問にベストアンサーIDを記録
+            run_query(c, '''
+                UPDATE questions
+                SET best_answer_id = ?
+                WHERE id = ?
+            ''', (answer_id, question_id), fetch=None)
+
+        run_write(_op)
+        read_cache.invalidate([question_id])
         return True
     except Exception as e:
-        print(f"ベストアンサー設定エラー: {e}")
+        logger.exception("ベストアンサー設定エラー: %s", e)
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-# 質問検索（複数キーワードAND検索）
-def search_questions(keywords):
+# ---- 複数の更新を1トランザクションで行う操作 ----
+# いずれも同じトランザクション内で読み直した (質問, 回答リスト) を返し、失敗時は None を返す
+
+def _read_question_state(c, question_id):
+    question = run_query(record_cursor(c.connection, Question),
+                         QUESTION_DETAIL_SQL + " WHERE q.id = ?", (question_id,), fetch='one')
+    if question is None:
+        raise LookupError(f"質問が見つかりません: {question_id}")
+    return question, _read_answers(c.connection, question_id)
+
+def _clear_resolution(c, question_id):
+    run_query(c, '''
+        UPDATE answers
+        SET is_best = 0
+        WHERE question_id = ? AND is_best != 0
+    ''', (question_id,), fetch=None)
+    run_query(c, '''
+        UPDATE questions
+        SET resolved = 0, best_answer_id = NULL, thank_message = NULL
+        WHERE id = ?
+    ''', (question_id,), fetch=None)
+
+def _delete_answer(c, answer_id):
+    """回答を削除し、ベストアンサーだった場合は質問の参照も外す（質問IDを返す）"""
+    question_id = _answer_question_id(c, answer_id)
+    run_query(c, 'DELETE FROM answers WHERE id = ?', (answer_id,), fetch=None)
+    run_query(c, '''
+        UPDATE questions
+        SET best_answer_id = NULL
+        WHERE id = ? AND best_answer_id = ?
+    ''', (question_id, answer_id), fetch=None)
+    return question_id
+
+# ベストアンサー・お礼メッセージ・解決済みをまとめて設定する
+@instrumented
+def resolve_question(question_id, best_answer_id, thank_message=None):
+    try:
+        def _op(conn):
+            c = conn.cursor()
+            if best_answer_id is not None and run_query(
+                    c, 'SELECT 1 FROM answers WHERE id = ? AND question_id = ?',
+                    (best_answer_id, question_id), fetch='one') is None:
+                raise ValueError(f"回答 {best_answer_id} は質問 {question_id} への回答ではありません")
+
+            # 指定した回答だけをベストアンサーにする（他の回答は外す）
+            run_query(c, '''
+                UPDATE answers
+                SET is_best = (id IS ?)
+                WHERE question_id = ?
+            ''', (best_answer_id, question_id), fetch=None)
+            run_query(c, '''
+                UPDATE questions
+                SET resolved = 1, best_answer_id = ?, thank_message = ?
+                WHERE id = ?
+            ''', (best_answer_id, thank_message, question_id), fetch=None)
+            return _read_question_state(c, question_id)
+
+        state = run_write(_op)
+        read_cache.invalidate([question_id])
+        logger.info("質問を解決済みにしました - 質問ID: %s, ベストアンサー: %s", question_id, best_answer_id)
+        return state
+    except Exception as e:
+        logger.exception("質問解決エラー: %s", e)
+        return None
+
+# 未解決に戻す（ベストアンサーとお礼メッセージも外す）
+@instrumented
+def unresolve_question(question_id):
+    try:
+        def _op(conn):
+            c = conn.cursor()
+            _clear_resolution(c, question_id)
+            return _read_question_state(c, question_id)
+
+        state = run_write(_op)
+        read_cache.invalidate([question_id])
+        return state
+    except Exception as e:
+        logger.exception("質問未解決設定エラー: %s", e)
+        return None
+
+# 回答を削除する（ベストアンサーだった場合は質問の参照も外す）
+@instrumented
+def remove_answer(answer_id):
+    try:
+        def _op(conn):
+            c = conn.cursor()
+            question_id = _delete_answer(c, answer_id)
+            if question_id is None:
+                raise LookupError(f"回答が見つかりません: {answer_id}")
+            return _read_question_state(c, question_id)
+
+        state = run_write(_op)
+        read_cache.invalidate([state[0].id])
+        return state
+    except Exception as e:
+        logger.exception("回答削除エラー: %s", e)
+        return None
+
+# trigramトークナイザでMATCHできる最短の語長（これより短い語はLIKEで絞り込む）
+FTS_MIN_TERM_LENGTH = 3
+
+# 検索結果のハイライト記号（Markdownの太字）
+SNIPPET_OPEN = "**"
+SNIPPET_CLOSE = "**"
+
+def _fts_phrase(keyword):
+    return '"' + keyword.replace('"', '""') + '"'
+
+def _like_pattern(keyword):
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+# 検索結果の並び順: 'relevance' は関連度順（短い語だけの検索は新着順）、'created' は新着順
+SEARCH_SORTS = ('relevance', 'created')
+
+# 検索キーワードからSQLを組み立てる（period は投稿日時の期間 (開始, 終了)、archive ならアーカイブDBの索引も引く）
+def _search_query(keywords, limit, period=None, sort='relevance', archive=False):
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"不明な並び順です: {sort}")
+    long_terms = [k for k in keywords if len(k) >= FTS_MIN_TERM_LENGTH]
+    short_terms = [k for k in keywords if len(k) < FTS_MIN_TERM_LENGTH]
+
+    conditions = []
+    params = []
+    if long_terms:
+        conditions.append('questions_fts MATCH ?')
+        params.append(' AND '.join(_fts_phrase(k) for k in long_terms))
+    # 短い語は列の連結に対するLIKEで絞り込む（長い語があれば候補はMATCHで絞られている）
+    for keyword in short_terms:
+        conditions.append("(f.title || ' ' || f.content || ' ' || f.tags || ' ' || f.answers) LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(keyword))
+    period_where, period_params = period_conditions("q.created_ts", period)
+    conditions.extend(period_where)
+    params.extend(period_params)
+
+    if long_terms:
+        # title, content, tags, answers の重み（bm25は小さいほど関連度が高いので符号を反転する）
+        score = '-bm25(questions_fts, 10.0, 4.0, 6.0, 1.0)'
+        snippet = f"snippet(questions_fts, -1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 24)"
+        order = 'score DESC'
+    else:
+        score = '0.0'
+        snippet = "substr(f.content, 1, 60)"
+        order = 'created_ts DESC, id DESC'
+    if sort == 'created':
+        order = 'created_ts DESC, id DESC'
+
+    # 本体とアーカイブDBはそれぞれの索引で引き、結果の列で並べ替える（bm25 の値は索引ごとの統計による）
+    select = f'''
+        SELECT q.id AS id, q.title, q.content, q.category, q.tags, q.ldap_id,
+               q.created_at, q.created_ts AS created_ts, q.resolved, q.best_answer_id, q.thank_message,
+               COALESCE(u.name, 'Unknown') AS user_name, q.answer_count,
+               {snippet} AS snippet,
+               {score} AS score,
+               {{archived}} AS archived
+        FROM {{schema}}.questions_fts f
+        JOIN {{schema}}.questions q ON q.id = f.rowid
+        JOIN users u ON q.ldap_id = u.ldap_id
+    '''
+    query, params = _fan_out(select, conditions, params, archive)
+    # LIMIT -1 は上限なし
+    query += f" ORDER BY {order} LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return query, params
+
+def _split_keywords(keywords):
+    return [k.strip() for k in keywords.split() if k.strip()]
+
+# 質問検索（複数キーワードAND検索、FTS5 + bm25順、period で投稿日時を絞り込む、既定でアーカイブDBも検索する）
+# レプリカが有効なら最新のスナップショットを検索する（結果は最後のバックアップ時点の内容）
+@instrumented
+def search_questions(keywords, limit=200, period=None, sort='relevance', include_archive=True):
     try:
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
-        
         # キーワードを分割して検索条件を生成
-        keywords = [k.strip() for k in keywords.split() if k.strip()]
+        keywords = _split_keywords(keywords)
         if not keywords:
             return []
-            
-        # 各キーワードを含む質問をAND条件で検索
-        query = '''
-            SELECT q.*, u.name as user_name,
-                   (SELECT COUNT(*) FROM answers a WHERE a.question_id = q.id) as answer_count
-            FROM questions q
-            JOIN users u ON q.ldap_id = u.ldap_id
-            WHERE ''' + ' AND '.join(['(q.title LIKE ? OR q.content LIKE ? OR q.tags LIKE ?)' for _ in keywords])
-        
-        params = []
-        for keyword in keywords:
-            like_term = f'%{keyword}%'
-            params.extend([like_term, like_term, like_term])
-        
-        c.execute(query, params)
-        
+
+        key = ('search_questions', tuple(keywords), limit, tuple(period) if period else None, sort,
+               include_archive)
+        hit, cached, stamp = read_cache.lookup(key)
+        if hit:
+            return cached
+
+        with get_read_connection() as conn:
+            query, params = _search_query(keywords, limit, period, sort, _use_archive(conn, include_archive))
+            questions = run_query(record_cursor(conn, Question), query, params)
+
+        return read_cache.store(key, stamp, questions)
+    except Exception as e:
+        logger.exception("検索エラー: %s", e)
+        return []
+
+# 検索結果を1件ずつ返す（limit=None で上限なし、キャッシュしない）
+@instrumented
+def iter_search_questions(keywords, limit=None, period=None, sort='relevance', include_archive=True):
+    keywords = _split_keywords(keywords)
+    if not keywords:
+        return
+    with get_read_connection(streaming=True) as conn:
+        query, params = _search_query(keywords, limit, period, sort, _use_archive(conn, include_archive))
+        yield from run_query(record_cursor(conn, Question), query, params, fetch='iter')
+
+# 類似質問の候補として表示する最低の類似度（0〜1）
+SIMILAR_MIN_SCORE = 0.15
+
+# 解決済みで絞り込む前に類似度順で取り出す候補数（表示件数に対する倍率）
+SIMILAR_CANDIDATE_FACTOR = 4
+
+def _read_resolved(c, schema, archived, question_ids):
+    placeholders = ','.join('?' * len(question_ids))
+    return run_query(c, f'''
+        SELECT id, title, category, answer_count, created_at, resolved, {archived} AS archived
+        FROM {schema}.questions
+        WHERE id IN ({placeholders}) AND resolved = 1
+    ''', question_ids)
+
+# 入力中のタイトル・本文に似た解決済みの質問（重複投稿の防止用、類似度の高い順）
+@instrumented
+def find_similar_questions(title, content='', limit=5, min_score=SIMILAR_MIN_SCORE):
+    try:
+        text = f"{title or ''}\n{content or ''}"
+        if not text.strip():
+            return []
+        ranked = similarity.find_similar(text, limit * SIMILAR_CANDIDATE_FACTOR, min_score)
+        if not ranked:
+            return []
+
+        # 類似度の索引はアーカイブした質問も含むので、本体に無い質問はアーカイブDBから読む
+        candidate_ids = [qid for qid, _ in ranked]
+        with get_connection() as conn:
+            c = record_cursor(conn, Question)
+            resolved = {q.id: q for q in _read_resolved(c, 'main', 0, candidate_ids)}
+            missing = [qid for qid in candidate_ids if qid not in resolved]
+            if missing and attach_archive(conn):
+                resolved.update((q.id, q) for q in _read_resolved(c, ARCHIVE_SCHEMA, 1, missing))
+
         questions = []
-        for row in c.fetchall():
-            questions.append({
-                'id': row[0],
-                'title': row[1],
-                'content': row[2],
-                'tags': row[3],
-                'ldap_id': row[4],
-                'created_at': row[5],
-                'resolved': row[6],
-                'best_answer_id': row[7],
-                'thank_message': row[8],
-                'user_name': row[9],
-                'answer_count': row[10]
-            })
-        
+        for qid, score in ranked:
+            question = resolved.get(qid)
+            if question is None:
+                continue
+            question.score = score
+            questions.append(question)
+            if len(questions) >= limit:
+                break
         return questions
     except Exception as e:
-        print(f"検索エラー: {e}")
+        logger.exception("類似質問検索エラー: %s", e)
         return []
-    finally:
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+
+# 1回の get_changes_since で返す変更の上限（超えたら reset を返し、一覧を読み直してもらう）
+CHANGE_LIMIT = 500
+
+# 変更履歴を残す日数（prune_changes で消す、環境変数 QA_APP_CHANGE_RETENTION_DAYS で変更可能）
+CHANGE_RETENTION_DAYS = int(os.environ.get('QA_APP_CHANGE_RETENTION_DAYS', '7'))
+
+# このプロセスが読み取りキャッシュに反映済みの変更番号（他プロセスの書き込みを検出する）
+_synced_seq = 0
+_synced_lock = threading.Lock()
+
+def _latest_seq(conn):
+    # 消した番号も含めた最大値（履歴が空でも戻らない）
+    row = run_query(conn.cursor(), "SELECT seq FROM sqlite_sequence WHERE name = 'changes'", fetch='one')
+    return row[0] if row else 0
+
+def _sync_read_cache(changes):
+    """このプロセスがまだ反映していない変更 [(変更番号, 質問ID)] の分だけ読み取りキャッシュを無効にする
+
+    このプロセスの書き込みは書き込み関数が無効化済みなので、主に他のプロセスの書き込みを反映する。
+    質問ID が None の変更があれば全体を消す。
+    """
+    global _synced_seq
+    with _synced_lock:
+        unseen = [qid for seq, qid in changes if seq > _synced_seq]
+        if not unseen:
+            return
+        _synced_seq = max(_synced_seq, changes[-1][0])
+    if None in unseen:
+        read_cache.clear()
+    else:
+        read_cache.invalidate(unseen)
+
+# 最新の変更番号（自動更新のポーリング用、キャッシュしない）
+@instrumented
+def latest_change_seq():
+    try:
+        with get_connection() as conn:
+            return _latest_seq(conn)
+    except Exception as e:
+        logger.exception("変更番号取得エラー: %s", e)
+        return 0
+
+# 変更番号 seq より後の変更（投稿・回答・編集・削除・解決・ベストアンサー）で影響を受けた行
+# 変更履歴の主キーの範囲検索と、変更のあった行だけの取得なので、費用はDBの大きさではなく変更の数で決まる
+@instrumented
+def get_changes_since(seq, limit=CHANGE_LIMIT):
+    try:
+        with get_connection() as conn:
+            rows = run_query(conn.cursor(), '''SELECT seq, entity, op, question_id, answer_id FROM changes
+                                               WHERE seq > ? ORDER BY seq LIMIT ?''', (seq, limit + 1))
+            latest = _latest_seq(conn)
+            # 履歴を消した範囲を含む・DBが作り直された・変更が多すぎる場合は差分にしない
+            oldest = rows[0][0] if rows else latest + 1
+            if seq > latest or oldest > seq + 1 or len(rows) > limit:
+                _sync_read_cache([(latest, None)])
+                return ChangeSet(seq=latest, reset=True)
+
+            question_ids = list(dict.fromkeys(r[3] for r in rows if r[3] is not None))
+            answer_ids = list(dict.fromkeys(r[4] for r in rows if r[1] == 'answer' and r[4] is not None))
+            changes = ChangeSet(seq=rows[-1][0] if rows else seq)
+            if question_ids:
+                placeholders = ",".join("?" * len(question_ids))
+                changes.questions = run_query(record_cursor(conn, Question), f'''
+                    SELECT {_QUESTION_SUMMARY_COLUMNS}
+                    FROM questions q
+                    JOIN users u ON q.ldap_id = u.ldap_id
+                    WHERE q.id IN ({placeholders})
+                ''', question_ids)
+                found = {q.id for q in changes.questions}
+                changes.deleted_question_ids = [qid for qid in question_ids if qid not in found]
+            if answer_ids:
+                placeholders = ",".join("?" * len(answer_ids))
+                changes.answers = run_query(record_cursor(conn, Answer), f'''
+                    SELECT a.id, a.content, a.posted_at, a.updated_at, a.posted_ts, a.updated_ts,
+                           COALESCE(u.name, 'Unknown') AS user_name, a.is_best, a.ldap_id, a.question_id
+                    FROM answers a
+                    JOIN users u ON a.ldap_id = u.ldap_id
+                    WHERE a.id IN ({placeholders})
+                ''', answer_ids)
+                found = {a.id for a in changes.answers}
+                changes.deleted_answer_ids = [aid for aid in answer_ids if aid not in found]
+
+        _sync_read_cache([(r[0], r[3]) for r in rows])
+        return changes
+    except Exception as e:
+        logger.exception("変更取得エラー: %s", e)
+        return ChangeSet(seq=seq, reset=True)
+
+# 古い変更履歴を消す（消した範囲より前の番号を持つ画面は一覧を読み直す）
+@instrumented
+def prune_changes(keep_days=CHANGE_RETENTION_DAYS):
+    try:
+        cutoff = now_stamp()[1] - keep_days * 86400
+
+        def _op(conn):
+            c = conn.cursor()
+            run_query(c, "DELETE FROM changes WHERE changed_ts < ?", (cutoff,), fetch=None)
+            return c.rowcount
+        return run_write(_op)
+    except Exception as e:
+        logger.exception("変更履歴の削除エラー: %s", e)
+        return 0
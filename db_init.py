@@ -1,15 +1,35 @@
+import argparse
+import os
 import sqlite3
+import sys
+import threading
+import db_pool
+from db_pool import get_connection
+from tag_utils import join_tags
+from time_utils import to_epoch
 
-def init_db():
-    conn = sqlite3.connect('qa_app.db')
-    c = conn.cursor()
-    
+# マイグレーション一覧: {バージョン: (説明, 適用関数)}
+# スキーマを変更する場合は、既存のステップを書き換えずに新しい番号のステップを追加する
+MIGRATIONS = {}
+
+
+def migration(version, description):
+    def register(func):
+        if version in MIGRATIONS:
+            raise ValueError(f"マイグレーション番号が重複しています: {version}")
+        MIGRATIONS[version] = (description, func)
+        return func
+    return register
+
+
+@migration(1, "初期スキーマ（users / questions / answers）")
+def _initial_schema(c):
     # ユーザーテーブル
     c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (ldap_id TEXT PRIMARY KEY, 
+                 (ldap_id TEXT PRIMARY KEY,
                   name TEXT NOT NULL,
                   created_at TEXT)''')
-    
+
     # 質問テーブル
     c.execute('''CREATE TABLE IF NOT EXISTS questions
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,7 +43,7 @@ def init_db():
                   best_answer_id INTEGER DEFAULT NULL,
                   thank_message TEXT,
                   FOREIGN KEY(ldap_id) REFERENCES users(ldap_id))''')
-    
+
     # 回答テーブル
     c.execute('''CREATE TABLE IF NOT EXISTS answers
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,11 +55,841 @@ def init_db():
                   is_best INTEGER DEFAULT 0,
                   FOREIGN KEY(question_id) REFERENCES questions(id),
                   FOREIGN KEY(ldap_id) REFERENCES users(ldap_id))''')
-    
-    conn.commit()
-    conn.close()
 
-if __name__ == "__main__":
+
+@migration(2, "全文検索インデックス（FTS5 trigram）と同期トリガー")
+def _search_index(c):
+    # trigramトークナイザは空白で区切られない日本語でも部分一致で検索できる
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts
+                 USING fts5(title, content, tags, answers, tokenize='trigram')''')
+
+    # 回答の集約更新で使う
+    c.execute('CREATE INDEX IF NOT EXISTS idx_answers_question_id ON answers(question_id)')
+
+    # 質問の追加・更新・削除
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_fts_ai AFTER INSERT ON questions BEGIN
+                     INSERT INTO questions_fts(rowid, title, content, tags, answers)
+                     VALUES (new.id, new.title, new.content, COALESCE(new.tags, ''), '');
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_fts_au AFTER UPDATE OF title, content, tags ON questions BEGIN
+                     UPDATE questions_fts
+                     SET title = new.title, content = new.content, tags = COALESCE(new.tags, '')
+                     WHERE rowid = new.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_fts_ad AFTER DELETE ON questions BEGIN
+                     DELETE FROM questions_fts WHERE rowid = old.id;
+                 END''')
+
+    # 回答は質問ごとに連結して1列に保持する
+    answers_of = "(SELECT COALESCE(group_concat(content, ' '), '') FROM answers WHERE question_id = {0})"
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_fts_ai AFTER INSERT ON answers BEGIN
+                      UPDATE questions_fts SET answers = {answers_of.format('new.question_id')}
+                      WHERE rowid = new.question_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_fts_au AFTER UPDATE OF content, question_id ON answers BEGIN
+                      UPDATE questions_fts SET answers = {answers_of.format('old.question_id')}
+                      WHERE rowid = old.question_id;
+                      UPDATE questions_fts SET answers = {answers_of.format('new.question_id')}
+                      WHERE rowid = new.question_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_fts_ad AFTER DELETE ON answers BEGIN
+                      UPDATE questions_fts SET answers = {answers_of.format('old.question_id')}
+                      WHERE rowid = old.question_id;
+                  END''')
+
+    rebuild_search_index(c)
+
+
+# 全文検索インデックスを既存データから作り直す
+def rebuild_search_index(c):
+    c.execute('DELETE FROM questions_fts')
+    c.execute('''INSERT INTO questions_fts(rowid, title, content, tags, answers)
+                 SELECT q.id, q.title, q.content, COALESCE(q.tags, ''),
+                        (SELECT COALESCE(group_concat(a.content, ' '), '')
+                         FROM answers a WHERE a.question_id = q.id)
+                 FROM questions q''')
+    c.execute("INSERT INTO questions_fts(questions_fts) VALUES ('optimize')")
+
+
+# 質問の最終アクティビティ（投稿日時と回答の投稿・更新日時の最大値）
+_LAST_ACTIVITY = '''NULLIF(max(COALESCE({q}.created_at, ''),
+                      COALESCE((SELECT MAX(max(a.posted_at, COALESCE(a.updated_at, a.posted_at)))
+                                FROM answers a WHERE a.question_id = {q}.id), '')), '')'''
+
+
+@migration(3, "質問の回答数・最終アクティビティ列（answer_count / last_activity_at）と集計トリガー")
+def _question_activity(c):
+    c.execute('ALTER TABLE questions ADD COLUMN answer_count INTEGER NOT NULL DEFAULT 0')
+    c.execute('ALTER TABLE questions ADD COLUMN last_activity_at TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_questions_last_activity ON questions(last_activity_at)')
+
+    # 投稿直後の最終アクティビティは投稿日時
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_activity_ai AFTER INSERT ON questions
+                 WHEN new.last_activity_at IS NULL BEGIN
+                     UPDATE questions SET last_activity_at = new.created_at WHERE id = new.id;
+                 END''')
+
+    # 回答の追加・更新は差分で、削除と付け替えは該当質問だけ集計し直す
+    c.execute('''CREATE TRIGGER IF NOT EXISTS answers_activity_ai AFTER INSERT ON answers BEGIN
+                     UPDATE questions
+                     SET answer_count = answer_count + 1,
+                         last_activity_at = NULLIF(max(COALESCE(last_activity_at, ''),
+                                                       COALESCE(new.posted_at, ''),
+                                                       COALESCE(new.updated_at, '')), '')
+                     WHERE id = new.question_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS answers_activity_au AFTER UPDATE OF content, updated_at ON answers
+                 WHEN new.question_id IS old.question_id BEGIN
+                     UPDATE questions
+                     SET last_activity_at = NULLIF(max(COALESCE(last_activity_at, ''),
+                                                       COALESCE(new.updated_at, '')), '')
+                     WHERE id = new.question_id;
+                 END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_activity_move AFTER UPDATE OF question_id ON answers
+                  WHEN new.question_id IS NOT old.question_id BEGIN
+                      UPDATE questions
+                      SET answer_count = answer_count - 1,
+                          last_activity_at = {_LAST_ACTIVITY.format(q='questions')}
+                      WHERE id = old.question_id;
+                      UPDATE questions
+                      SET answer_count = answer_count + 1,
+                          last_activity_at = {_LAST_ACTIVITY.format(q='questions')}
+                      WHERE id = new.question_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_activity_ad AFTER DELETE ON answers BEGIN
+                      UPDATE questions
+                      SET answer_count = answer_count - 1,
+                          last_activity_at = {_LAST_ACTIVITY.format(q='questions')}
+                      WHERE id = old.question_id;
+                  END''')
+
+    recompute_question_activity(c)
+
+
+# 回答数と最終アクティビティを回答テーブルから集計し直す
+def recompute_question_activity(c):
+    c.execute(f'''UPDATE questions
+                  SET answer_count = (SELECT COUNT(*) FROM answers a WHERE a.question_id = questions.id),
+                      last_activity_at = {_LAST_ACTIVITY.format(q='questions')}''')
+
+
+# 集計列と実データの食い違い
+# 戻り値: [(質問ID, 回答数, 実際の回答数, 最終アクティビティ, 実際の最終アクティビティ)]
+def check_question_activity(c, limit=None):
+    sql = '''SELECT q.id, q.answer_count, COALESCE(a.cnt, 0), q.last_activity_at,
+                    NULLIF(max(COALESCE(q.created_at, ''), COALESCE(a.last_at, '')), '') AS expected
+             FROM questions q
+             LEFT JOIN (SELECT question_id, COUNT(*) AS cnt,
+                               MAX(max(posted_at, COALESCE(updated_at, posted_at))) AS last_at
+                        FROM answers GROUP BY question_id) a ON a.question_id = q.id
+             WHERE q.answer_count != COALESCE(a.cnt, 0) OR q.last_activity_at IS NOT expected
+             ORDER BY q.id'''
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return c.execute(sql).fetchall()
+
+
+@migration(4, "一覧・回答スレッド・ユーザー別の二次インデックス")
+def _secondary_indexes(c):
+    # 実行計画は check_query_plans.py で検査する
+    indexes = [
+        # get_questions / get_question_page（絞り込みなしの新着順）
+        ('idx_questions_created', 'questions(created_at)'),
+        # 同（解決状態で絞り込んだ新着順・最近の動き順）
+        ('idx_questions_resolved_created', 'questions(resolved, created_at)'),
+        ('idx_questions_resolved_activity', 'questions(resolved, last_activity_at)'),
+        # ユーザー別の質問・回答
+        ('idx_questions_ldap_id', 'questions(ldap_id)'),
+        ('idx_answers_ldap_id', 'answers(ldap_id)'),
+        # get_answers / get_answers_for_questions / set_best_answer と回答のトリガー
+        ('idx_answers_thread', 'answers(question_id, is_best DESC, posted_at)'),
+    ]
+    for name, definition in indexes:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+    # question_id 単独のインデックスは idx_answers_thread の先頭列で代替できる
+    c.execute('DROP INDEX IF EXISTS idx_answers_question_id')
+
+
+# questions.tags（カンマ区切り）を (タグ, 質問ID) の行に展開するSQL
+# {source} は (質問ID, '', タグ文字列 || ',') を返すSELECT
+_SPLIT_TAGS = """WITH RECURSIVE split(question_id, tag, rest) AS (
+                     {source}
+                     UNION ALL
+                     SELECT question_id, trim(substr(rest, 1, instr(rest, ',') - 1), ' 　'),
+                            substr(rest, instr(rest, ',') + 1)
+                     FROM split WHERE rest != '')
+                 SELECT tag, question_id FROM split WHERE tag != ''"""
+
+
+@migration(5, "タグの正規化テーブル（question_tags / tag_counts）と同期トリガー")
+def _question_tags(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS question_tags
+                 (tag TEXT NOT NULL,
+                  question_id INTEGER NOT NULL,
+                  PRIMARY KEY (tag, question_id),
+                  FOREIGN KEY(question_id) REFERENCES questions(id)) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_question_tags_question ON question_tags(question_id)')
+
+    # タグごとの質問数（タグ一覧・絞り込み用）
+    c.execute('''CREATE TABLE IF NOT EXISTS tag_counts
+                 (tag TEXT PRIMARY KEY,
+                  question_count INTEGER NOT NULL) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tag_counts_count ON tag_counts(question_count DESC, tag)')
+
+    # 質問の追加・タグ変更・削除で question_tags を同期する
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_tags_ai AFTER INSERT ON questions BEGIN
+                      INSERT OR IGNORE INTO question_tags(tag, question_id)
+                      {_SPLIT_TAGS.format(source="SELECT new.id, '', COALESCE(new.tags, '') || ','")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_tags_au AFTER UPDATE OF tags ON questions BEGIN
+                      DELETE FROM question_tags WHERE question_id = old.id;
+                      INSERT OR IGNORE INTO question_tags(tag, question_id)
+                      {_SPLIT_TAGS.format(source="SELECT new.id, '', COALESCE(new.tags, '') || ','")};
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_tags_ad AFTER DELETE ON questions BEGIN
+                     DELETE FROM question_tags WHERE question_id = old.id;
+                 END''')
+
+    # question_tags の増減で tag_counts を更新する
+    c.execute('''CREATE TRIGGER IF NOT EXISTS question_tags_count_ai AFTER INSERT ON question_tags BEGIN
+                     INSERT INTO tag_counts(tag, question_count) VALUES (new.tag, 1)
+                     ON CONFLICT(tag) DO UPDATE SET question_count = question_count + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS question_tags_count_ad AFTER DELETE ON question_tags BEGIN
+                     UPDATE tag_counts SET question_count = question_count - 1 WHERE tag = old.tag;
+                     DELETE FROM tag_counts WHERE tag = old.tag AND question_count <= 0;
+                 END''')
+
+    # 既存のタグ文字列を正規化（全角・半角の統一、空白と重複の除去）してから展開する
+    rows = c.execute("SELECT id, tags FROM questions WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    updates = [(join_tags(tags), question_id) for question_id, tags in rows if join_tags(tags) != tags]
+    c.executemany('UPDATE questions SET tags = ? WHERE id = ?', updates)
+    c.execute(f'''INSERT OR IGNORE INTO question_tags(tag, question_id)
+                  {_SPLIT_TAGS.format(source="SELECT id, '', COALESCE(tags, '') || ',' FROM questions")}''')
+
+
+# question_tags と tag_counts を questions.tags から作り直す（並べ替えキーは questions の現在の値）
+def rebuild_question_tags(c):
+    c.execute('DELETE FROM question_tags')
+    c.execute('DELETE FROM tag_counts')
+    c.execute(f'''INSERT OR IGNORE INTO question_tags({_TAG_KEY_COLUMNS})
+                  {_TAG_ROWS.format(source="SELECT id, '', COALESCE(tags, '') || ',' FROM questions")}''')
+
+
+# tag_counts と question_tags の食い違い
+# 戻り値: [(タグ, 保存値の質問数, 実際の質問数)]
+def check_tag_counts(c, limit=None):
+    sql = '''SELECT tag, SUM(saved), SUM(actual) FROM (
+                 SELECT tag, question_count AS saved, 0 AS actual FROM tag_counts
+                 UNION ALL
+                 SELECT tag, 0, COUNT(*) FROM question_tags GROUP BY tag)
+             GROUP BY tag HAVING SUM(saved) != SUM(actual)
+             ORDER BY tag'''
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return c.execute(sql).fetchall()
+
+
+# user_stats に差分を加算するSQL（{select} は (LDAP ID, カテゴリ, 回答数, ベストアンサー数, 解決済み質問数) を返すSELECT）
+# カテゴリ未設定の質問は '' として集計する
+_UPSERT_USER_STATS = '''INSERT INTO user_stats
+                            (ldap_id, category, answer_count, best_answer_count, resolved_question_count)
+                        {select}
+                        ON CONFLICT(ldap_id, category) DO UPDATE SET
+                            answer_count = answer_count + excluded.answer_count,
+                            best_answer_count = best_answer_count + excluded.best_answer_count,
+                            resolved_question_count = resolved_question_count + excluded.resolved_question_count'''
+
+
+def _answer_stats(row, sign):
+    """回答1件分の差分（回答者・質問のカテゴリ）"""
+    return _UPSERT_USER_STATS.format(select=f'''
+        SELECT {row}.ldap_id, COALESCE(q.category, ''), {sign}1, {sign}(COALESCE({row}.is_best, 0) != 0), 0
+        FROM questions q WHERE q.id = {row}.question_id AND {row}.ldap_id IS NOT NULL''')
+
+
+def _question_answer_stats(row, sign):
+    """質問に付いた回答すべての差分（質問の削除・カテゴリ変更用）"""
+    return _UPSERT_USER_STATS.format(select=f'''
+        SELECT ldap_id, COALESCE({row}.category, ''), {sign}COUNT(*), {sign}SUM(COALESCE(is_best, 0) != 0), 0
+        FROM answers WHERE question_id = {row}.id AND ldap_id IS NOT NULL
+        GROUP BY ldap_id''')
+
+
+def _resolved_stats(row, sign):
+    """解決済みの質問1件分の差分（質問者・質問のカテゴリ）"""
+    return _UPSERT_USER_STATS.format(select=f'''
+        SELECT {row}.ldap_id, COALESCE({row}.category, ''), 0, 0, {sign}1
+        WHERE {row}.ldap_id IS NOT NULL AND COALESCE({row}.resolved, 0) != 0''')
+
+
+# 減算した結果すべて0になった行は消す
+_PRUNE_USER_STATS = '''DELETE FROM user_stats
+                       WHERE ldap_id = {ldap_id}
+                         AND answer_count = 0 AND best_answer_count = 0 AND resolved_question_count = 0'''
+
+
+@migration(6, "ユーザー別・カテゴリ別の集計テーブル（user_stats）と集計トリガー")
+def _user_stats(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS user_stats
+                 (ldap_id TEXT NOT NULL,
+                  category TEXT NOT NULL,
+                  answer_count INTEGER NOT NULL DEFAULT 0,
+                  best_answer_count INTEGER NOT NULL DEFAULT 0,
+                  resolved_question_count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (ldap_id, category)) WITHOUT ROWID''')
+    # get_leaderboard: カテゴリごとに指標の大きい順（ROW_NUMBER の並べ替えをインデックスで済ませる）
+    for column in ('answer_count', 'best_answer_count', 'resolved_question_count'):
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_user_stats_{column}
+                      ON user_stats(category, {column} DESC, ldap_id)''')
+
+    # 回答の追加・削除、ベストアンサーの変更、回答の付け替え
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_stats_ai AFTER INSERT ON answers BEGIN
+                      {_answer_stats('new', '+')};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_stats_au AFTER UPDATE OF is_best, ldap_id, question_id ON answers
+                  WHEN (COALESCE(old.is_best, 0) != 0) IS NOT (COALESCE(new.is_best, 0) != 0)
+                       OR old.ldap_id IS NOT new.ldap_id OR old.question_id IS NOT new.question_id BEGIN
+                      {_answer_stats('old', '-')};
+                      {_answer_stats('new', '+')};
+                      {_PRUNE_USER_STATS.format(ldap_id='old.ldap_id')};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_stats_ad AFTER DELETE ON answers BEGIN
+                      {_answer_stats('old', '-')};
+                      {_PRUNE_USER_STATS.format(ldap_id='old.ldap_id')};
+                  END''')
+
+    # 質問の解決・未解決、質問者やカテゴリの変更、削除
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_stats_ai AFTER INSERT ON questions BEGIN
+                      {_resolved_stats('new', '+')};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_stats_au AFTER UPDATE OF resolved, ldap_id, category ON questions
+                  WHEN (COALESCE(old.resolved, 0) != 0) IS NOT (COALESCE(new.resolved, 0) != 0)
+                       OR old.ldap_id IS NOT new.ldap_id OR old.category IS NOT new.category BEGIN
+                      {_resolved_stats('old', '-')};
+                      {_resolved_stats('new', '+')};
+                      {_PRUNE_USER_STATS.format(ldap_id='old.ldap_id')};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_stats_category AFTER UPDATE OF category ON questions
+                  WHEN old.category IS NOT new.category BEGIN
+                      {_question_answer_stats('old', '-')};
+                      {_question_answer_stats('new', '+')};
+                      DELETE FROM user_stats
+                      WHERE ldap_id IN (SELECT ldap_id FROM answers WHERE question_id = old.id)
+                        AND answer_count = 0 AND best_answer_count = 0 AND resolved_question_count = 0;
+                  END''')
+    # 質問が消えた回答は集計から外す（再集計も質問と結合できる回答だけを数える）
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_stats_ad AFTER DELETE ON questions BEGIN
+                      {_resolved_stats('old', '-')};
+                      {_question_answer_stats('old', '-')};
+                      DELETE FROM user_stats
+                      WHERE (ldap_id = old.ldap_id OR ldap_id IN (SELECT ldap_id FROM answers WHERE question_id = old.id))
+                        AND answer_count = 0 AND best_answer_count = 0 AND resolved_question_count = 0;
+                  END''')
+
+    rebuild_user_stats(c)
+
+
+# user_stats の正しい値（回答・質問テーブルからの集計）
+_USER_STATS_ACTUAL = '''SELECT ldap_id, category, SUM(answers) AS answers, SUM(best) AS best, SUM(resolved) AS resolved
+                        FROM (SELECT a.ldap_id, COALESCE(q.category, '') AS category,
+                                     1 AS answers, COALESCE(a.is_best, 0) != 0 AS best, 0 AS resolved
+                              FROM answers a JOIN questions q ON q.id = a.question_id
+                              WHERE a.ldap_id IS NOT NULL
+                              UNION ALL
+                              SELECT ldap_id, COALESCE(category, ''), 0, 0, 1
+                              FROM questions
+                              WHERE ldap_id IS NOT NULL AND COALESCE(resolved, 0) != 0)
+                        GROUP BY ldap_id, category'''
+
+
+# user_stats の正しい値: 回答・質問テーブルの集計に、アーカイブへ移した質問・回答の分（アーカイブDBの user_stats）を加える
+# （archive.py は移した分を user_stats から引かないので、ランキングは移した後も変わらない）
+def _user_stats_expected(c):
+    if not db_pool.archive_attached(c.connection):
+        return _USER_STATS_ACTUAL
+    return f'''SELECT ldap_id, category, SUM(answers) AS answers, SUM(best) AS best, SUM(resolved) AS resolved
+               FROM ({_USER_STATS_ACTUAL}
+                     UNION ALL
+                     SELECT ldap_id, category, answer_count, best_answer_count, resolved_question_count
+                     FROM {db_pool.ARCHIVE_SCHEMA}.user_stats)
+               GROUP BY ldap_id, category'''
+
+
+# アーカイブDB（schema）へ移した質問と回答の分を user_stats に加え直す
+# 本体から削除したときにトリガーが引いた分を戻すので、ランキングはアーカイブした後も変わらない
+def restore_archived_user_stats(c, schema, question_ids):
+    if not question_ids:
+        return
+    placeholders = ','.join('?' * len(question_ids))
+    c.execute(_UPSERT_USER_STATS.format(select=f'''
+        SELECT ldap_id, category, SUM(answers), SUM(best), SUM(resolved)
+        FROM (SELECT a.ldap_id, COALESCE(q.category, '') AS category,
+                     1 AS answers, COALESCE(a.is_best, 0) != 0 AS best, 0 AS resolved
+              FROM {schema}.answers a JOIN {schema}.questions q ON q.id = a.question_id
+              WHERE q.id IN ({placeholders}) AND a.ldap_id IS NOT NULL
+              UNION ALL
+              SELECT ldap_id, COALESCE(category, ''), 0, 0, 1
+              FROM {schema}.questions
+              WHERE id IN ({placeholders}) AND ldap_id IS NOT NULL AND COALESCE(resolved, 0) != 0)
+        GROUP BY ldap_id, category'''), list(question_ids) * 2)
+
+
+# user_stats を回答・質問テーブル（とアーカイブDB）から作り直す
+def rebuild_user_stats(c):
+    c.execute('DELETE FROM user_stats')
+    c.execute(f'''INSERT INTO user_stats
+                      (ldap_id, category, answer_count, best_answer_count, resolved_question_count)
+                  {_user_stats_expected(c)}''')
+
+
+# user_stats と実データの食い違い
+# 戻り値: [(LDAP ID, カテゴリ, 保存値 (回答数, ベストアンサー数, 解決済み質問数), 実際の値)]
+def check_user_stats(c, limit=None):
+    sql = f'''SELECT ldap_id, category,
+                     SUM(s_answers), SUM(s_best), SUM(s_resolved),
+                     SUM(answers), SUM(best), SUM(resolved)
+              FROM (SELECT ldap_id, category,
+                           answer_count AS s_answers, best_answer_count AS s_best,
+                           resolved_question_count AS s_resolved,
+                           0 AS answers, 0 AS best, 0 AS resolved
+                    FROM user_stats
+                    UNION ALL
+                    SELECT ldap_id, category, 0, 0, 0, answers, best, resolved
+                    FROM ({_user_stats_expected(c)}))
+              GROUP BY ldap_id, category
+              HAVING SUM(s_answers) != SUM(answers) OR SUM(s_best) != SUM(best)
+                  OR SUM(s_resolved) != SUM(resolved)
+              ORDER BY ldap_id, category'''
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return [(row[0], row[1], tuple(row[2:5]), tuple(row[5:8])) for row in c.execute(sql)]
+
+
+# 質問の最終アクティビティ（UNIX時刻）: 投稿日時と回答の投稿・更新日時の最大値
+_LAST_ACTIVITY_TS = '''NULLIF(max(COALESCE({q}.created_ts, 0),
+                         COALESCE((SELECT MAX(max(a.posted_ts, COALESCE(a.updated_ts, a.posted_ts)))
+                                   FROM answers a WHERE a.question_id = {q}.id), 0)), 0)'''
+
+# 整数列が未設定の行を文字列から補うSQL式（トリガー用、タイムゾーンの無い値はローカル時刻とみなす）
+# 旧形式も含めたすべての値の変換は backfill_timestamps（time_utils.to_epoch）で行う
+_EPOCH_OF = "CAST(strftime('%s', {value}, 'utc') AS INTEGER)"
+
+
+def _register_epoch_function(conn):
+    conn.create_function('qa_epoch', 1, to_epoch, deterministic=True)
+
+
+@migration(7, "日時の整数列（created_ts / posted_ts / updated_ts / last_activity_ts）と日付範囲用のインデックス")
+def _epoch_timestamps(c):
+    c.execute('ALTER TABLE users ADD COLUMN created_ts INTEGER')
+    c.execute('ALTER TABLE questions ADD COLUMN created_ts INTEGER')
+    c.execute('ALTER TABLE questions ADD COLUMN last_activity_ts INTEGER')
+    c.execute('ALTER TABLE answers ADD COLUMN posted_ts INTEGER')
+    c.execute('ALTER TABLE answers ADD COLUMN updated_ts INTEGER')
+
+    # 既存行の変換は行ごとのトリガーを動かさないよう、トリガーとインデックスより先に行う
+    backfill_timestamps(c)
+
+    # data_handler は文字列と整数の両方を書き込む。整数を省略した書き込み（手作業のSQLなど）は文字列から補う
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS users_ts_ai AFTER INSERT ON users
+                  WHEN new.created_ts IS NULL AND new.created_at IS NOT NULL BEGIN
+                      UPDATE users SET created_ts = {_EPOCH_OF.format(value='created_at')}
+                      WHERE ldap_id = new.ldap_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_ts_ai AFTER INSERT ON questions
+                  WHEN new.created_ts IS NULL OR new.last_activity_ts IS NULL BEGIN
+                      UPDATE questions
+                      SET created_ts = COALESCE(created_ts, {_EPOCH_OF.format(value='created_at')}),
+                          last_activity_ts = COALESCE(last_activity_ts, created_ts,
+                                                      {_EPOCH_OF.format(value='created_at')})
+                      WHERE id = new.id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_ts_ai AFTER INSERT ON answers
+                  WHEN new.posted_ts IS NULL OR (new.updated_ts IS NULL AND new.updated_at IS NOT NULL) BEGIN
+                      UPDATE answers
+                      SET posted_ts = COALESCE(posted_ts, {_EPOCH_OF.format(value='posted_at')}),
+                          updated_ts = COALESCE(updated_ts, {_EPOCH_OF.format(value='updated_at')})
+                      WHERE id = new.id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_ts_au AFTER UPDATE OF posted_at, updated_at ON answers
+                  WHEN (new.posted_at IS NOT old.posted_at AND new.posted_ts IS old.posted_ts)
+                       OR (new.updated_at IS NOT old.updated_at AND new.updated_ts IS old.updated_ts) BEGIN
+                      UPDATE answers
+                      SET posted_ts = CASE WHEN new.posted_at IS NOT old.posted_at AND new.posted_ts IS old.posted_ts
+                                           THEN {_EPOCH_OF.format(value='new.posted_at')} ELSE posted_ts END,
+                          updated_ts = CASE WHEN new.updated_at IS NOT old.updated_at AND new.updated_ts IS old.updated_ts
+                                            THEN {_EPOCH_OF.format(value='new.updated_at')} ELSE updated_ts END
+                      WHERE id = new.id;
+                  END''')
+
+    # 最終アクティビティ（整数）の集計は migration 3 の文字列版と同じ方針で、追加・更新は差分、削除と付け替えは再集計
+    c.execute('''CREATE TRIGGER IF NOT EXISTS answers_activity_ts_ai AFTER INSERT ON answers BEGIN
+                     UPDATE questions
+                     SET last_activity_ts = NULLIF(max(COALESCE(last_activity_ts, 0),
+                                                       COALESCE(new.posted_ts, 0),
+                                                       COALESCE(new.updated_ts, 0)), 0)
+                     WHERE id = new.question_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS answers_activity_ts_au AFTER UPDATE OF posted_ts, updated_ts ON answers
+                 WHEN new.question_id IS old.question_id BEGIN
+                     UPDATE questions
+                     SET last_activity_ts = NULLIF(max(COALESCE(last_activity_ts, 0),
+                                                       COALESCE(new.posted_ts, 0),
+                                                       COALESCE(new.updated_ts, 0)), 0)
+                     WHERE id = new.question_id;
+                 END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_activity_ts_move AFTER UPDATE OF question_id ON answers
+                  WHEN new.question_id IS NOT old.question_id BEGIN
+                      UPDATE questions
+                      SET last_activity_ts = {_LAST_ACTIVITY_TS.format(q='questions')}
+                      WHERE id IN (old.question_id, new.question_id);
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_activity_ts_ad AFTER DELETE ON answers BEGIN
+                      UPDATE questions
+                      SET last_activity_ts = {_LAST_ACTIVITY_TS.format(q='questions')}
+                      WHERE id = old.question_id;
+                  END''')
+
+    # 並べ替え・期間の絞り込みを文字列から整数の列に移す（文字列の列のインデックスは使われなくなるので消す）
+    for name in ('idx_questions_created', 'idx_questions_resolved_created',
+                 'idx_questions_resolved_activity', 'idx_questions_last_activity', 'idx_answers_thread'):
+        c.execute(f'DROP INDEX IF EXISTS {name}')
+    indexes = [
+        # get_question_page など（新着順・最近の動き順、期間の範囲検索とキーセットのページ送り）
+        ('idx_questions_created_ts', 'questions(created_ts)'),
+        ('idx_questions_activity_ts', 'questions(last_activity_ts)'),
+        ('idx_questions_resolved_created_ts', 'questions(resolved, created_ts)'),
+        ('idx_questions_resolved_activity_ts', 'questions(resolved, last_activity_ts)'),
+        # get_answers / get_answers_for_questions / set_best_answer と回答のトリガー
+        ('idx_answers_thread', 'answers(question_id, is_best DESC, posted_ts)'),
+    ]
+    for name, definition in indexes:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+# すべての日時の整数列を文字列から作り直し、最終アクティビティを集計し直す
+def backfill_timestamps(c):
+    _register_epoch_function(c.connection)
+    c.execute('UPDATE users SET created_ts = qa_epoch(created_at)')
+    c.execute('UPDATE questions SET created_ts = qa_epoch(created_at)')
+    c.execute('UPDATE answers SET posted_ts = qa_epoch(posted_at), updated_ts = qa_epoch(updated_at)')
+    c.execute(f'UPDATE questions SET last_activity_ts = {_LAST_ACTIVITY_TS.format(q="questions")}')
+
+
+# 日時の整数列と文字列・実データの食い違い
+# 戻り値: [(テーブル, 行のキー, 列, 保存値, 正しい値)]
+def check_timestamps(c, limit=None):
+    _register_epoch_function(c.connection)
+    sql = f'''SELECT 'users', ldap_id, 'created_ts', created_ts, qa_epoch(created_at)
+              FROM users WHERE created_ts IS NOT qa_epoch(created_at)
+              UNION ALL
+              SELECT 'questions', id, 'created_ts', created_ts, qa_epoch(created_at)
+              FROM questions WHERE created_ts IS NOT qa_epoch(created_at)
+              UNION ALL
+              SELECT 'answers', id, 'posted_ts', posted_ts, qa_epoch(posted_at)
+              FROM answers WHERE posted_ts IS NOT qa_epoch(posted_at)
+              UNION ALL
+              SELECT 'answers', id, 'updated_ts', updated_ts, qa_epoch(updated_at)
+              FROM answers WHERE updated_ts IS NOT qa_epoch(updated_at)
+              UNION ALL
+              SELECT 'questions', id, 'last_activity_ts', last_activity_ts, expected
+              FROM (SELECT id, last_activity_ts, {_LAST_ACTIVITY_TS.format(q='questions')} AS expected FROM questions)
+              WHERE last_activity_ts IS NOT expected'''
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return c.execute(sql).fetchall()
+
+
+# 変更履歴に1行追加するSQL（{values} は (対象, 操作, 質問ID, 回答ID) を返すSELECT）
+_LOG_CHANGE = '''INSERT INTO changes (entity, op, question_id, answer_id)
+                 {values}'''
+
+
+@migration(8, "変更履歴（changes）と記録トリガー（差分での画面更新用）")
+def _change_log(c):
+    # seq は単調増加（AUTOINCREMENT なので削除した番号も再利用しない）
+    c.execute('''CREATE TABLE IF NOT EXISTS changes
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  entity TEXT NOT NULL,
+                  op TEXT NOT NULL,
+                  question_id INTEGER,
+                  answer_id INTEGER,
+                  changed_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)))''')
+    # prune_changes: 古い履歴の削除
+    c.execute('CREATE INDEX IF NOT EXISTS idx_changes_ts ON changes(changed_ts)')
+
+    # 質問: 投稿・削除と、表示する列の更新（回答数・最終アクティビティの変化は回答の変更として記録される）
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_changes_ai AFTER INSERT ON questions BEGIN
+                      {_LOG_CHANGE.format(values="VALUES ('question', 'insert', new.id, NULL)")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_changes_au
+                  AFTER UPDATE OF title, content, category, tags, ldap_id, resolved, best_answer_id, thank_message
+                  ON questions BEGIN
+                      {_LOG_CHANGE.format(values="VALUES ('question', 'update', new.id, NULL)")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS questions_changes_ad AFTER DELETE ON questions BEGIN
+                      {_LOG_CHANGE.format(values="VALUES ('question', 'delete', old.id, NULL)")};
+                  END''')
+
+    # 回答: 投稿・編集・ベストアンサーの変更・削除（付け替えは移動元の質問にも記録する）
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_changes_ai AFTER INSERT ON answers BEGIN
+                      {_LOG_CHANGE.format(values="VALUES ('answer', 'insert', new.question_id, new.id)")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_changes_au
+                  AFTER UPDATE OF content, updated_at, is_best, ldap_id, question_id ON answers BEGIN
+                      {_LOG_CHANGE.format(values="""SELECT 'answer', 'update', new.question_id, new.id
+                                                    UNION ALL
+                                                    SELECT 'answer', 'update', old.question_id, new.id
+                                                    WHERE old.question_id IS NOT new.question_id""")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS answers_changes_ad AFTER DELETE ON answers BEGIN
+                      {_LOG_CHANGE.format(values="VALUES ('answer', 'delete', old.question_id, old.id)")};
+                  END''')
+
+
+# question_tags に写す並べ替えキー（解決状態は 0 / 1 に揃える）
+_TAG_KEY_COLUMNS = 'tag, question_id, resolved, created_ts, last_activity_ts'
+
+# questions.tags を展開した question_tags の行（並べ替えキーは questions の現在の値を引く）
+# {source} は _SPLIT_TAGS と同じ
+_TAG_ROWS = """SELECT s.tag, s.question_id, CASE WHEN q.resolved THEN 1 ELSE 0 END, q.created_ts, q.last_activity_ts
+               FROM (""" + _SPLIT_TAGS + """) s
+               CROSS JOIN questions q ON q.id = s.question_id"""
+
+
+@migration(9, "question_tags の並べ替えキー（解決状態・投稿日時・最終アクティビティ）とタグ別一覧のインデックス")
+def _question_tag_keys(c):
+    c.execute('ALTER TABLE question_tags ADD COLUMN resolved INTEGER NOT NULL DEFAULT 0')
+    c.execute('ALTER TABLE question_tags ADD COLUMN created_ts INTEGER')
+    c.execute('ALTER TABLE question_tags ADD COLUMN last_activity_ts INTEGER')
+    c.execute('''UPDATE question_tags
+                 SET resolved = CASE WHEN q.resolved THEN 1 ELSE 0 END,
+                     created_ts = q.created_ts,
+                     last_activity_ts = q.last_activity_ts
+                 FROM questions q WHERE q.id = question_tags.question_id''')
+
+    # get_questions_by_tags: タグ・解決状態ごとに並べ替えキーの降順で範囲検索する
+    indexes = [
+        ('idx_question_tags_created', 'question_tags(tag, resolved, created_ts, question_id)'),
+        ('idx_question_tags_activity', 'question_tags(tag, resolved, last_activity_ts, question_id)'),
+    ]
+    for name, definition in indexes:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+    # 行の追加・タグ変更は並べ替えキーごと書き込む
+    # questions_ts_ai が後から整数列を補う場合もあるので、new ではなく questions の現在の値を引く
+    c.execute('DROP TRIGGER IF EXISTS questions_tags_ai')
+    c.execute('DROP TRIGGER IF EXISTS questions_tags_au')
+    c.execute(f'''CREATE TRIGGER questions_tags_ai AFTER INSERT ON questions BEGIN
+                      INSERT OR IGNORE INTO question_tags({_TAG_KEY_COLUMNS})
+                      {_TAG_ROWS.format(source="SELECT new.id, '', COALESCE(new.tags, '') || ','")};
+                  END''')
+    c.execute(f'''CREATE TRIGGER questions_tags_au AFTER UPDATE OF tags ON questions BEGIN
+                      DELETE FROM question_tags WHERE question_id = old.id;
+                      INSERT OR IGNORE INTO question_tags({_TAG_KEY_COLUMNS})
+                      {_TAG_ROWS.format(source="SELECT new.id, '', COALESCE(new.tags, '') || ','")};
+                  END''')
+    # 解決・回答・日時の補完で変わったキーを写す
+    c.execute('''CREATE TRIGGER IF NOT EXISTS questions_tag_keys_au
+                 AFTER UPDATE OF resolved, created_ts, last_activity_ts ON questions
+                 WHEN new.resolved IS NOT old.resolved OR new.created_ts IS NOT old.created_ts
+                      OR new.last_activity_ts IS NOT old.last_activity_ts BEGIN
+                     UPDATE question_tags
+                     SET resolved = CASE WHEN new.resolved THEN 1 ELSE 0 END,
+                         created_ts = new.created_ts,
+                         last_activity_ts = new.last_activity_ts
+                     WHERE question_id = new.id;
+                 END''')
+
+
+# question_tags の並べ替えキーと questions の食い違い
+# 戻り値: [(質問ID, タグ)]
+def check_tag_keys(c, limit=None):
+    sql = '''SELECT t.question_id, t.tag FROM question_tags t
+             JOIN questions q ON q.id = t.question_id
+             WHERE t.resolved IS NOT (CASE WHEN q.resolved THEN 1 ELSE 0 END)
+                OR t.created_ts IS NOT q.created_ts
+                OR t.last_activity_ts IS NOT q.last_activity_ts
+             ORDER BY t.question_id, t.tag'''
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return c.execute(sql).fetchall()
+
+
+def latest_version():
+    return max(MIGRATIONS) if MIGRATIONS else 0
+
+
+# スキーマバージョン取得（PRAGMA user_version）
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# 接続先のデータベースに未適用のマイグレーションを順に適用する
+def upgrade_connection(conn, target=None):
+    target = latest_version() if target is None else target
+    applied = []
+    if get_schema_version(conn) >= target:
+        return applied
+
+    for version in sorted(v for v in MIGRATIONS if v <= target):
+        description, func = MIGRATIONS[version]
+        # 他プロセスと同時に実行しても二重適用しないよう、書き込みロックを取ってから再確認する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            func(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, description))
+    return applied
+
+
+# アーカイブDB（archive.py が作る）を同じスキーマに揃える（アーカイブDBが無ければ何もしない）
+def upgrade_archive(target=None):
+    path = db_pool.get_pool().archive_path
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path, timeout=db_pool.get_pool().timeout)
+    try:
+        return upgrade_connection(conn, target)
+    finally:
+        conn.close()
+
+
+# 未適用のマイグレーションを順に適用する（アーカイブDBがあればそちらにも適用する）
+def upgrade(target=None):
+    with get_connection() as conn:
+        applied = upgrade_connection(conn, target)
+    upgrade_archive(target)
+    return applied
+
+
+# マイグレーションの適用状況
+def status():
+    with get_connection() as conn:
+        current = get_schema_version(conn)
+    pending = [(v, MIGRATIONS[v][0]) for v in sorted(MIGRATIONS) if v > current]
+    return {'current': current, 'latest': latest_version(), 'pending': pending}
+
+
+_checked_paths = set()
+_checked_lock = threading.Lock()
+
+
+# プロセス起動時に一度だけスキーマを最新化する
+def ensure_schema():
+    path = db_pool.get_pool().db_path
+    if path in _checked_paths:
+        return
+    with _checked_lock:
+        if path not in _checked_paths:
+            upgrade()
+            _checked_paths.add(path)
+
+
+def init_db():
+    """互換用: スキーマを最新バージョンまで更新する"""
+    return upgrade()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="QAアプリのデータベース初期化・マイグレーション")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--init", action="store_true", help="データベースを初期化する（--upgrade と同じ）")
+    group.add_argument("--upgrade", action="store_true", help="未適用のマイグレーションを適用する")
+    group.add_argument("--status", action="store_true", help="スキーマバージョンと未適用のマイグレーションを表示する")
+    group.add_argument("--rebuild-search", action="store_true", help="全文検索インデックスを再構築する")
+    group.add_argument("--check", action="store_true", help="集計列（回答数・最終アクティビティ・タグ別質問数・タグの並べ替えキー・ユーザー別集計・日時の整数列）を実データと照合する")
+    group.add_argument("--repair", action="store_true", help="集計列・タグの展開・ユーザー別集計・日時の整数列を再計算する")
+    parser.add_argument("--to", type=int, help="--upgrade で適用する上限バージョン")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db_pool.configure(args.db)
+
+    if args.status:
+        info = status()
+        print(f"現在のスキーマバージョン: {info['current']} / 最新: {info['latest']}")
+        if info['pending']:
+            print("未適用のマイグレーション:")
+            for version, description in info['pending']:
+                print(f"  {version}: {description}")
+        else:
+            print("未適用のマイグレーションはありません")
+        return 0
+
+    if args.rebuild_search:
+        upgrade()
+        with get_connection() as conn:
+            rebuild_search_index(conn.cursor())
+            conn.commit()
+        print("全文検索インデックスを再構築しました")
+        return 0
+
+    if args.check:
+        upgrade()
+        with get_connection() as conn:
+            mismatches = check_question_activity(conn.cursor())
+            tag_mismatches = check_tag_counts(conn.cursor())
+            key_mismatches = check_tag_keys(conn.cursor())
+            user_mismatches = check_user_stats(conn.cursor())
+            ts_mismatches = check_timestamps(conn.cursor())
+        if not mismatches and not tag_mismatches and not key_mismatches and not user_mismatches and not ts_mismatches:
+            print("集計列（回答数・最終アクティビティ・タグ別質問数・タグの並べ替えキー・ユーザー別集計・日時の整数列）は実データと一致しています")
+            return 0
+        if mismatches:
+            print(f"回答数・最終アクティビティの食い違いが {len(mismatches)} 件あります:")
+            for qid, count, actual_count, last_at, actual_last_at in mismatches[:20]:
+                print(f"  質問ID {qid}: 回答数 {count} -> {actual_count}, 最終アクティビティ {last_at} -> {actual_last_at}")
+        if tag_mismatches:
+            print(f"タグ別質問数の食い違いが {len(tag_mismatches)} 件あります:")
+            for tag, count, actual_count in tag_mismatches[:20]:
+                print(f"  {tag}: {count} -> {actual_count}")
+        if key_mismatches:
+            print(f"タグの並べ替えキー（解決状態・投稿日時・最終アクティビティ）の食い違いが {len(key_mismatches)} 件あります:")
+            for qid, tag in key_mismatches[:20]:
+                print(f"  質問ID {qid} / {tag}")
+        if user_mismatches:
+            print(f"ユーザー別集計（回答数・ベストアンサー数・解決済み質問数）の食い違いが {len(user_mismatches)} 件あります:")
+            for ldap_id, category, saved, actual in user_mismatches[:20]:
+                print(f"  {ldap_id} / {category or '(カテゴリなし)'}: {saved} -> {actual}")
+        if ts_mismatches:
+            print(f"日時の整数列の食い違いが {len(ts_mismatches)} 件あります:")
+            for table, key, column, saved, actual in ts_mismatches[:20]:
+                print(f"  {table} {key} の {column}: {saved} -> {actual}")
+        print("--repair で再計算できます")
+        return 1
+
+    if args.repair:
+        upgrade()
+        with get_connection() as conn:
+            recompute_question_activity(conn.cursor())
+            rebuild_question_tags(conn.cursor())
+            rebuild_user_stats(conn.cursor())
+            backfill_timestamps(conn.cursor())
+            conn.commit()
+        print("回答数・最終アクティビティ・タグ・ユーザー別集計・日時の整数列を再計算しました")
+        return 0
+
     print("データベースを初期化します...")
-    init_db()
+    try:
+        applied = upgrade(args.to)
+    except sqlite3.Error as e:
+        print(f"マイグレーションに失敗しました: {e}")
+        return 1
+    for version, description in applied:
+        print(f"  適用: {version}: {description}")
     print("データベースの初期化が完了しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import os
+import sqlite3
+import threading
+import urllib.request
+from contextlib import contextmanager
+
+# データベースファイルのパス（環境変数 QA_APP_DB で変更可能）
+DB_PATH = os.environ.get('QA_APP_DB', 'qa_app.db')
+
+# 古い解決済み質問の移動先（環境変数 QA_APP_ARCHIVE_DB で変更可能、既定はDBファイルの隣の <DB名>.archive.db）
+ARCHIVE_PATH = os.environ.get('QA_APP_ARCHIVE_DB')
+
+# アーカイブDBを ATTACH するスキーマ名
+ARCHIVE_SCHEMA = 'archive'
+
+
+def default_archive_path(db_path):
+    return ARCHIVE_PATH or os.path.splitext(db_path)[0] + '.archive.db'
+
+
+def read_only_uri(path):
+    """読み取り専用で開くURI（sqlite3.connect(..., uri=True) と ATTACH で使う）"""
+    return f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro"
+
+
+def archive_attached(conn):
+    """接続にアーカイブDBが ATTACH されているか"""
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute("PRAGMA database_list"))
+
+
+# 接続ごとに一度だけ適用するPRAGMA
+DEFAULT_PRAGMAS = {
+    # 新しく作るDBだけに効く（既存のDBは maintenance.py --enable-incremental-vacuum で切り替える）
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,      # 約20MB（負値はKiB単位）
+    'mmap_size': 268435456,    # 256MB
+}
+
+
+class ConnectionPool:
+    """スレッドセーフなSQLite接続プール
+
+    接続は使い終わってもクローズせずにプールへ戻し、次の呼び出しや
+    別のStreamlitセッションで再利用する。同じスレッド内で入れ子に
+    取得した場合は、既に保持している接続をそのまま返す。
+    """
+
+    def __init__(self, db_path=None, max_connections=8, pragmas=None, timeout=30.0, archive_path=None,
+                 read_only=False):
+        self.db_path = db_path or DB_PATH
+        self.archive_path = archive_path or default_archive_path(self.db_path)
+        # 読み取り専用のプール（backup.py のスナップショットを読むレプリカ用）
+        self.read_only = read_only
+        self.max_connections = max_connections
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = []          # LIFO: 直近に使った（キャッシュが温まった）接続を優先
+        self._all = []
+        self._local = threading.local()
+        self._closed = False
+
+        self._opened = 0
+        self._reused = 0
+        self._waits = 0
+        self._waiting = 0
+
+    def _open(self):
+        if self.read_only:
+            conn = sqlite3.connect(read_only_uri(self.db_path), timeout=self.timeout, check_same_thread=False,
+                                   uri=True)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+        self.attach_archive(conn)
+        return conn
+
+    def attach_archive(self, conn):
+        """アーカイブDBがあれば接続に ATTACH する（ATTACH 済みか、できたら True）
+
+        アーカイブDBは archive.py が最初の移動で作るので、それより前に開いた接続には読み取りの直前に ATTACH する。
+        """
+        if archive_attached(conn):
+            return True
+        if not os.path.exists(self.archive_path):
+            return False
+        path = read_only_uri(self.archive_path) if self.read_only else self.archive_path
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (path,))
+        return True
+
+    def dedicated_connection(self):
+        """プールの外で使う専用の接続（同じPRAGMAを適用済み、クローズは呼び出し側で行う）"""
+        return self._open()
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("接続プールは既にクローズされています")
+                if self._idle:
+                    self._reused += 1
+                    return self._idle.pop()
+                if len(self._all) < self.max_connections:
+                    # プール上限の枠を先に確保してからロック外で接続する
+                    self._all.append(None)
+                    break
+                self._waits += 1
+                self._waiting += 1
+                try:
+                    if not self._cond.wait(self.timeout):
+                        raise sqlite3.OperationalError("接続プールの待機がタイムアウトしました")
+                finally:
+                    self._waiting -= 1
+
+        try:
+            conn = self._open()
+        except Exception:
+            with self._cond:
+                self._all.remove(None)
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._all[self._all.index(None)] = conn
+            self._opened += 1
+        return conn
+
+    def _release(self, conn):
+        # 未確定のトランザクションを残したまま他の呼び出しに渡さない
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn):
+        with self._cond:
+            if conn in self._all:
+                self._all.remove(conn)
+            self._cond.notify()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """接続を借りて返すコンテキストマネージャ
+
+        同じスレッドで入れ子に借りた場合は同じ接続を返し、最後に抜けた側がプールへ戻す
+        （最初に借りた側が先に抜けても、使用中の接続は戻さない）。
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._acquire()
+            self._local.conn = conn
+            self._local.depth = 0
+        self._local.depth += 1
+        try:
+            yield conn
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self._local.conn = None
+                self._release(conn)
+
+    @contextmanager
+    def streaming_connection(self):
+        """逐次取得（ジェネレーター）用に接続を借りる
+
+        スレッドごとの接続としては登録しないので、ジェネレーターが止まっている間に同じスレッドで
+        connection() を使っても別の接続になり、ジェネレーターが閉じられる（別のスレッドのGCを含む）ときに
+        使用中の接続を戻してしまうことがない。
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def stats(self):
+        """接続数・再利用数・待機数を返す"""
+        with self._cond:
+            return {
+                'db_path': self.db_path,
+                'archive_path': self.archive_path,
+                'read_only': self.read_only,
+                'max_connections': self.max_connections,
+                'open': len([c for c in self._all if c is not None]),
+                'idle': len(self._idle),
+                'in_use': len(self._all) - len(self._idle),
+                'opened': self._opened,
+                'reused': self._reused,
+                'waits': self._waits,
+                'waiting': self._waiting,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                self._all.remove(conn)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(db_path=None, **kwargs):
+    """プロセス共通のプールを作り直す（DBパスやPRAGMAの変更用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(db_path, **kwargs)
+        return _pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def attach_archive(conn):
+    """共通プールのアーカイブDBを接続に ATTACH する（アーカイブDBが無ければ False）
+
+    読み取り専用の接続（レプリカ）にはスナップショットのアーカイブDBだけを使い、本体のものは ATTACH しない。
+    """
+    if archive_attached(conn):
+        return True
+    if conn.execute("PRAGMA query_only").fetchone()[0]:
+        return False
+    return get_pool().attach_archive(conn)
+
+
+def get_connection():
+    """共通プールから接続を借りる: with get_connection() as conn: ..."""
+    return get_pool().connection()
+
+
+def get_streaming_connection():
+    """共通プールから逐次取得用の接続を借りる（ジェネレーターの中で使う）"""
+    return get_pool().streaming_connection()
+
+
+def pool_stats():
+    return get_pool().stats()
@@ -1,87 +1,333 @@
+import argparse
+import random
 import sqlite3
+import sys
+import time
 from datetime import datetime, timedelta
+import db_pool
 from db_init import init_db
+from db_pool import get_connection
+from time_utils import TIMESTAMP_FORMAT, now_stamp
 
 def generate_dummy_data():
     """Generate dummy plant engineering QA data"""
     try:
         init_db()
-        conn = sqlite3.connect('qa_app.db')
-        c = conn.cursor()
+        with get_connection() as conn:
+            c = conn.cursor()
         
-        # Clear existing data
-        c.execute('DELETE FROM answers')
-        c.execute('DELETE FROM questions')
-        c.execute('DELETE FROM users')
+            # Clear existing data
+            c.execute('DELETE FROM answers')
+            c.execute('DELETE FROM questions')
+            c.execute('DELETE FROM users')
         
-        # ユーザーデータ (5人)
-        users = [
-            ('10000001', '田中 技術士', datetime.now()),
-            ('10000002', '佐藤 主任', datetime.now()),
-            ('10000003', '鈴木 ベテラン', datetime.now()),
-            ('10000004', '山本 設計士', datetime.now()),
-            ('10000005', '高橋 エンジニア', datetime.now()),
-            ('10000006', '伊藤 新人', datetime.now()),
-            ('10000007', '渡辺 技師長', datetime.now()),
-            ('10000008', '中村 コンサルタント', datetime.now()),
-            ('10000009', '小林 プロマネ', datetime.now()),
-            ('10000010', '加藤 現場監督', datetime.now()),
-            ('12345678', '山本', datetime.now())
-        ]
-        c.executemany('INSERT OR IGNORE INTO users VALUES (?, ?, ?)', users)
+            # ユーザーデータ (5人)
+            users = [
+                ('10000001', '田中 技術士', _fmt(datetime.now())),
+                ('10000002', '佐藤 主任', _fmt(datetime.now())),
+                ('10000003', '鈴木 ベテラン', _fmt(datetime.now())),
+                ('10000004', '山本 設計士', _fmt(datetime.now())),
+                ('10000005', '高橋 エンジニア', _fmt(datetime.now())),
+                ('10000006', '伊藤 新人', _fmt(datetime.now())),
+                ('10000007', '渡辺 技師長', _fmt(datetime.now())),
+                ('10000008', '中村 コンサルタント', _fmt(datetime.now())),
+                ('10000009', '小林 プロマネ', _fmt(datetime.now())),
+                ('10000010', '加藤 現場監督', _fmt(datetime.now())),
+                ('12345678', '山本', _fmt(datetime.now()))
+            ]
+            c.executemany('INSERT OR IGNORE INTO users (ldap_id, name, created_at) VALUES (?, ?, ?)', users)
         
-        # 質問データ (10件)
-        questions = [
-            (10000001, 'コンベヤ設計のポイント', 'コンベヤの設計で、ベルトの張力計算や荷重の均等分散をどう評価すればよいか悩んでいます。特に、稼働中の振動や偏摩耗を抑えるための設計対策は何でしょうか？', '設計,コンベヤ,振動', '2024-01-10'),
-            (10000002, '除塵機の設置と空気流量計算', '除塵機の設置にあたって、対象エリアの粉塵発生量を見積もるとともに、最適な空気流量を確保するための設計ポイントは何でしょうか？', '除塵機,空気流量,設計', '2024-01-15'),
-            (10000003, 'フライト式汚泥かき寄せ機の設計最適化', 'フライト式汚泥かき寄せ機を設置する際、かき寄せ効率を最大化するために、フライトの角度やピッチ、使用材料の選定など、どのパラメータに注力すれば良いでしょうか？', '汚泥,かき寄せ機,設計', '2024-01-20'),
-            (10000004, '高温高圧配管の熱膨張対策', '高温高圧条件下での配管設計で、熱膨張や応力集中を防ぐために、どのような設計上の対策を講じればよいのでしょうか？', '配管,熱膨張,設計', '2024-02-05'),
-            (10000005, '点検架台（作業プラットフォーム）の安全設計', '点検架台の設計で、作業者が安全かつ効率的に点検作業できるよう、荷重計算や安全装置の配置など、どのような点に留意すべきでしょうか？', '点検架台,安全設計,荷重', '2024-02-10'),
-            (10000006, '大型機械用基礎工事の振動吸収設計', '大型設備の設置に伴う基礎工事で、地盤との一体化を図るとともに、振動や衝撃を吸収するための具体的な設計手法は何でしょうか？', '基礎工事,振動,設計', '2024-02-15'),
-            (10000007, '防食塗装施工管理の工程と品質チェック', '防食塗装の工程管理において、表面前処理や塗膜の厚さ管理、環境条件の管理はどのように行えば良いのでしょうか？', '防食塗装,品質管理,施工', '2024-03-01'),
-            (10000008, '複数設備間の連携と施工調整', 'コンベヤ、除塵機、配管など異なる設備間の設計連携が必要なプロジェクトで、各設備のインターフェース設計やレイアウト調整はどのように統一して進めるべきでしょうか？', '設計連携,施工調整,インターフェース', '2024-03-05'),
-            (10000009, '施工スケジュールと品質管理の統合運用', '基礎工事、防食塗装、配管工事など複数の工事が同時進行する現場では、施工スケジュールと品質管理をどう一元管理すれば、工程間のトラブルを未然に防げるでしょうか？', 'スケジュール管理,品質管理,施工', '2024-03-10'),
-            (10000010, '設計変更時の再調整と記録管理', '設計変更が生じた場合、特に除塵機と配管、あるいは基礎部との連携部分において、再設計や現場調整が必要となります。現場では、こうした変更をどのように記録し、管理しているのでしょうか？', '設計変更,記録管理,施工', '2024-03-15')
-        ]
-        c.executemany('''
-            INSERT INTO questions (ldap_id, title, content, tags, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', questions)
+            # 質問データ (10件)
+            questions = [
+                (10000001, 'コンベヤ設計のポイント', 'コンベヤの設計で、ベルトの張力計算や荷重の均等分散をどう評価すればよいか悩んでいます。特に、稼働中の振動や偏摩耗を抑えるための設計対策は何でしょうか？', '設計,コンベヤ,振動', '2024-01-10'),
+                (10000002, '除塵機の設置と空気流量計算', '除塵機の設置にあたって、対象エリアの粉塵発生量を見積もるとともに、最適な空気流量を確保するための設計ポイントは何でしょうか？', '除塵機,空気流量,設計', '2024-01-15'),
+                (10000003, 'フライト式汚泥かき寄せ機の設計最適化', 'フライト式汚泥かき寄せ機を設置する際、かき寄せ効率を最大化するために、フライトの角度やピッチ、使用材料の選定など、どのパラメータに注力すれば良いでしょうか？', '汚泥,かき寄せ機,設計', '2024-01-20'),
+                (10000004, '高温高圧配管の熱膨張対策', '高温高圧条件下での配管設計で、熱膨張や応力集中を防ぐために、どのような設計上の対策を講じればよいのでしょうか？', '配管,熱膨張,設計', '2024-02-05'),
+                (10000005, '点検架台（作業プラットフォーム）の安全設計', '点検架台の設計で、作業者が安全かつ効率的に点検作業できるよう、荷重計算や安全装置の配置など、どのような点に留意すべきでしょうか？', '点検架台,安全設計,荷重', '2024-02-10'),
+                (10000006, '大型機械用基礎工事の振動吸収設計', '大型設備の設置に伴う基礎工事で、地盤との一体化を図るとともに、振動や衝撃を吸収するための具体的な設計手法は何でしょうか？', '基礎工事,振動,設計', '2024-02-15'),
+                (10000007, '防食塗装施工管理の工程と品質チェック', '防食塗装の工程管理において、表面前処理や塗膜の厚さ管理、環境条件の管理はどのように行えば良いのでしょうか？', '防食塗装,品質管理,施工', '2024-03-01'),
+                (10000008, '複数設備間の連携と施工調整', 'コンベヤ、除塵機、配管など異なる設備間の設計連携が必要なプロジェクトで、各設備のインターフェース設計やレイアウト調整はどのように統一して進めるべきでしょうか？', '設計連携,施工調整,インターフェース', '2024-03-05'),
+                (10000009, '施工スケジュールと品質管理の統合運用', '基礎工事、防食塗装、配管工事など複数の工事が同時進行する現場では、施工スケジュールと品質管理をどう一元管理すれば、工程間のトラブルを未然に防げるでしょうか？', 'スケジュール管理,品質管理,施工', '2024-03-10'),
+                (10000010, '設計変更時の再調整と記録管理', '設計変更が生じた場合、特に除塵機と配管、あるいは基礎部との連携部分において、再設計や現場調整が必要となります。現場では、こうした変更をどのように記録し、管理しているのでしょうか？', '設計変更,記録管理,施工', '2024-03-15')
+            ]
+            c.executemany('''
+                INSERT INTO questions (ldap_id, title, content, tags, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', questions)
         
-        # 回答データ (各質問に1-3回答)
-        answers = [
-            (1, 10000003, 'まず、搬送物の重量や流量、ベルトの材質に基づき、メーカー提供の計算式で適正な張力を求めます。設計段階では、ローラーの配置や支持部材の強度計算を十分に行い、振動解析も実施してください。実運転後は、振動センサでデータを取得し、必要に応じたアジャストメントを行う体制を整えると良いです。', '2024-01-12', '2024-01-12'),
-            (2, 10000004, 'まず、現場ごとの粉塵発生特性をヒアリングや実測データで把握し、必要な処理能力を算出します。次に、フィルターの捕集効率とダクト内の圧力損失を考慮して、使用するファンの能力を見積もります。CADと流体解析ソフトでシミュレーションを行い、各部のチューニングを実施することが成功の鍵です。', '2024-01-17', '2024-01-17'),
-            (3, 10000002, 'まず、現場の汚泥の物性（粘度や含水率）をしっかり把握します。その上で、フライトの角度は汚泥が詰まりにくい斜め方向（一般的には30～45度程度）が多く採用されます。ピッチや刃の形状は、試作やシミュレーションで最適値を見つけ、摩耗に強い材質を選択することがポイントです。現場試験で微調整を繰り返すと良いでしょう。', '2024-01-22', '2024-01-22'),
-            (4, 10000001, '配管ルートには必ず膨張ループやフレックスジョイントを取り入れ、熱変形を吸収できる設計とします。また、各部品の素材選定も重要で、温度変化による膨張係数の違いを考慮してください。CAE解析を用いて応力分布をシミュレーションし、局所的な集中を防止する支持金具の配置を行うことが基本です。', '2024-02-07', '2024-02-07'),
-            (5, 10000005, '作業者だけではなく、工具や器材も含めた最大荷重を試算し、耐荷重性を確認することが重要です。手すり、足場、滑り止めなどの安全対策は現地の安全基準に準拠します。さらに、非常時の退避経路や定期点検による構造健全性のチェックを計画に含めるようにしましょう。', '2024-02-12', '2024-02-12'),
-            (6, 10000007, 'まず、地盤調査を徹底し、適切な基礎形式（布基礎、杭基礎など）を選定します。さらに、振動吸収のために、鋼板スラブの下にゴム材や特殊クッション材を挟む設計を検討するのが一般的です。実際の設計では、動的解析を行い、振動モードや衝撃伝播を予測し、再現実験を経て設計を確定します。', '2024-02-17', '2024-02-17'),
-            (7, 10000008, 'まず、サンドブラストなどで既存の錆や汚染物質を徹底的に除去し、適切な下地処理を行います。次に、各層ごとに規定の塗装厚を維持するため、測厚器などで現場検査を実施します。また、施工中の温度、湿度、風速を常にモニタリングし、塗装条件が基準を満たしているか確認する体制を整え、検査記録を詳細に残すことが大切です。', '2024-03-03', '2024-03-03'),
-            (8, 10000009, '各設備の設計図面を統一フォーマットに落とし込み、共通のインターフェース基準を設けることが第一歩です。各専門部門間での合同レビューや、3Dモデリングによる干渉チェックが不可欠です。また、プロジェクトマネージャーの下で定期ミーティングを開催し、実際の現場状況を反映した設計変更や調整を迅速に行える体制を構築することが求められます。', '2024-03-07', '2024-03-07'),
-            (9, 10000010, 'まずは各工程の詳細な作業計画と品質チェックリストを作成し，全体のタイムラインを統合した進捗管理システムを導入します。各工程の責任者が定期的に現場検査を行い，進捗報告を共有することで，問題の早期発見と迅速な対応が可能となります。また，各工程間のインターフェース部分は，専門の監督者を置き，情報の共有と連携を強化することが重要です。', '2024-03-12', '2024-03-12'),
-            (10, 10000006, '設計変更は，まず正式な変更依頼書や影響分析レポートを作成し，関係部署と協議の上で承認を得ます。その後，図面や仕様書はバージョン管理システムに登録し，変更箇所に対するマーキングやコメントを残します。さらに，施工前にプレコンストラクションミーティングを実施し，変更内容とその影響を全体で共有することが必須です。これにより，現場での再調整がスムーズに行えるようになります。', '2024-03-17', '2024-03-17'),
-            (1, 10000007, '追加のアドバイスとして，コンベヤの定期的なメンテナンス計画も設計段階で考慮に入れておくことをお勧めします。特に，ベアリングの潤滑管理やベルトの張力調整は，長期的な安定稼働に不可欠です。', '2024-01-18', '2024-01-18'),
-            (2, 10000003, '粉塵の性質によっては，静電気対策も重要です。導電性素材の使用や接地設計を検討してください。', '2024-01-25', '2024-01-25'),
-            (3, 10000005, 'フライトの摩耗対策としては，表面に硬質クロメート処理を施すか，セラミックライニングを検討すると良いでしょう。', '2024-02-02', '2024-02-02')
-        ]
-        c.executemany('''
-            INSERT INTO answers (question_id, ldap_id, content, posted_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', answers)
+            # 回答データ (各質問に1-3回答)
+            answers = [
+                (1, 10000003, 'まず、搬送物の重量や流量、ベルトの材質に基づき、メーカー提供の計算式で適正な張力を求めます。設計段階では、ローラーの配置や支持部材の強度計算を十分に行い、振動解析も実施してください。実運転後は、振動センサでデータを取得し、必要に応じたアジャストメントを行う体制を整えると良いです。', '2024-01-12', '2024-01-12'),
+                (2, 10000004, 'まず、現場ごとの粉塵発生特性をヒアリングや実測データで把握し、必要な処理能力を算出します。次に、フィルターの捕集効率とダクト内の圧力損失を考慮して、使用するファンの能力を見積もります。CADと流体解析ソフトでシミュレーションを行い、各部のチューニングを実施することが成功の鍵です。', '2024-01-17', '2024-01-17'),
+                (3, 10000002, 'まず、現場の汚泥の物性（粘度や含水率）をしっかり把握します。その上で、フライトの角度は汚泥が詰まりにくい斜め方向（一般的には30～45度程度）が多く採用されます。ピッチや刃の形状は、試作やシミュレーションで最適値を見つけ、摩耗に強い材質を選択することがポイントです。現場試験で微調整を繰り返すと良いでしょう。', '2024-01-22', '2024-01-22'),
+                (4, 10000001, '配管ルートには必ず膨張ループやフレックスジョイントを取り入れ、熱変形を吸収できる設計とします。また、各部品の素材選定も重要で、温度変化による膨張係数の違いを考慮してください。CAE解析を用いて応力分布をシミュレーションし、局所的な集中を防止する支持金具の配置を行うことが基本です。', '2024-02-07', '2024-02-07'),
+                (5, 10000005, '作業者だけではなく、工具や器材も含めた最大荷重を試算し、耐荷重性を確認することが重要です。手すり、足場、滑り止めなどの安全対策は現地の安全基準に準拠します。さらに、非常時の退避経路や定期点検による構造健全性のチェックを計画に含めるようにしましょう。', '2024-02-12', '2024-02-12'),
+                (6, 10000007, 'まず、地盤調査を徹底し、適切な基礎形式（布基礎、杭基礎など）を選定します。さらに、振動吸収のために、鋼板スラブの下にゴム材や特殊クッション材を挟む設計を検討するのが一般的です。実際の設計では、動的解析を行い、振動モードや衝撃伝播を予測し、再現実験を経て設計を確定します。', '2024-02-17', '2024-02-17'),
+                (7, 10000008, 'まず、サンドブラストなどで既存の錆や汚染物質を徹底的に除去し、適切な下地処理を行います。次に、各層ごとに規定の塗装厚を維持するため、測厚器などで現場検査を実施します。また、施工中の温度、湿度、風速を常にモニタリングし、塗装条件が基準を満たしているか確認する体制を整え、検査記録を詳細に残すことが大切です。', '2024-03-03', '2024-03-03'),
+                (8, 10000009, '各設備の設計図面を統一フォーマットに落とし込み、共通のインターフェース基準を設けることが第一歩です。各専門部門間での合同レビューや、3Dモデリングによる干渉チェックが不可欠です。また、プロジェクトマネージャーの下で定期ミーティングを開催し、実際の現場状況を反映した設計変更や調整を迅速に行える体制を構築することが求められます。', '2024-03-07', '2024-03-07'),
+                (9, 10000010, 'まずは各工程の詳細な作業計画と品質チェックリストを作成し，全体のタイムラインを統合した進捗管理システムを導入します。各工程の責任者が定期的に現場検査を行い，進捗報告を共有することで，問題の早期発見と迅速な対応が可能となります。また，各工程間のインターフェース部分は，専門の監督者を置き，情報の共有と連携を強化することが重要です。', '2024-03-12', '2024-03-12'),
+                (10, 10000006, '設計変更は，まず正式な変更依頼書や影響分析レポートを作成し，関係部署と協議の上で承認を得ます。その後，図面や仕様書はバージョン管理システムに登録し，変更箇所に対するマーキングやコメントを残します。さらに，施工前にプレコンストラクションミーティングを実施し，変更内容とその影響を全体で共有することが必須です。これにより，現場での再調整がスムーズに行えるようになります。', '2024-03-17', '2024-03-17'),
+                (1, 10000007, '追加のアドバイスとして，コンベヤの定期的なメンテナンス計画も設計段階で考慮に入れておくことをお勧めします。特に，ベアリングの潤滑管理やベルトの張力調整は，長期的な安定稼働に不可欠です。', '2024-01-18', '2024-01-18'),
+                (2, 10000003, '粉塵の性質によっては，静電気対策も重要です。導電性素材の使用や接地設計を検討してください。', '2024-01-25', '2024-01-25'),
+                (3, 10000005, 'フライトの摩耗対策としては，表面に硬質クロメート処理を施すか，セラミックライニングを検討すると良いでしょう。', '2024-02-02', '2024-02-02')
+            ]
+            c.executemany('''
+                INSERT INTO answers (question_id, ldap_id, content, posted_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', answers)
         
-        conn.commit()
+            conn.commit()
         print("ダミーデータ生成完了")
         return True
     except Exception as e:
         print(f"ダミーデータ生成エラー: {e}")
         return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-if __name__ == "__main__":
+
+# ---- 大量データ生成（性能試験用） ----
+
+CATEGORIES = ["水処理技術", "機械（設計、調達、試運転、メンテ）", "電気（設計、調達、メンテ）",
+              "土木建築（設計、構造、施工）", "現場管理", "プロジェクト管理", "その他"]
+
+EQUIPMENT = ["コンベヤ", "除塵機", "配管", "ポンプ", "汚泥かき寄せ機", "ブロワ", "沈殿池", "ろ過機",
+             "脱水機", "受変電設備", "制御盤", "点検架台", "基礎", "バルブ", "散気装置", "薬注設備",
+             "スクリーン", "クレーン", "計装機器", "ダクト"]
+ISSUES = ["振動", "腐食", "摩耗", "異音", "漏水", "詰まり", "温度上昇", "騒音", "劣化", "芯ずれ",
+          "圧力損失", "結露", "過負荷", "キャビテーション", "塗装剥離"]
+PHASES = ["設計", "調達", "施工", "試運転", "保守点検", "更新計画", "安全管理", "品質管理"]
+MEASURES = ["定期点検の頻度を見直す", "材質を耐食性の高いものに変更する", "支持金具の配置を再検討する",
+            "メーカーと仕様を再確認する", "現場で実測データを取得する", "予備品を確保しておく",
+            "CAE解析で応力分布を確認する", "施工要領書に確認項目を追加する", "運転記録を傾向管理する",
+            "試運転時に負荷試験を実施する"]
+
+SURNAMES = ["田中", "佐藤", "鈴木", "高橋", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+            "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "斎藤", "清水"]
+ROLES = ["技術士", "主任", "ベテラン", "設計士", "エンジニア", "新人", "技師長", "コンサルタント",
+         "プロマネ", "現場監督"]
+
+TITLE_TEMPLATES = [
+    "{equipment}の{issue}対策について",
+    "{equipment}{phase}時の{issue}の評価方法",
+    "{equipment}の{phase}で注意すべき点",
+    "{equipment}と{equipment2}の取り合い部の{issue}",
+    "{phase}段階での{equipment}の{issue}予防",
+]
+CONTENT_TEMPLATES = [
+    "{equipment}の{phase}において、{issue}が発生しています。",
+    "現場では{equipment2}との取り合い部で特に{issue}が目立ちます。",
+    "過去の事例では{measure}ことで改善したと聞いていますが、今回も有効でしょうか？",
+    "設計条件や運転条件のどの項目を優先して確認すべきか教えてください。",
+    "同様の経験がある方がいれば、{phase}での具体的な対応を共有いただけると助かります。",
+]
+ANSWER_TEMPLATES = [
+    "まず{issue}の原因を切り分けるために、{measure}ことをお勧めします。",
+    "{equipment}の場合、{phase}の段階で{issue}を想定しておくことが重要です。",
+    "当社の現場では{measure}ことで{issue}が大幅に減りました。",
+    "{equipment2}側の条件も影響するので、両方の図面を突き合わせて確認してください。",
+    "記録を残しておくと、次回の{phase}で同じ{issue}を防げます。",
+]
+THANK_MESSAGE = "ありがとうございました。参考になりました。"
+
+
+def _cum_weights(n, exponent=1.1):
+    """Zipf風の偏った累積重み（先頭ほど出現しやすい）"""
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / (rank ** exponent)
+        cum.append(total)
+    return cum
+
+
+class _TextFactory:
+    def __init__(self, rng):
+        self.rng = rng
+        self._equipment = _cum_weights(len(EQUIPMENT))
+        self._issues = _cum_weights(len(ISSUES))
+        self._phases = _cum_weights(len(PHASES), 0.8)
+        self._categories = _cum_weights(len(CATEGORIES), 0.9)
+
+    def _fields(self):
+        rng = self.rng
+        equipment, equipment2 = rng.choices(EQUIPMENT, cum_weights=self._equipment, k=2)
+        return {
+            'equipment': equipment,
+            'equipment2': equipment2,
+            'issue': rng.choices(ISSUES, cum_weights=self._issues)[0],
+            'phase': rng.choices(PHASES, cum_weights=self._phases)[0],
+            'measure': rng.choice(MEASURES),
+        }
+
+    def question(self):
+        rng = self.rng
+        fields = self._fields()
+        title = rng.choice(TITLE_TEMPLATES).format(**fields)
+        sentences = rng.sample(CONTENT_TEMPLATES, rng.randint(2, len(CONTENT_TEMPLATES)))
+        content = "".join(t.format(**fields) for t in sentences)
+        tags = list(dict.fromkeys([fields['equipment'], fields['issue'], fields['phase'], fields['equipment2']]))
+        category = rng.choices(CATEGORIES, cum_weights=self._categories)[0]
+        return title, content, category, ",".join(tags[:rng.randint(2, 4)])
+
+    def answer(self):
+        fields = self._fields()
+        sentences = self.rng.sample(ANSWER_TEMPLATES, self.rng.randint(1, 3))
+        return "".join(t.format(**fields) for t in sentences)
+
+
+def _next_id(c, table):
+    # AUTOINCREMENTの採番と衝突しないよう、sqlite_sequence と MAX(id) の大きい方から続ける
+    c.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    max_id = c.fetchone()[0]
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = ?", (table,))
+    return max(max_id, c.fetchone()[0]) + 1
+
+
+def _fmt(dt):
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+def _flush(conn, c, question_rows, answer_rows):
+    # 日時の整数列も渡し、文字列から補うトリガーを行ごとに動かさない
+    c.executemany('''INSERT INTO questions
+                     (id, title, content, category, tags, ldap_id, created_at, created_ts, last_activity_ts,
+                      resolved, best_answer_id, thank_message)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', question_rows)
+    c.executemany('''INSERT INTO answers
+                     (id, question_id, content, ldap_id, posted_at, updated_at, posted_ts, updated_ts, is_best)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', answer_rows)
+    conn.commit()
+
+
+def generate_synthetic_data(num_users=100, num_questions=1000, answers_per_question=3, seed=None,
+                            days=3 * 365, chunk_size=5000, truncate=False, progress=True, now=None):
+    """性能試験用の大量データを生成する
+
+    既定では既存データに追記する。質問と回答はチャンクごとに executemany して
+    コミットするため、件数に関係なくメモリ使用量は一定。
+    回答数は質問ごとに 0 ～ 2 * answers_per_question の範囲でばらつかせる。
+    投稿日時は now（既定: 現在時刻）から days 日前までに分散させる。seed と now が同じなら同じデータになる。
+    """
+    rng = random.Random(seed)
+    text = _TextFactory(rng)
+    now = now or datetime.now()
+    start = now - timedelta(days=days)
+    span = (now - start).total_seconds()
+    started = time.perf_counter()
+
+    init_db()
+    with get_connection() as conn:
+        c = conn.cursor()
+
+        if truncate:
+            c.execute('DELETE FROM answers')
+            c.execute('DELETE FROM questions')
+            c.execute('DELETE FROM users')
+            conn.commit()
+
+        # ユーザー（既存のIDとは重ならない8桁の番号を振る）
+        c.execute("SELECT COALESCE(MAX(CAST(ldap_id AS INTEGER)), 0) FROM users")
+        first_ldap = max(20000000, c.fetchone()[0] + 1)
+        ldap_ids = [str(first_ldap + i) for i in range(num_users)]
+        c.executemany('INSERT OR IGNORE INTO users (ldap_id, name, created_at, created_ts) VALUES (?, ?, ?, ?)',
+                      ((ldap_id, f"{rng.choice(SURNAMES)} {rng.choice(ROLES)}", *now_stamp(start))
+                       for ldap_id in ldap_ids))
+        conn.commit()
+
+        # 投稿の多いユーザーと少ないユーザーがいるように偏らせる
+        rng.shuffle(ldap_ids)
+        user_weights = _cum_weights(len(ldap_ids), 0.8)
+
+        next_question_id = _next_id(c, 'questions')
+        next_answer_id = _next_id(c, 'answers')
+
+        question_rows = []
+        answer_rows = []
+        answers_written = 0
+        for i in range(num_questions):
+            question_id = next_question_id + i
+            # 質問IDの順に投稿日時が進むようにし、多少の揺らぎを加える
+            created = start + timedelta(seconds=span * (i + rng.random()) / num_questions)
+            title, content, category, tags = text.question()
+            ldap_id = rng.choices(ldap_ids, cum_weights=user_weights)[0]
+
+            answers = []
+            posted = created
+            for _ in range(rng.randint(0, 2 * answers_per_question)):
+                posted = min(now, posted + timedelta(minutes=rng.randint(10, 60 * 24 * 7)))
+                posted_at, posted_ts = now_stamp(posted)
+                answers.append([next_answer_id, question_id, text.answer(),
+                                rng.choices(ldap_ids, cum_weights=user_weights)[0],
+                                posted_at, posted_at, posted_ts, posted_ts, 0])
+                next_answer_id += 1
+
+            # 古くて回答のある質問ほど解決済みになりやすい
+            resolved = bool(answers) and rng.random() < 0.3 + 0.6 * (1 - i / num_questions)
+            best_answer_id = None
+            if resolved:
+                best = rng.choice(answers)
+                best[8] = 1
+                best_answer_id = best[0]
+            answer_rows.extend(answers)
+
+            created_at, created_ts = now_stamp(created)
+            question_rows.append((question_id, title, content, category, tags, ldap_id,
+                                  created_at, created_ts, created_ts, 1 if resolved else 0, best_answer_id, THANK_MESSAGE if resolved else None))
+
+            if len(question_rows) >= chunk_size:
+                _flush(conn, c, question_rows, answer_rows)
+                answers_written += len(answer_rows)
+                question_rows, answer_rows = [], []
+                if progress:
+                    print(f"  質問 {i + 1:,}/{num_questions:,} 件, 回答 {answers_written:,} 件 "
+                          f"({time.perf_counter() - started:.1f}秒)")
+
+        if question_rows:
+            _flush(conn, c, question_rows, answer_rows)
+            answers_written += len(answer_rows)
+
+    return {'users': num_users, 'questions': num_questions, 'answers': answers_written,
+            'seconds': time.perf_counter() - started}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="QAアプリのダミーデータ生成")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    parser.add_argument("--generate", action="store_true", help="固定のサンプルデータで置き換える（既定の動作）")
+    parser.add_argument("--synthetic", action="store_true", help="性能試験用の大量データを追記する")
+    parser.add_argument("--users", type=int, default=100, help="--synthetic: 追加するユーザー数")
+    parser.add_argument("--questions", type=int, default=1000, help="--synthetic: 追加する質問数")
+    parser.add_argument("--answers-per-question", type=int, default=3, help="--synthetic: 質問あたりの平均回答数")
+    parser.add_argument("--seed", type=int, help="--synthetic: 乱数シード（同じ値なら同じデータ）")
+    parser.add_argument("--days", type=int, default=3 * 365, help="--synthetic: 投稿日時を分散させる日数")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="--synthetic: 1トランザクションあたりの質問数")
+    parser.add_argument("--truncate", action="store_true", help="--synthetic: 既存データを削除してから生成する")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db_pool.configure(args.db)
+
+    if args.synthetic:
+        if args.users < 1 or args.questions < 1:
+            parser.error("--users と --questions は1以上を指定してください")
+        print("大量データを生成します...")
+        try:
+            result = generate_synthetic_data(args.users, args.questions, args.answers_per_question,
+                                             seed=args.seed, days=args.days, chunk_size=args.chunk_size,
+                                             truncate=args.truncate)
+        except sqlite3.Error as e:
+            print(f"ダミーデータ生成エラー: {e}")
+            return 1
+        print(f"生成完了: ユーザー {result['users']:,} 人, 質問 {result['questions']:,} 件, "
+              f"回答 {result['answers']:,} 件 ({result['seconds']:.1f}秒)")
+        return 0
+
     print("ダミーデータを生成します...")
     if generate_dummy_data():
         print("ダミーデータの生成が完了しました")
-    else:
-        print("ダミーデータの生成に失敗しました")
+        return 0
+    print("ダミーデータの生成に失敗しました")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
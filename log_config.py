@@ -0,0 +1,77 @@
+import contextvars
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+# アプリ全体のロガー名（各モジュールは "qa_app.<モジュール名>" を使う）
+LOGGER_NAME = 'qa_app'
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(funcName)s user=%(user)s %(message)s'
+
+# リクエスト単位のコンテキスト（Streamlitのスクリプト実行スレッドごとに設定する）
+_current_user = contextvars.ContextVar('qa_app_user', default='-')
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """ログレコードに操作中のユーザーを付与する"""
+
+    def filter(self, record):
+        record.user = _current_user.get()
+        return True
+
+
+def get_logger(name):
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
+
+
+def set_log_user(ldap_id):
+    """以降のログに出力するユーザーを設定する（未ログインは None）"""
+    _current_user.set(ldap_id or '-')
+
+
+@contextmanager
+def log_user(ldap_id):
+    token = _current_user.set(ldap_id or '-')
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+def configure_logging(level=None, destination=None, force=False):
+    """ログレベルと出力先を設定する
+
+    level: ログレベル名（既定: 環境変数 QA_APP_LOG_LEVEL または INFO）
+    destination: 出力ファイルのパス（既定: 環境変数 QA_APP_LOG_FILE、未設定なら標準エラー出力）
+    Streamlitは再実行のたびにスクリプトを読み直すため、2回目以降は force=True の場合のみ設定し直す。
+    """
+    global _configured
+    with _configure_lock:
+        if _configured and not force:
+            return logging.getLogger(LOGGER_NAME)
+
+        level = (level or os.environ.get('QA_APP_LOG_LEVEL', 'INFO')).upper()
+        destination = destination or os.environ.get('QA_APP_LOG_FILE')
+
+        if destination:
+            handler = logging.FileHandler(destination, encoding='utf-8')
+        else:
+            handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(ContextFilter())
+
+        logger = logging.getLogger(LOGGER_NAME)
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+            old.close()
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+        _configured = True
+        return logger
@@ -1,10 +1,574 @@
+import os
 import streamlit as st
-import time
 from data_handler import (
-    save_question, get_questions, add_answer, get_answers,
-    get_user_name, login, signup, set_best_answer, delete_answer, update_answer,
-    mark_question_resolved, mark_question_unresolved, search_questions
+    save_question, add_answer,
+    get_user_name, login, signup, update_answer,
+    resolve_question, unresolve_question, remove_answer, search_questions,
+    get_answers, get_question_page, get_question_details,
+    get_questions_by_tags, get_tag_counts, find_similar_questions,
+    get_leaderboard, get_user_stats, LEADERBOARD_METRICS,
+    get_changes_since, latest_change_seq, QUESTION_SORT_COLUMNS
 )
+from db_init import ensure_schema
+from log_config import configure_logging, set_log_user
+import query_stats
+from db_pool import pool_stats
+from maintenance import maintenance_stats, start_maintenance
+from query_cache import read_cache
+from write_queue import write_queue_stats
+from tag_utils import normalize_tags
+from time_utils import fiscal_year, fiscal_year_of, last_days
+
+# ログ設定とスキーマの最新化、メンテナンスの開始はプロセスごとに一度だけ行う
+configure_logging()
+ensure_schema()
+start_maintenance()
+
+# 一覧のページ位置（表示済みページのカーソルを積んでおく）
+def current_cursor(view):
+    cursors = st.session_state.setdefault(f"{view}_cursors", [None])
+    return cursors[-1]
+
+# ページ送り（一覧の断片の中で呼び、一覧だけを再実行する）
+def page_navigation(view, next_cursor):
+    cursors = st.session_state.setdefault(f"{view}_cursors", [None])
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if len(cursors) > 1 and st.button("← 前のページ", key=f"{view}_prev"):
+            cursors.pop()
+            st.rerun(scope="fragment")
+    with col2:
+        st.caption(f"{len(cursors)} ページ目")
+    with col3:
+        if next_cursor and st.button("次のページ →", key=f"{view}_next"):
+            cursors.append(next_cursor)
+            st.rerun(scope="fragment")
+
+# サイドバーで選べるタグの数（質問数の多い順）
+TAG_FILTER_LIMIT = 50
+
+# 画面の切り替え（選んだ画面だけを読み込んで描画する）
+VIEWS = {"open": "質問一覧", "resolved": "解決済み", "search": "検索", "ranking": "ランキング"}
+
+# 検索結果を一度に表示する件数（「さらに表示」で増やす）
+SEARCH_PAGE_SIZE = 20
+
+# ランキングに表示するカテゴリごとの人数
+LEADERBOARD_LIMIT = 10
+
+LEADERBOARD_LABELS = {"answers": "回答数", "best_answers": "ベストアンサー数", "resolved_questions": "解決済み質問数"}
+
+# 一覧・検索の期間の絞り込み: {名前: (表示名, 期間 (開始, 終了) を返す関数)}
+PERIODS = {
+    "all": ("すべての期間", lambda: None),
+    "7d": ("直近7日", lambda: last_days(7)),
+    "30d": ("直近30日", lambda: last_days(30)),
+    "this_fy": ("今年度", lambda: fiscal_year(fiscal_year_of())),
+    "last_fy": ("前年度", lambda: fiscal_year(fiscal_year_of() - 1)),
+}
+
+SEARCH_SORT_LABELS = {"relevance": "関連度順", "created": "新着順"}
+
+# 期間の選択（戻り値: (名前, 期間)）
+def period_select(key):
+    name = st.selectbox("期間", list(PERIODS), key=key, format_func=lambda p: PERIODS[p][0])
+    return name, PERIODS[name][1]()
+
+# 新規質問のタイトルがこの文字数以上になったら似た質問を探す
+SIMILAR_MIN_TITLE_LENGTH = 4
+
+# 新規質問フォームに表示する似た質問の件数
+SIMILAR_LIMIT = 5
+
+# 一覧のページ取得（サイドバーでタグを選んでいればタグで絞り込む）
+# 戻り値: (ページ位置のキー, (質問リスト, 次ページのカーソル))
+def load_question_page(view, resolved_filter, sort="created", period=None, include_archive=False):
+    tags = st.session_state.get("tag_filter") or []
+    if not tags:
+        def fetch(cursor):
+            return get_question_page(resolved_filter=resolved_filter, cursor=cursor,
+                                     sort=sort, period=period, include_archive=include_archive)
+
+        def matches(q):
+            return bool(q.resolved) == resolved_filter
+    else:
+        mode = st.session_state.get("tag_mode", "and")
+        # 絞り込み条件ごとにページ位置を別に持つ
+        view = f"{view}_{mode}_{','.join(sorted(tags))}"
+
+        def fetch(cursor):
+            return get_questions_by_tags(tags, mode, resolved_filter=resolved_filter,
+                                         cursor=cursor, sort=sort, period=period)
+
+        def matches(q):
+            found = set(tags) & set(normalize_tags(q.tags))
+            return bool(q.resolved) == resolved_filter and (found == set(tags) if mode == "and" else bool(found))
+    return view, session_page(view, fetch, matches, QUESTION_SORT_COLUMNS[sort])
+
+# セッションに保持する一覧のページ数（古いものから捨てる）
+SESSION_PAGE_LIMIT = 20
+
+# 一覧のページをセッションに保持し、2回目からは前回以降の変更（get_changes_since）だけを当てる
+# 差分で済まないとき（新しい質問がページに入る、並び順が変わる、履歴が消えた）だけページを読み直す
+def session_page(view, fetch, matches, column):
+    cursor = current_cursor(view)
+    pages = st.session_state.setdefault("question_pages", {})
+    key = (view, cursor)
+    entry = pages.pop(key, None)
+    if entry is not None:
+        seq, questions, next_cursor = entry
+        changes = get_changes_since(seq)
+        patched = None if changes.reset else apply_question_changes(questions, changes, matches, column)
+        if patched is not None:
+            pages[key] = (changes.seq, patched, next_cursor)
+            return patched, next_cursor
+
+    # 変更番号はページより先に取る（読み込み中の変更は次回の差分に含まれる）
+    seq = latest_change_seq()
+    questions, next_cursor = fetch(cursor)
+    pages[key] = (seq, questions, next_cursor)
+    while len(pages) > SESSION_PAGE_LIMIT:
+        pages.pop(next(iter(pages)))
+    return questions, next_cursor
+
+# 一覧のページに変更を当てる（差分で済まなければ None）
+def apply_question_changes(questions, changes, matches, column):
+    if not changes.questions and not changes.deleted_question_ids:
+        return questions
+    changed = {q.id: q for q in changes.questions}
+    deleted = set(changes.deleted_question_ids)
+    result = []
+    for q in questions:
+        # アーカイブDBの質問は変更履歴の対象外
+        if q.archived:
+            result.append(q)
+            continue
+        if q.id in deleted:
+            continue
+        current = changed.pop(q.id, None)
+        if current is None:
+            result.append(q)
+        elif getattr(current, column) != getattr(q, column):
+            return None
+        elif matches(current):
+            result.append(current)
+    # ページに無かった質問が条件に合えば（新しい投稿など）、どの位置に入るかはページを読み直して決める
+    if any(matches(q) for q in changed.values()):
+        return None
+    return result
+
+# 更新操作が返した質問と回答を、その質問の次の再実行で読み直さずに使えるよう保持する
+def remember_state(state):
+    st.session_state.setdefault("fresh_states", {})[state[0].id] = state
+
+# 質問と回答（直前の更新で返された分があればそれを使う）
+def load_question(question_id):
+    fresh = st.session_state.setdefault("fresh_states", {}).pop(question_id, None)
+    if fresh:
+        return fresh
+    return get_question_details([question_id]).get(question_id), get_answers(question_id)
+
+# ベストアンサーの強調表示
+def best_answer_badge():
+    st.markdown("""
+        <div style='background-color: #FFF9C4; padding: 8px; border-radius: 8px; margin-bottom: 8px;'>
+            <div style='display: flex; align-items: center; gap: 8px;'>
+                <span style='color: #FFA000; font-weight: bold;'>★ ベストアンサー</span>
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+# 回答者と回答日時
+def answer_header(ans):
+    st.write(f"**{ans.user_name} (ID: {ans.ldap_id})** さんからの回答:")
+    st.markdown(f"""
+        <div style='display: flex; gap: 16px; font-size: 0.8em; color: #888888; margin-bottom: 8px;'>
+            <span>回答日時: {ans.posted_at}</span>
+            {f"<span>最終更新: {ans.updated_at}</span>" if ans.updated_at else ""}
+        </div>
+    """, unsafe_allow_html=True)
+
+# 一覧の1行の開閉ボタン（開く質問は一覧ごとに1件だけで、切り替えは一覧の断片だけを再実行する）
+def toggle_button(kind, question_id, is_open):
+    if st.button("閉じる" if is_open else "詳細", key=f"{kind}_row_{question_id}"):
+        st.session_state[f"{kind}_opened"] = None if is_open else question_id
+        st.rerun(scope="fragment")
+
+# 質問一覧の1行（タイトルと件数だけの軽い表示）
+def question_row(summary, is_open):
+    col1, col2 = st.columns([8, 1])
+    with col1:
+        # リンク風タイトル
+        st.markdown(f"""
+            <div style="
+                color: #1a73e8;
+                font-weight: bold;
+                margin: 10px 0;
+            ">
+            {summary.title} (投稿者: {summary.user_name}, 回答数: {summary.answer_count})
+            </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        toggle_button("open", summary.id, is_open)
+
+# 開いた質問の本文と回答スレッド
+def question_detail(summary):
+    q = get_question_details([summary.id]).get(summary.id, summary)
+
+    with st.container(border=True):
+        st.write(q.content or "")
+        st.write(f"タグ: {q.tags}")
+        st.write(f"投稿者: {q.user_name} (ID: {q.ldap_id})")
+        st.markdown(f"<span style='color:#888888'>投稿日時: {q.created_at}</span>", unsafe_allow_html=True)
+        answer_thread(q.id)
+
+# 解決操作・回答・回答フォーム（操作したらこの質問の回答スレッドだけを再実行する）
+@st.fragment
+def answer_thread(question_id):
+    q, answers = load_question(question_id)
+    if q is None:
+        st.warning("この質問は削除されました")
+        return
+
+    # 質問者用の解決済み/未解決ボタン
+    if q.ldap_id == st.session_state.ldap_id:
+        if q.resolved:
+            if st.button("未解決に戻す", key=f"unresolve_{q.id}"):
+                state = unresolve_question(q.id)
+                if state:
+                    remember_state(state)
+                    st.toast("質問を未解決に戻しました")
+                    st.rerun(scope="fragment")
+                else:
+                    st.error("変更に失敗しました")
+
+            # 解決済みのお礼メッセージ表示
+            if q.thank_message:
+                st.info(f"**解決のお礼**: {q.thank_message}")
+        else:
+            # ベストアンサー設定とお礼メッセージ（質問者本人のみ）
+            with st.form(f"resolve_form_{q.id}"):
+                st.subheader("質問を解決済みにする")
+
+                # ベストアンサー選択
+                answer_options = {ans.id: ans.content[:50] + '...' for ans in answers}
+                selected_answer = st.selectbox("ベストアンサーを選択",
+                                            options=list(answer_options.keys()),
+                                            format_func=lambda x: answer_options[x])
+
+                # お礼メッセージ入力
+                thank_message = st.text_area("お礼メッセージ（任意）",
+                                           placeholder="回答してくれた方へのお礼を記入してください")
+
+                submitted = st.form_submit_button("解決済みとして確定")
+                if submitted:
+                    state = resolve_question(q.id, selected_answer, thank_message if thank_message else None)
+                    if state:
+                        remember_state(state)
+                        st.toast("ベストアンサーを設定し、質問を解決済みにしました！")
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error("解決済みにできませんでした。再度お試しください")
+
+    if answers:
+        st.write("---")
+        st.subheader("回答")
+        for ans in answers:
+            # ベストアンサー表示
+            if ans.is_best == 1:
+                st.success(f"ベストアンサー: {ans.user_name} (ID: {ans.ldap_id})")
+
+            answer_header(ans)
+
+            # 回答編集・削除（回答者のみ）
+            if ans.ldap_id == st.session_state.get('ldap_id'):
+                edit_key = f"editing_{ans.id}"
+                delete_key = f"deleting_{ans.id}"
+                if st.session_state.get(edit_key, False):
+                    with st.form(f"edit_form_{ans.id}"):
+                        edited_content = st.text_area("回答を編集",
+                                                    value=ans.content,
+                                                    height=200)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("更新"):
+                                if update_answer(ans.id, edited_content):
+                                    st.toast("回答を更新しました")
+                                    st.session_state[edit_key] = False
+                                    st.rerun(scope="fragment")
+                                else:
+                                    st.error("更新に失敗しました")
+                        with col2:
+                            if st.form_submit_button("キャンセル"):
+                                st.session_state[edit_key] = False
+                                st.rerun(scope="fragment")
+                elif st.session_state.get(delete_key, False):
+                    content = ans.content
+                    st.warning(f"回答を本当に削除しますか？\n\n{content[:100]}{'...' if len(content) > 100 else ''}")
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        if st.button("削除する", key=f"confirm_del_{ans.id}", type="primary"):
+                            state = remove_answer(ans.id)
+                            st.session_state[delete_key] = False
+                            if state:
+                                remember_state(state)
+                                st.toast("回答を削除しました")
+                                st.rerun(scope="fragment")
+                            else:
+                                st.error("削除に失敗しました")
+                    with col2:
+                        if st.button("やめる", key=f"cancel_del_{ans.id}"):
+                            st.session_state[delete_key] = False
+                            st.rerun(scope="fragment")
+                else:
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        if st.button("✏️ 編集", key=f"edit_btn_{ans.id}"):
+                            st.session_state[edit_key] = True
+                            st.rerun(scope="fragment")
+                    with col2:
+                        if st.button("🗑️ 削除", key=f"del_btn_{ans.id}"):
+                            st.session_state[delete_key] = True
+                            st.rerun(scope="fragment")
+
+            st.write(ans.content)
+            st.write("---")
+
+    # 回答フォーム（回答表示の後に配置）
+    with st.form(f"answer_form_{q.id}", clear_on_submit=True):
+        answer = st.text_area("回答を入力")
+        submitted = st.form_submit_button("回答する")
+
+        if submitted:
+            if not answer:
+                st.warning("回答内容を入力してください")
+            elif not st.session_state.get('ldap_id'):
+                st.error("ログインが必要です")
+            elif add_answer(q.id, answer, st.session_state.ldap_id):
+                st.toast("回答が投稿されました！")
+                st.rerun(scope="fragment")
+            else:
+                st.error("回答の保存に失敗しました。詳細はコンソールを確認してください")
+
+# アーカイブDBから読んだ質問の目印（一覧・検索結果の行に添える）
+def archived_badge(q):
+    if not q.archived:
+        return ""
+    return ("<div style='background-color: #9E9E9E; color: white; padding: 2px 8px; "
+            "border-radius: 12px; font-size: 0.8em;'>アーカイブ</div>")
+
+# 解決済み一覧の1行
+def resolved_row(summary, is_open):
+    col1, col2 = st.columns([8, 1])
+    with col1:
+        st.markdown(f"""
+            <div style='display: flex; align-items: center; gap: 8px; margin-bottom: 8px;'>
+                <div style='background-color: #4CAF50; color: white; padding: 2px 8px; border-radius: 12px; font-size: 0.8em;'>
+                    解決済み
+                </div>
+                {archived_badge(summary)}
+                <div style='font-size: 1.2em; color: #666;'>
+                    {summary.title}
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        toggle_button("resolved", summary.id, is_open)
+
+# 開いた解決済み質問（閲覧のみ）
+def resolved_detail(summary):
+    q, answers = load_question(summary.id)
+    q = q or summary
+
+    with st.container(border=True):
+        st.write(q.content or "")
+
+        # Display answers (readonly)
+        for ans in answers:
+            # ベストアンサーを強調表示
+            if ans.is_best:
+                best_answer_badge()
+
+            st.write(f"**回答者:** {ans.ldap_id}")
+            st.write(f"**投稿日時:** {ans.posted_at}")
+            st.write(ans.content)
+            st.write("---")
+
+# 自動更新で変更を確かめる間隔（秒）
+AUTO_REFRESH_SECONDS = 10
+
+# 自動更新: 変更番号だけを定期的に確かめ、誰かが書き込んでいたら画面を更新する（一覧は差分を当てる）
+@st.fragment(run_every=AUTO_REFRESH_SECONDS)
+def change_watcher():
+    seq = latest_change_seq()
+    seen = st.session_state.setdefault("seen_change_seq", seq)
+    if seq != seen:
+        st.session_state.seen_change_seq = seq
+        st.rerun()
+
+# 質問一覧・解決済み一覧（ページ送りと質問の開閉はこの一覧だけを再実行する）
+@st.fragment
+def question_list(kind):
+    # 期間は並び順の日時（新着順は投稿日時、最近動きのあった順は最終アクティビティ）で絞り込む
+    period_name, period = period_select(f"{kind}_period")
+    if kind == "open":
+        sort = st.radio("並び順", ["created", "activity"], horizontal=True, key="open_sort",
+                        format_func=lambda s: {"created": "新着順", "activity": "最近動きのあった順"}[s])
+        # 並び順・期間ごとにカーソルが異なるのでページ位置も別に持つ
+        view, (questions, next_cursor) = load_question_page(f"open_{sort}_{period_name}", False, sort, period)
+        row, detail = question_row, question_detail
+    else:
+        # アーカイブDBへ移した古い質問は指定したときだけ含める（タグの絞り込みは本体の質問だけ）
+        include_archive = st.checkbox("アーカイブした古い質問も表示する", key="resolved_include_archive")
+        view, (questions, next_cursor) = load_question_page(
+            f"resolved_{period_name}{'_archive' if include_archive else ''}", True,
+            period=period, include_archive=include_archive)
+        row, detail = resolved_row, resolved_detail
+
+    # 本文・回答・フォームは開いた質問の分だけ作る
+    opened = st.session_state.get(f"{kind}_opened")
+    for q in questions:
+        row(q, q.id == opened)
+        if q.id == opened:
+            detail(q)
+
+    page_navigation(view, next_cursor)
+
+# 検索結果の1行
+def search_row(q, is_open):
+    # ステータス表示
+    status_color = "#4CAF50" if q.resolved else "#2196F3"
+    status_text = "解決済み" if q.resolved else "回答受付中"
+
+    col1, col2 = st.columns([8, 1])
+    with col1:
+        st.markdown(f"""
+            <div style='display: flex; align-items: center; gap: 8px; margin-bottom: 8px;'>
+                <div style='background-color: {status_color}; color: white; padding: 2px 8px; border-radius: 12px; font-size: 0.8em;'>
+                    {status_text}
+                </div>
+                {archived_badge(q)}
+                <div style='font-size: 1.2em;'>
+                    {q.title}
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
+
+        # 一致箇所のハイライト
+        if q.snippet:
+            st.caption(q.snippet)
+    with col2:
+        toggle_button("search", q.id, is_open)
+
+# 開いた検索結果（閲覧のみ）
+def search_detail(q):
+    answers = get_answers(q.id)
+
+    with st.container(border=True):
+        st.write(f"**投稿者:** {q.user_name} (ID: {q.ldap_id})")
+        st.write(f"**投稿日時:** {q.created_at}")
+        st.write(f"**カテゴリ:** {q.category or '未設定'}")
+        st.write(f"**回答数:** {q.answer_count}")
+
+        if q.tags:
+            st.write(f"**タグ:** {q.tags}")
+
+        st.write(q.content or "")
+
+        # 回答表示
+        if answers:
+            st.subheader("回答")
+            for ans in answers:
+                if ans.is_best:
+                    best_answer_badge()
+                answer_header(ans)
+                st.write(ans.content)
+                st.write("---")
+
+# 検索パネル（キーワードの入力や結果の開閉は検索パネルだけを再実行する）
+@st.fragment
+def search_panel():
+    st.header("質問検索")
+    search_keywords = st.text_input("検索キーワード（複数単語はスペース区切りでAND検索）")
+    col1, col2 = st.columns(2)
+    with col1:
+        # 検索の期間は投稿日時で絞り込む
+        period_name, period = period_select("search_period")
+    with col2:
+        sort = st.radio("並び順", list(SEARCH_SORT_LABELS), horizontal=True, key="search_sort",
+                        format_func=SEARCH_SORT_LABELS.get)
+
+    if not search_keywords:
+        return
+    questions = search_questions(search_keywords, period=period, sort=sort)
+    if not questions:
+        st.warning("該当する質問が見つかりませんでした")
+        return
+    st.success(f"{len(questions)}件の質問が見つかりました")
+
+    # 表示件数は検索条件ごとに数え直す
+    condition = (search_keywords, period_name, sort)
+    shown_condition, shown = st.session_state.get("search_shown", (None, SEARCH_PAGE_SIZE))
+    if shown_condition != condition:
+        shown = SEARCH_PAGE_SIZE
+    opened = st.session_state.get("search_opened")
+    for q in questions[:shown]:
+        search_row(q, q.id == opened)
+        if q.id == opened:
+            search_detail(q)
+
+    if len(questions) > shown and st.button(f"さらに表示（残り{len(questions) - shown}件）", key="search_more"):
+        st.session_state["search_shown"] = (condition, shown + SEARCH_PAGE_SIZE)
+        st.rerun(scope="fragment")
+
+# カテゴリ別ランキング（指標の切り替えはランキングタブだけを再実行する）
+@st.fragment
+def leaderboard_panel():
+    st.header("カテゴリ別ランキング")
+    metric = st.radio("指標", list(LEADERBOARD_METRICS), horizontal=True, key="leaderboard_metric",
+                      format_func=lambda m: LEADERBOARD_LABELS[m])
+    leaderboard = get_leaderboard(metric, LEADERBOARD_LIMIT)
+    if not leaderboard:
+        st.info("まだ集計対象のデータがありません")
+    for category, entries in leaderboard.items():
+        st.subheader(category or "カテゴリなし")
+        st.table([{"順位": e.rank, "氏名": e.user_name, "LDAP ID": e.ldap_id,
+                   LEADERBOARD_LABELS[metric]: e.value} for e in entries])
+
+# 管理者のLDAP ID（カンマ区切り、環境変数 QA_APP_ADMIN_IDS）
+ADMIN_IDS = {i.strip() for i in os.environ.get('QA_APP_ADMIN_IDS', '').split(',') if i.strip()}
+
+# 管理者用: クエリ統計ページ
+def render_query_stats():
+    st.header("クエリ統計")
+    stats = query_stats.snapshot()
+    st.caption(f"集計時刻: {stats['generated_at']} / 遅いクエリの閾値: {stats['slow_query_ms']:.0f}ms")
+
+    st.subheader("関数別レイテンシ")
+    st.dataframe(stats['functions'], use_container_width=True)
+
+    st.subheader("クエリ別レイテンシ")
+    st.dataframe(stats['queries'], use_container_width=True)
+
+    st.subheader(f"遅いクエリ（{len(stats['slow_queries'])}件）")
+    for entry in reversed(stats['slow_queries']):
+        with st.expander(f"{entry['elapsed_ms']:.1f}ms {entry['function']} ({entry['at']})"):
+            st.code(entry['fingerprint'], language="sql")
+            st.write(f"パラメータ: {entry['params']} / 行数: {entry['rows']}")
+            st.code("\n".join(entry['plan']), language="text")
+
+    st.subheader("接続プール・書き込みキュー・キャッシュ・メンテナンス")
+    st.json({'pool': pool_stats(), 'writer': write_queue_stats(), 'cache': read_cache.stats(),
+             'maintenance': maintenance_stats()})
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("JSONでエクスポート", query_stats.export_json(),
+                           file_name="query_stats.json", mime="application/json")
+    with col2:
+        if st.button("統計をリセット"):
+            query_stats.reset()
+            st.rerun()
 
 # アプリタイトル
 st.title("HPS（水事）知恵袋")
@@ -17,6 +581,9 @@ if 'logged_in' not in st.session_state:
         'user_name': None
     })
 
+# このスクリプト実行中のログに操作ユーザーを付与する
+set_log_user(st.session_state.ldap_id)
+
 # サイドバーにログインフォーム
 with st.sidebar:
     if not st.session_state.logged_in:
@@ -46,13 +613,46 @@ with st.sidebar:
             st.session_state.ldap_id = None
             st.session_state.user_name = None
             st.rerun()
+        
+        # 自分の回答数・ベストアンサー数・解決済み質問数
+        my_stats = get_user_stats(st.session_state.ldap_id)
+        if my_stats:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("回答", my_stats['answer_count'])
+            col2.metric("ベストアンサー", my_stats['best_answer_count'])
+            col3.metric("解決済み質問", my_stats['resolved_question_count'])
+
+        if st.session_state.ldap_id in ADMIN_IDS:
+            st.toggle("クエリ統計（管理者）", key="show_query_stats")
+
+        # タグで絞り込み
+        tag_counts = dict(get_tag_counts(TAG_FILTER_LIMIT))
+        st.multiselect("タグで絞り込み", list(tag_counts), key="tag_filter",
+                       format_func=lambda t: f"{t} ({tag_counts.get(t, 0)})")
+        st.radio("条件", ["and", "or"], horizontal=True, key="tag_mode",
+                 format_func=lambda m: {"and": "すべてを含む", "or": "いずれかを含む"}[m])
+
+        st.toggle(f"自動更新（{AUTO_REFRESH_SECONDS}秒ごと）", key="auto_refresh")
 
 if st.session_state.logged_in:
 
+    # 管理者用ページ
+    if st.session_state.ldap_id in ADMIN_IDS and st.session_state.get("show_query_stats"):
+        render_query_stats()
+        st.stop()
+
     # 新規質問フォーム
     with st.expander("新規質問"):
+        # タイトルはフォームの外に置き、入力を確定するたびに似た解決済みの質問を表示する
+        title = st.text_input("質問タイトル", key="new_question_title")
+        if len(title.strip()) >= SIMILAR_MIN_TITLE_LENGTH:
+            similar = find_similar_questions(title, limit=SIMILAR_LIMIT)
+            if similar:
+                st.info("似た質問が既に解決済みです。投稿する前に確認してください")
+                for sq in similar:
+                    st.markdown(f"- #ID{sq.id} **{sq.title}** "
+                                f"（{sq.category}・回答 {sq.answer_count}件）")
         with st.form("new_question_form", clear_on_submit=True):
-            title = st.text_input("質問タイトル")
             content = st.text_area("質問内容")
             category = st.selectbox("カテゴリ", ["水処理技術","機械（設計、調達、試運転、メンテ）", "電気（設計、調達、メンテ）", "土木建築（設計、構造、施工）","現場管理", "プロジェクト管理", "その他"])
             tags = st.text_input("タグ (カンマ区切り)")
@@ -76,265 +676,25 @@ if st.session_state.logged_in:
                     )
                     if question_id:
                         st.success(f"質問 #ID{question_id} が投稿されました！")
+                        # フォーム外のタイトルは clear_on_submit で消えないので次の実行で空にする
+                        st.session_state.pop("new_question_title", None)
                     else:
                         st.error("質問の保存に失敗しました。再度お試しください")
             
             if cancelled:
                 st.info("質問の投稿をキャンセルしました")
 
-    # タブ定義
-    tab1, tab2, tab3 = st.tabs(["質問一覧", "解決済み", "検索"])
-    
-    with tab1:
-        questions = get_questions(resolved_filter=False)
-        for q in questions:
-            expand_key = f"expanded_{q['id']}"
-            if expand_key not in st.session_state:
-                st.session_state[expand_key] = False
-            
-            # リンク風タイトル
-            st.markdown(f"""
-                <div style="
-                    color: #1a73e8;
-                    font-weight: bold;
-                    cursor: pointer;
-                    margin: 10px 0;
-                ">
-                {q['title']} (投稿者: {q['user_name']}, 回答数: {q['answer_count']})
-                </div>
-            """, unsafe_allow_html=True)
-            
-            with st.expander("詳細", expanded=bool(st.session_state.get(f"expanded_{q['id']}", False))):
-                st.session_state[f"expanded_{q['id']}"] = True
-                
-                st.write(q["content"])
-                st.write(f"タグ: {q['tags']}")
-                st.write(f"投稿者: {q['user_name']} (ID: {q['ldap_id']})")
-                st.markdown(f"<span style='color:#888888'>投稿日時: {q['created_at']}</span>", unsafe_allow_html=True)
-                
-                # 質問者用の解決済み/未解決ボタン
-                if q['ldap_id'] == st.session_state.ldap_id:
-                    if q['resolved']:
-                        if st.button("未解決に戻す", key=f"unresolve_{q['id']}"):
-                            if mark_question_unresolved(q['id']):
-                                st.success("質問を未解決に戻しました")
-                                st.rerun()
-                            else:
-                                st.error("変更に失敗しました")
-                        
-                        # 解決済みのお礼メッセージ表示
-                        if q.get('thank_message'):
-                            st.info(f"**解決のお礼**: {q['thank_message']}")
-                    else:
-                        # ベストアンサー設定とお礼メッセージ（質問者本人のみ）
-                        with st.form(f"resolve_form_{q['id']}"):
-                            st.subheader("質問を解決済みにする")
-                            
-                            # ベストアンサー選択
-                            answer_options = {ans['id']: ans['content'][:50] + '...' for ans in get_answers(q['id']) if ans.get('question_id') == q['id']}
-                            selected_answer = st.selectbox("ベストアンサーを選択", 
-                                                        options=list(answer_options.keys()), 
-                                                        format_func=lambda x: answer_options[x])
-                            
-                            # お礼メッセージ入力
-                            thank_message = st.text_area("お礼メッセージ（任意）", 
-                                                       placeholder="回答してくれた方へのお礼を記入してください")
-                            
-                            submitted = st.form_submit_button("解決済みとして確定")
-                            if submitted:
-                                if set_best_answer(q['id'], selected_answer) and \
-                                   mark_question_resolved(q['id'], thank_message if thank_message else None):
-                                    st.success("ベストアンサーを設定し、質問を解決済みにしました！")
-                                    time.sleep(1)
-                                    st.rerun()
-                
-                answers = get_answers(q['id'])
-                if answers:
-                    st.write("---")
-                    st.subheader("回答")
-                    for ans in answers:
-                        # ベストアンサー表示
-                        if ans.get('is_best', 0) == 1:
-                            st.success(f"ベストアンサー: {ans['user_name']} (ID: {ans['ldap_id']})")
-                        
-                        st.write(f"**{ans['user_name']} (ID: {ans['ldap_id']})** さんからの回答:")
-                        st.markdown(f"""
-                            <div style='display: flex; gap: 16px; font-size: 0.8em; color: #888888; margin-bottom: 8px;'>
-                                <span>回答日時: {ans['posted_at']}</span>
-                                {f"<span>最終更新: {ans['updated_at']}</span>" if ans.get('updated_at') else ""}
-                            </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # 回答編集機能（回答者のみ）
-                        if ans.get('ldap_id') == st.session_state.get('ldap_id'):
-                            edit_key = f"editing_{ans['id']}"
-                            if st.session_state.get(edit_key, False):
-                                with st.form(f"edit_form_{ans['id']}"):
-                                    edited_content = st.text_area("回答を編集", 
-                                                                value=ans.get("content", ""), 
-                                                                height=200)
-                                    col1, col2 = st.columns(2)
-                                    with col1:
-                                        if st.form_submit_button("更新"):
-                                            if update_answer(ans['id'], edited_content):
-                                                st.success("回答を更新しました")
-                                                st.session_state[edit_key] = False
-                                                st.rerun()
-                                            else:
-                                                st.error("更新に失敗しました")
-                                    with col2:
-                                        if st.form_submit_button("キャンセル"):
-                                            st.session_state[edit_key] = False
-                                            st.rerun()
-                            else:
-                                col1, col2 = st.columns([4,1])
-                                with col1:
-                                    if st.button("✏️ 編集", key=f"edit_btn_{ans['id']}"):
-                                        st.session_state[edit_key] = True
-                                        st.rerun()
-                                with col2:
-                                    if st.button("🗑️ 削除", key=f"del_btn_{ans['id']}"):
-                                        if st.checkbox(f"回答を本当に削除しますか？\n\n{ans.get('content','')[:100]}{'...' if len(ans.get('content','')) > 100 else ''}", 
-                                                     key=f"confirm_del_{ans['id']}"):
-                                            if delete_answer(ans['id']):
-                                                st.success("回答を削除しました")
-                                                time.sleep(1)
-                                                st.rerun()
-                                            else:
-                                                st.error("削除に失敗しました")
-                        
-                        st.write(ans["content"])
-                        st.write("---")
-                
-                # 回答フォーム（回答表示の後に配置）
-                with st.form(f"answer_form_{q['id']}", clear_on_submit=True):
-                    answer = st.text_area("回答を入力")
-                    submitted = st.form_submit_button("回答する")
-                    
-                    if submitted:
-                        if not answer:
-                            st.warning("回答内容を入力してください")
-                            st.stop()
-                        
-                        if 'ldap_id' not in st.session_state:
-                            st.error("ログインが必要です")
-                            st.stop()
-                        
-                        try:
-                            if add_answer(q['id'], answer, st.session_state.ldap_id):
-                                st.success("回答が投稿されました！")
-                                time.sleep(1)  # メッセージ表示のために少し待つ
-                                st.rerun()
-                            else:
-                                st.error("回答の保存に失敗しました。詳細はコンソールを確認してください")
-                        except Exception as e:
-                            st.error(f"予期せぬエラーが発生しました: {str(e)}")
-                            st.stop()
-    
-    with tab2:
-        questions = get_questions(resolved_filter=True)
-        for q in questions:
-            st.markdown(f"""
-                <div style='display: flex; align-items: center; gap: 8px; margin-bottom: 8px;'>
-                    <div style='background-color: #4CAF50; color: white; padding: 2px 8px; border-radius: 12px; font-size: 0.8em;'>
-                        解決済み
-                    </div>
-                    <div style='font-size: 1.2em; color: #666;'>
-                        {q.get('title', '')}
-                    </div>
-                </div>
-            """, unsafe_allow_html=True)
-            
-            with st.expander("詳細", expanded=bool(st.session_state.get(f"expanded_{q['id']}", False))):
-                st.session_state[f"expanded_{q['id']}"] = True
-                
-                st.write(q["content"])
-                
-                # Display answers (readonly)
-                answers = get_answers(q['id'])
-                if answers:
-                    for ans in answers:
-                        if ans.get('question_id') == q['id']:
-                            # ベストアンサーを強調表示
-                            if ans.get('is_best', 0):
-                                st.markdown("""
-                                    <div style='background-color: #FFF9C4; padding: 8px; border-radius: 8px; margin-bottom: 8px;'>
-                                        <div style='display: flex; align-items: center; gap: 8px;'>
-                                            <span style='color: #FFA000; font-weight: bold;'>★ ベストアンサー</span>
-                                        </div>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                            
-                            st.write(f"**回答者:** {ans.get('ldap_id', '')}")
-                            st.write(f"**投稿日時:** {ans.get('posted_at', '')}")
-                            st.write(ans.get("content", ""))
-                            st.write("---")
-    
-    with tab3:
-        st.header("質問検索")
-        search_keywords = st.text_input("検索キーワード（複数単語はスペース区切りでAND検索）")
-        
-        if search_keywords:
-            questions = search_questions(search_keywords)
-            if not questions:
-                st.warning("該当する質問が見つかりませんでした")
-            else:
-                st.success(f"{len(questions)}件の質問が見つかりました")
-                
-                for q in questions:
-                    expand_key = f"expanded_search_{q['id']}"
-                    
-                    # ステータス表示
-                    status_color = "#4CAF50" if q["resolved"] else "#2196F3"
-                    status_text = "解決済み" if q["resolved"] else "回答受付中"
-                    
-                    st.markdown(f"""
-                        <div style='display: flex; align-items: center; gap: 8px; margin-bottom: 8px;'>
-                            <div style='background-color: {status_color}; color: white; padding: 2px 8px; border-radius: 12px; font-size: 0.8em;'>
-                                {status_text}
-                            </div>
-                            <div style='font-size: 1.2em;'>
-                                {q['title']}
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    with st.expander("詳細", expanded=st.session_state.get(expand_key, False)):
-                        st.session_state[expand_key] = True
-                        
-                        st.write(f"**投稿者:** {q['user_name']} (ID: {q['ldap_id']})")
-                        st.write(f"**投稿日時:** {q['created_at']}")
-                        st.write(f"**カテゴリ:** {q.get('category', '未設定')}")
-                        st.write(f"**回答数:** {len(get_answers(q['id']))}")
-                        
-                        if q.get('tags'):
-                            st.write(f"**タグ:** {q['tags']}")
-                        
-                        st.write(q["content"])
-                        
-                        # 回答表示
-                        answers = get_answers(q['id'])
-                        if answers:
-                            st.subheader("回答")
-                            for ans in answers:
-                                if ans.get('is_best', 0):
-                                    st.markdown("""
-                                        <div style='background-color: #FFF9C4; padding: 8px; border-radius: 8px; margin-bottom: 8px;'>
-                                            <div style='display: flex; align-items: center; gap: 8px;'>
-                                                <span style='color: #FFA000; font-weight: bold;'>★ ベストアンサー</span>
-                                            </div>
-                                        </div>
-                                    """, unsafe_allow_html=True)
-                                
-                                st.write(f"**{ans.get('user_name', 'Unknown')} (ID: {ans.get('ldap_id', '')})** さんからの回答:")
-                                st.markdown(f"""
-                                    <div style='display: flex; gap: 16px; font-size: 0.8em; color: #888888; margin-bottom: 8px;'>
-                                        <span>回答日時: {ans['posted_at']}</span>
-                                        {f"<span>最終更新: {ans['updated_at']}</span>" if ans.get('updated_at') else ""}
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                
-                                st.write(ans.get("content", ""))
-                                st.write("---")
+    if st.session_state.get("auto_refresh"):
+        change_watcher()
+
+    # 表示中の画面だけを実行する（st.tabs はすべてのタブの中身を毎回実行してしまう）
+    view = st.radio("表示", list(VIEWS), horizontal=True, key="main_view",
+                    format_func=VIEWS.get, label_visibility="collapsed")
+    if view in ("open", "resolved"):
+        question_list(view)
+    elif view == "search":
+        search_panel()
+    else:
+        leaderboard_panel()
 else:
     st.warning("質問や回答をするにはログインしてください")
\ No newline at end of file
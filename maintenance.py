@@ -0,0 +1,402 @@
+import argparse
+import atexit
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import db_pool
+from data_handler import latest_change_seq, prune_changes
+from db_pool import ARCHIVE_SCHEMA, attach_archive, get_connection
+from log_config import get_logger
+from time_utils import now_stamp
+from write_queue import run_write, write_queue_stats
+
+logger = get_logger('maintenance')
+
+# アプリのプロセスでバックグラウンドのメンテナンスを動かす（QA_APP_MAINTENANCE=0 で止める、cron で CLI を使う場合など）
+ENABLED = os.environ.get('QA_APP_MAINTENANCE', '1') not in ('', '0')
+
+# 実行する作業があるかを確かめる間隔（秒、環境変数 QA_APP_MAINTENANCE_INTERVAL で変更可能）
+CHECK_INTERVAL = float(os.environ.get('QA_APP_MAINTENANCE_INTERVAL', '60'))
+
+# 書き込みが多い間は確かめる間隔を倍々に延ばす（上限の秒数）
+MAX_BACKOFF = 600.0
+
+# 1秒あたりの書き込みがこれを超えていたら作業を見送る（環境変数 QA_APP_MAINTENANCE_BUSY_WPS で変更可能）
+# 変更履歴の変更番号の増え方で数えるので、他のプロセスの書き込みを含み、メンテナンス自身の書き込みは含まない
+BUSY_WRITES_PER_SEC = float(os.environ.get('QA_APP_MAINTENANCE_BUSY_WPS', '20'))
+
+# PRAGMA optimize（統計が無ければ ANALYZE）を実行する間隔（秒）
+OPTIMIZE_INTERVAL = 3600.0
+
+# ANALYZE でインデックスごとに調べる行数の上限（大きな表でも短時間で終わらせる）
+ANALYSIS_LIMIT = 1000
+
+# WALファイルがこの大きさ（MB）を超えたらチェックポイントして切り詰める（環境変数 QA_APP_CHECKPOINT_WAL_MB で変更可能）
+CHECKPOINT_WAL_MB = float(os.environ.get('QA_APP_CHECKPOINT_WAL_MB', '64'))
+
+# 空きページがこの数を超えたら incremental_vacuum で返す
+VACUUM_MIN_FREE_PAGES = 1000
+
+# 1回の書き込みで返すページ数（ライターを長く占有しないよう小分けにする）
+VACUUM_PAGES_PER_STEP = 500
+
+# 古い変更履歴を消す間隔（秒）
+PRUNE_INTERVAL = 86400.0
+
+# PRAGMA auto_vacuum の値
+_AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def _targets(conn):
+    """メンテナンスの対象: [(スキーマ, ファイルのパス)]（アーカイブDBがあれば含める）"""
+    pool = db_pool.get_pool()
+    targets = [('main', pool.db_path)]
+    if attach_archive(conn):
+        targets.append((ARCHIVE_SCHEMA, pool.archive_path))
+    return targets
+
+
+def _pragma(conn, schema, name):
+    return conn.execute(f"PRAGMA {schema}.{name}").fetchone()[0]
+
+
+def _wal_bytes(path):
+    wal = path + '-wal'
+    return os.path.getsize(wal) if os.path.exists(wal) else 0
+
+
+def _analyzed(conn, schema):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+
+
+def optimize(force=False):
+    """クエリプランナーの統計を更新する
+
+    統計（sqlite_stat1）がまだ無いスキーマは ANALYZE、あれば PRAGMA optimize で必要な表だけを調べ直す。
+    force なら常に ANALYZE する。戻り値: {'analyzed': ANALYZE したスキーマ}
+    """
+    def _op(conn):
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}").fetchall()
+        analyzed = []
+        for schema, _ in _targets(conn):
+            if force or not _analyzed(conn, schema):
+                conn.execute(f"ANALYZE {schema}")
+                analyzed.append(schema)
+            else:
+                conn.execute(f"PRAGMA {schema}.optimize").fetchall()
+        return {'analyzed': analyzed}
+    return run_write(_op)
+
+
+def checkpoint(force=False):
+    """WALファイルが CHECKPOINT_WAL_MB を超えていたらチェックポイントして切り詰める
+
+    まず PASSIVE（書き込みを止めない）で書き戻し、読み取り中の接続が無く全部書き戻せたときだけ
+    TRUNCATE でファイルを空にする。戻り値: {スキーマ: {'wal_bytes', 'frames', 'checkpointed', 'truncated_bytes'}}
+    """
+    threshold = CHECKPOINT_WAL_MB * 1024 * 1024
+    results = {}
+    with get_connection() as conn:
+        for schema, path in _targets(conn):
+            before = _wal_bytes(path)
+            if not force and before < threshold:
+                continue
+            busy, frames, done = conn.execute(f"PRAGMA {schema}.wal_checkpoint(PASSIVE)").fetchone()
+            if busy == 0 and frames == done:
+                conn.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)").fetchall()
+            results[schema] = {'wal_bytes': before, 'frames': frames, 'checkpointed': done,
+                               'truncated_bytes': before - _wal_bytes(path)}
+    return results
+
+
+def incremental_vacuum(force=False, should_stop=None):
+    """空きページを VACUUM_PAGES_PER_STEP ずつファイルから返す（auto_vacuum=incremental のDBだけ）
+
+    空きページが VACUUM_MIN_FREE_PAGES 以下なら何もしない（force なら1ページからでも返す）。
+    should_stop() が真を返したらステップの間で止める。戻り値: {スキーマ: 返したページ数}
+    """
+    def _free_pages(schema):
+        def _op(conn):
+            attach_archive(conn)
+            return _pragma(conn, schema, 'auto_vacuum'), _pragma(conn, schema, 'freelist_count')
+        return run_write(_op)
+
+    def _step(schema):
+        def _op(conn):
+            attach_archive(conn)
+            before = _pragma(conn, schema, 'freelist_count')
+            # sqlite3 モジュールは行を返さない文を1回しか進めず、incremental_vacuum は1回で1ページしか返さないので、
+            # ページ数だけ実行する
+            for _ in range(min(before, VACUUM_PAGES_PER_STEP)):
+                conn.execute(f"PRAGMA {schema}.incremental_vacuum")
+            return before - _pragma(conn, schema, 'freelist_count')
+        return run_write(_op)
+
+    with get_connection() as conn:
+        schemas = [schema for schema, _ in _targets(conn)]
+    results = {}
+    for schema in schemas:
+        mode, free = _free_pages(schema)
+        if mode != 2 or free == 0 or (not force and free <= VACUUM_MIN_FREE_PAGES):
+            continue
+        reclaimed = 0
+        while True:
+            pages = _step(schema)
+            reclaimed += pages
+            if pages < VACUUM_PAGES_PER_STEP or (should_stop is not None and should_stop()):
+                break
+        results[schema] = reclaimed
+    return results
+
+
+def prune(force=False):
+    """CHANGE_RETENTION_DAYS より古い変更履歴を消す（force は他の作業と呼び方を揃えるためで使わない、戻り値: {'deleted': 行数}）"""
+    return {'deleted': prune_changes()}
+
+
+def enable_incremental_vacuum():
+    """既存のDBを auto_vacuum=incremental に切り替える（VACUUM でファイルを作り直すので、その間は書き込みが止まる）
+
+    新しく作るDBは db_pool の PRAGMA で最初から incremental になる。戻り値: 切り替えたスキーマ
+    """
+    pool = db_pool.get_pool()
+    conn = pool.dedicated_connection()
+    conn.isolation_level = None
+    try:
+        changed = []
+        for schema, _ in _targets(conn):
+            if _pragma(conn, schema, 'auto_vacuum') == 2:
+                continue
+            conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+            conn.execute(f"VACUUM {schema}")
+            changed.append(schema)
+        return changed
+    finally:
+        conn.close()
+
+
+def database_status():
+    """スキーマごとのページ数・空きページ数・auto_vacuum・WALの大きさ・統計の有無"""
+    status = {}
+    with get_connection() as conn:
+        for schema, path in _targets(conn):
+            status[schema] = {
+                'path': path,
+                'pages': _pragma(conn, schema, 'page_count'),
+                'free_pages': _pragma(conn, schema, 'freelist_count'),
+                'auto_vacuum': _AUTO_VACUUM_MODES.get(_pragma(conn, schema, 'auto_vacuum'), '?'),
+                'wal_bytes': _wal_bytes(path),
+                'analyzed': _analyzed(conn, schema),
+            }
+    return status
+
+
+# 作業: 名前 -> (関数, 実行する間隔の秒数（0は確かめるたび）)
+# checkpoint / vacuum は閾値を超えたときだけ実際に作業するので、確かめるたびに呼ぶ
+TASKS = {
+    'checkpoint': (checkpoint, 0.0),
+    'vacuum': (incremental_vacuum, 0.0),
+    'optimize': (optimize, OPTIMIZE_INTERVAL),
+    'prune': (prune, PRUNE_INTERVAL),
+}
+
+
+class MaintenanceScheduler:
+    """書き込みの少ないときにメンテナンス作業を実行するバックグラウンドスレッド
+
+    CHECK_INTERVAL ごとに書き込みの頻度を測り、BUSY_WRITES_PER_SEC を超えていれば何もせずに
+    次に確かめるまでの間隔を倍にする（MAX_BACKOFF まで）。空いていれば期限の来た作業を順に実行する。
+    作業ごとの所要時間と返したページ数は stats() で確認できる。
+    """
+
+    def __init__(self, pool, interval=CHECK_INTERVAL):
+        self.pool = pool
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_run = {}
+        self._tasks = {}
+        self._backoffs = 0
+        self._wait = interval
+        self._last_writes = None
+
+        self._thread = threading.Thread(target=self._run, name='qa_app-maintenance', daemon=True)
+        self._thread.start()
+
+    def write_rate(self):
+        """前回測ってからの1秒あたりの書き込み数（初回は0）"""
+        now, writes = time.monotonic(), latest_change_seq()
+        last, self._last_writes = self._last_writes, (now, writes)
+        if last is None or now <= last[0]:
+            return 0.0
+        return max(0, writes - last[1]) / (now - last[0])
+
+    def busy(self):
+        """書き込みが多く、作業を見送るべきか"""
+        # このプロセスの書き込みキューに待ちがあれば、頻度に関わらず見送る
+        return (write_queue_stats().get('queued', 0) > 0
+                or self.write_rate() > BUSY_WRITES_PER_SEC)
+
+    def _record(self, name, seconds, result):
+        pages = sum(result.values()) if name == 'vacuum' else 0
+        with self._lock:
+            task = self._tasks.setdefault(name, {'runs': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'pages': 0,
+                                                 'last_ms': 0.0, 'last_at': None, 'last_result': None})
+            task['runs'] += 1
+            task['total_ms'] += seconds * 1000.0
+            task['max_ms'] = max(task['max_ms'], seconds * 1000.0)
+            task['last_ms'] = seconds * 1000.0
+            task['last_at'] = now_stamp()[0]
+            task['last_result'] = result
+            task['pages'] += pages
+        if result:
+            logger.info("メンテナンス %s: %.0fms %s", name, seconds * 1000.0, result)
+
+    def run_due(self):
+        """期限の来た作業を実行する（途中で書き込みが増えたら残りは次回に回す、戻り値: 実行した作業名）"""
+        done = []
+        for name, (func, interval) in TASKS.items():
+            last = self._last_run.get(name)
+            if last is not None and time.monotonic() - last < interval:
+                continue
+            if done and self.busy():
+                break
+            started = time.perf_counter()
+            try:
+                result = func(should_stop=self.busy) if name == 'vacuum' else func()
+            except sqlite3.Error as e:
+                logger.warning("メンテナンス %s に失敗しました: %s", name, e)
+                continue
+            finally:
+                self._last_run[name] = time.monotonic()
+            self._record(name, time.perf_counter() - started, result)
+            done.append(name)
+        return done
+
+    def _run(self):
+        self.write_rate()
+        while not self._stop.wait(self._wait):
+            try:
+                if self.busy():
+                    with self._lock:
+                        self._backoffs += 1
+                    self._wait = min(self._wait * 2, MAX_BACKOFF)
+                    continue
+                self._wait = self.interval
+                self.run_due()
+            except Exception as e:
+                # 作業の失敗でスレッドは止めない
+                logger.exception("メンテナンスの実行に失敗しました: %s", e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'next_check_seconds': self._wait,
+                'backoffs': self._backoffs,
+                'tasks': {name: dict(task) for name, task in self._tasks.items()},
+            }
+
+    def close(self, timeout=30.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_maintenance():
+    """共通プールのDBのメンテナンスを始める（既に動いていれば何もしない、QA_APP_MAINTENANCE=0 なら None）"""
+    global _scheduler
+    if not ENABLED:
+        return None
+    pool = db_pool.get_pool()
+    scheduler = _scheduler
+    if scheduler is not None and scheduler.pool is pool:
+        return scheduler
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler.pool is not pool:
+            if _scheduler is not None:
+                _scheduler.close()
+            _scheduler = MaintenanceScheduler(pool)
+        return _scheduler
+
+
+def maintenance_stats():
+    return _scheduler.stats() if _scheduler is not None else {}
+
+
+@atexit.register
+def _shutdown():
+    if _scheduler is not None:
+        _scheduler.close()
+
+
+def _print_status():
+    for schema, info in database_status().items():
+        print(f"{schema}: {info['path']}")
+        print(f"  ページ数 {info['pages']} / 空きページ {info['free_pages']} / auto_vacuum={info['auto_vacuum']} / "
+              f"WAL {info['wal_bytes'] / 1024 / 1024:.1f}MB / 統計 {'あり' if info['analyzed'] else 'なし'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="データベースのメンテナンス（ANALYZE・optimize・チェックポイント・incremental vacuum）")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    parser.add_argument("--task", action="append", choices=list(TASKS),
+                        help="実行する作業（複数指定可、既定: すべて）")
+    parser.add_argument("--force", action="store_true",
+                        help="閾値に関わらず実行する（チェックポイント・空きページの返却、ANALYZE のやり直し）")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--daemon", action="store_true", help="バックグラウンドと同じ間隔で実行し続ける（Ctrl+C で終了）")
+    group.add_argument("--status", action="store_true", help="ページ数・空きページ数・WALの大きさを表示する")
+    group.add_argument("--enable-incremental-vacuum", action="store_true",
+                       help="既存のDBを auto_vacuum=incremental に切り替える（VACUUM の間は書き込みが止まる）")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db_pool.configure(args.db)
+
+    if args.status:
+        _print_status()
+        return 0
+
+    if args.enable_incremental_vacuum:
+        try:
+            changed = enable_incremental_vacuum()
+        except sqlite3.Error as e:
+            print(f"切り替えに失敗しました: {e}")
+            return 1
+        print(f"auto_vacuum=incremental に切り替えました: {', '.join(changed)}" if changed
+              else "すでに auto_vacuum=incremental です")
+        return 0
+
+    if args.daemon:
+        scheduler = MaintenanceScheduler(db_pool.get_pool())
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.close()
+            return 0
+
+    failed = False
+    for name in args.task or list(TASKS):
+        func = TASKS[name][0]
+        started = time.perf_counter()
+        try:
+            result = func(force=args.force)
+        except sqlite3.Error as e:
+            print(f"{name}: 失敗しました: {e}")
+            failed = True
+            continue
+        print(f"{name}: {(time.perf_counter() - started) * 1000:.0f}ms {result or '（閾値未満のため何もしませんでした）'}")
+    _print_status()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadCache:
+    """世代番号で無効化するプロセス内の読み取りキャッシュ（LRU）
+
+    一覧や検索のように質問全体に依存する結果は全体の世代番号で、
+    回答スレッドのように特定の質問だけに依存する結果は質問ごとの
+    世代番号で有効性を判定する。書き込み側は invalidate() で世代を
+    進めるだけでよく、古いエントリは参照時に破棄される。
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._global_gen = 0
+        self._question_gens = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _stamp(self, question_ids):
+        if question_ids is None:
+            return self._global_gen
+        return tuple(self._question_gens.get(qid, 0) for qid in question_ids)
+
+    def lookup(self, key, question_ids=None):
+        """(ヒットしたか, 値, 世代スタンプ) を返す
+
+        ミスした場合は、クエリを実行する前に取ったスタンプを store() に渡す。
+        クエリ中に書き込みがあれば、そのスタンプは既に古いので保存した値は使われない。
+        """
+        if question_ids is not None:
+            question_ids = tuple(question_ids)
+        with self._lock:
+            stamp = self._stamp(question_ids)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_stamp, entry_question_ids, stored_at, value = entry
+                expired = self.ttl is not None and time.monotonic() - stored_at > self.ttl
+                if entry_stamp == stamp and entry_question_ids == question_ids and not expired:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return True, value, (question_ids, stamp)
+                del self._entries[key]
+            self._misses += 1
+            return False, None, (question_ids, stamp)
+
+    def store(self, key, stamp, value):
+        question_ids, gen = stamp
+        with self._lock:
+            self._entries[key] = (gen, question_ids, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def invalidate(self, question_ids=()):
+        """書き込み後に呼ぶ。一覧系は常に、指定した質問の回答スレッドも無効になる"""
+        with self._lock:
+            self._global_gen += 1
+            for qid in question_ids:
+                if qid is not None:
+                    self._question_gens[qid] = self._question_gens.get(qid, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._global_gen += 1
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': self._hits / total if total else 0.0,
+            }
+
+
+def _env_ttl():
+    value = os.environ.get('QA_APP_CACHE_TTL')
+    return float(value) if value else None
+
+
+# プロセス共通のキャッシュ（サイズは QA_APP_CACHE_SIZE、有効期限は QA_APP_CACHE_TTL 秒で変更可能）
+read_cache = ReadCache(
+    max_entries=int(os.environ.get('QA_APP_CACHE_SIZE', '1024')),
+    ttl=_env_ttl(),
+)
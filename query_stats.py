@@ -0,0 +1,239 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from log_config import get_logger
+
+logger = get_logger('query_stats')
+
+# 遅いクエリとみなす閾値（ミリ秒、環境変数 QA_APP_SLOW_QUERY_MS で変更可能）
+SLOW_QUERY_MS = float(os.environ.get('QA_APP_SLOW_QUERY_MS', '100'))
+
+# パーセンタイル計算に使う直近のサンプル数
+SAMPLE_SIZE = 2048
+
+# 保持する遅いクエリの件数
+SLOW_LOG_SIZE = 200
+
+# 実行中の data_handler 関数名
+_current_function = contextvars.ContextVar('qa_app_function', default='-')
+
+# capture_queries() 中に実行したSQLの記録先
+_captured = contextvars.ContextVar('qa_app_captured_queries', default=None)
+
+
+class LatencyHistogram:
+    """件数・合計・最大と直近サンプルからのパーセンタイル"""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self._samples = deque(maxlen=sample_size)
+
+    def add(self, elapsed_ms, rows=0):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        self._samples.append(elapsed_ms)
+
+    def percentile(self, p):
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'rows': self.rows,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms,
+        }
+
+
+_lock = threading.Lock()
+_functions = {}
+_queries = {}
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def fingerprint(sql):
+    """リテラルとIN句の長さを正規化したSQL（集計キー）"""
+    text = _WHITESPACE.sub(' ', sql).strip()
+    text = _STRING_LITERAL.sub('?', text)
+    text = _NUMBER_LITERAL.sub('?', text)
+    return _PLACEHOLDER_LIST.sub('?+', text)
+
+
+def configure(slow_query_ms=None):
+    global SLOW_QUERY_MS
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = float(slow_query_ms)
+
+
+def instrumented(func):
+    """data_handler の公開関数に付けて、呼び出し全体の所要時間を関数ごとに集計する
+
+    ジェネレータ関数の場合は、呼び出し側が次の行を受け取るまでの時間だけを合計する
+    （行を受け取った後の呼び出し側の処理は含めない）。
+    """
+    if inspect.isgeneratorfunction(func):
+        return _instrumented_generator(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_function.set(func.__name__)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            _current_function.reset(token)
+            with _lock:
+                _functions.setdefault(func.__name__, LatencyHistogram()).add(elapsed_ms)
+    return wrapper
+
+
+def _instrumented_generator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 関数名はこのジェネレータ専用のコンテキストに設定し、再開のたびにその中で実行する
+        context = contextvars.copy_context()
+        context.run(_current_function.set, func.__name__)
+        generator = func(*args, **kwargs)
+        elapsed_ms = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = context.run(next, generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed_ms += (time.perf_counter() - start) * 1000.0
+                yield item
+        finally:
+            context.run(generator.close)
+            with _lock:
+                _functions.setdefault(func.__name__, LatencyHistogram()).add(elapsed_ms)
+    return wrapper
+
+
+def _explain(cursor, sql, params):
+    try:
+        plan = cursor.connection.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        return [row[3] for row in plan]
+    except Exception as e:  # 計測のための補助情報なので失敗しても本処理には影響させない
+        return [f'EXPLAIN失敗: {e}']
+
+
+def run_query(cursor, sql, params=(), fetch='all'):
+    """SQLを実行して結果を取得し、所要時間と行数を記録する
+
+    fetch: 'all' は fetchall() の結果、'one' は fetchone() の結果、None は取得しない（更新系）、
+    'iter' は実行済みのカーソル（呼び出し側が1行ずつ読む。計測は実行までで行数は数えない）
+    """
+    start = time.perf_counter()
+    cursor.execute(sql, params)
+    if fetch == 'all':
+        result = cursor.fetchall()
+        rows = len(result)
+    elif fetch == 'one':
+        result = cursor.fetchone()
+        rows = 0 if result is None else 1
+    elif fetch == 'iter':
+        result = cursor
+        rows = 0
+    else:
+        result = None
+        rows = max(cursor.rowcount, 0)
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+
+    function = _current_function.get()
+    captured = _captured.get()
+    if captured is not None:
+        captured.append((function, sql, tuple(params)))
+    key = fingerprint(sql)
+    with _lock:
+        _queries.setdefault((function, key), LatencyHistogram()).add(elapsed_ms, rows)
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        entry = {
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'function': function,
+            'fingerprint': key,
+            'params': repr(params)[:200],
+            'rows': rows,
+            'elapsed_ms': elapsed_ms,
+            'plan': _explain(cursor, sql, params),
+        }
+        with _lock:
+            _slow_log.append(entry)
+        logger.warning("遅いクエリ %.1fms (%s): %s", elapsed_ms, function, key)
+    return result
+
+
+@contextmanager
+def capture_queries():
+    """ブロック内で run_query が実行したSQLを [(関数名, SQL, パラメータ)] に記録する（実行計画の検査用）"""
+    captured = []
+    token = _captured.set(captured)
+    try:
+        yield captured
+    finally:
+        _captured.reset(token)
+
+
+def snapshot():
+    """関数別・クエリ別の統計と遅いクエリログ"""
+    with _lock:
+        functions = [dict(function=name, **hist.summary()) for name, hist in _functions.items()]
+        for row in functions:
+            del row['rows']  # 行数はクエリ単位でのみ集計する
+        queries = [dict(function=function, fingerprint=key, **hist.summary())
+                   for (function, key), hist in _queries.items()]
+        slow = list(_slow_log)
+    functions.sort(key=lambda r: r['p95_ms'], reverse=True)
+    queries.sort(key=lambda r: r['avg_ms'] * r['count'], reverse=True)
+    return {
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'slow_query_ms': SLOW_QUERY_MS,
+        'functions': functions,
+        'queries': queries,
+        'slow_queries': slow,
+    }
+
+
+def export_json(path=None):
+    data = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    return data
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+        _queries.clear()
+        _slow_log.clear()
@@ -0,0 +1,105 @@
+import functools
+from dataclasses import dataclass, field, fields
+
+# data_handler が返すレコード型
+# 行ごとの dict の代わりに __slots__ 付きのデータクラスを使い、列は位置ではなく列名（SELECT の別名）で対応付ける。
+# *_at は表示用の文字列、*_ts は並べ替え・期間の絞り込みに使うUNIX時刻（秒）。
+# 読み取りキャッシュが同じオブジェクトを複数の呼び出し元に返すので、受け取った側で書き換えないこと。
+
+
+@dataclass(slots=True)
+class Question:
+    """質問（一覧では content / thank_message を含まない。検索結果は snippet / score を持つ。archived はアーカイブDBの質問）"""
+    id: int
+    title: str
+    content: str | None = None
+    category: str | None = None
+    tags: str | None = None
+    ldap_id: str | None = None
+    created_at: str | None = None
+    created_ts: int | None = None
+    resolved: int = 0
+    best_answer_id: int | None = None
+    thank_message: str | None = None
+    user_name: str = "Unknown"
+    answer_count: int = 0
+    last_activity_at: str | None = None
+    last_activity_ts: int | None = None
+    snippet: str | None = None
+    score: float | None = None
+    archived: int = 0
+
+
+@dataclass(slots=True)
+class Answer:
+    id: int
+    content: str
+    posted_at: str | None = None
+    updated_at: str | None = None
+    posted_ts: int | None = None
+    updated_ts: int | None = None
+    user_name: str = "Unknown"
+    is_best: int = 0
+    ldap_id: str | None = None
+    question_id: int | None = None
+
+
+@dataclass(slots=True)
+class LeaderboardEntry:
+    category: str
+    rank: int
+    ldap_id: str
+    user_name: str
+    value: int
+
+
+@dataclass(slots=True)
+class ChangeSet:
+    """get_changes_since の結果（seq は次に渡す変更番号）
+
+    questions は変更のあった質問の現在の行（一覧と同じ列）、answers は変更のあった回答の現在の行。
+    reset が True なら差分を当てられない（履歴が消えた・変更が多すぎる）ので、一覧を読み直す。
+    """
+    seq: int
+    reset: bool = False
+    questions: list = field(default_factory=list)
+    deleted_question_ids: list = field(default_factory=list)
+    answers: list = field(default_factory=list)
+    deleted_answer_ids: list = field(default_factory=list)
+
+
+@functools.lru_cache(maxsize=None)
+def _constructor(cls, names):
+    """列名の並び names の行から cls を作る関数（列の組み合わせごとに一度だけ生成する）"""
+    unknown = [name for name in names if name not in {f.name for f in fields(cls)}]
+    if unknown:
+        raise ValueError(f"{cls.__name__} に対応しない列があります: {', '.join(unknown)}")
+    # 行ごとに dict を作らないよう、キーワード引数で直接呼ぶ関数を生成する
+    args = ', '.join(f'{name}=row[{i}]' for i, name in enumerate(names))
+    namespace = {'cls': cls}
+    exec(f'def construct(row):\n    return cls({args})', namespace)
+    return namespace['construct']
+
+
+def record_factory(cls):
+    """cursor.row_factory に設定すると、各行を cls のレコードとして返す
+
+    列は cursor.description の列名（SELECT の別名）で対応付ける。
+    対応付けは文の実行ごとに一度だけ求める。
+    """
+    cache = [None, None]
+
+    def factory(cursor, row):
+        description = cursor.description
+        if description is not cache[0]:
+            cache[0] = description
+            cache[1] = _constructor(cls, tuple(column[0] for column in description))
+        return cache[1](row)
+    return factory
+
+
+def record_cursor(conn, cls):
+    """行を cls のレコードとして返すカーソル"""
+    c = conn.cursor()
+    c.row_factory = record_factory(cls)
+    return c
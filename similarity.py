@@ -0,0 +1,478 @@
+import argparse
+import atexit
+import math
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+import db_pool
+from db_pool import get_connection
+from log_config import get_logger
+
+try:
+    import numpy as np
+except ImportError:  # NumPy が無い環境では純Pythonで集計する（ディスクへの保存は行わない）
+    np = None
+
+logger = get_logger('similarity')
+
+# インデックスの保存先（環境変数 QA_APP_SIMILARITY_INDEX で変更可能、既定はDBファイルの隣）
+INDEX_PATH = os.environ.get('QA_APP_SIMILARITY_INDEX')
+
+# 文字n-gramの長さ（日本語は分かち書きせずに2〜3文字単位で比較する）
+NGRAM_SIZES = (2, 3)
+
+# タイトルの語の重み（本文より強く効かせる）
+TITLE_WEIGHT = 2
+
+# 検索時に無視する語: 全体のこの割合を超える質問に出てくる語（「ですか」など）
+MAX_DF_RATIO = 0.5
+
+# 前回の全構築時からこの倍率まで件数が増えたら、起動時にIDFを付け直すため全体を作り直す
+REBUILD_GROWTH = 2.0
+
+# 追加がこの件数たまったらバックグラウンドのスレッドでディスクに書き出す（残りは終了時に書き出す）
+SAVE_EVERY = 20
+
+# 他のプロセスが追加した質問を取り込むためにDBを確認する間隔（秒）
+SYNC_INTERVAL = 30.0
+
+# 保存形式のバージョン（互換性のない変更をしたら上げる）
+FORMAT_VERSION = 1
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """全角/半角・大文字/小文字の違いをそろえる"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def ngrams(text):
+    """文字n-gramの出現回数（記号や空白をまたぐn-gramは作らない）"""
+    counts = Counter()
+    for word in _WORD.findall(normalize_text(text)):
+        if len(word) < NGRAM_SIZES[0]:
+            counts[word] += 1
+            continue
+        for n in NGRAM_SIZES:
+            for i in range(len(word) - n + 1):
+                counts[word[i:i + n]] += 1
+    return counts
+
+
+def question_terms(title, content):
+    counts = ngrams(content)
+    for gram, count in ngrams(title).items():
+        counts[gram] += count * TITLE_WEIGHT
+    return counts
+
+
+def default_index_path(db_path):
+    return INDEX_PATH or os.path.splitext(db_path)[0] + '.simidx.npz'
+
+
+class SimilarityIndex:
+    """質問のタイトルと本文の文字n-gram TF-IDFによる類似検索インデックス
+
+    語ごとに (文書位置, 重み) の転置リストを持ち、検索では問い合わせに含まれる
+    語の転置リストだけを足し合わせてコサイン類似度を求める。転置リストは
+    array に追記していくので、質問の追加はその質問の語の分だけで済む。
+    文書ベクトルは追加時点のIDFで正規化し、問い合わせ側は現在のIDFを使う。
+    NumPy があれば集計を配列演算で行い、.npz に保存して次回の起動時に読み込む。
+    """
+
+    def __init__(self, pool, path=None):
+        self.pool = pool
+        self.path = path or default_index_path(pool.db_path)
+        self._lock = threading.RLock()
+        # 書き出しどうしの排他（書き出し中も _lock は持たないので、検索や追加を止めない）
+        self._save_lock = threading.Lock()
+        self._saver = None
+        self._reset()
+        self._dirty = 0
+        self._synced_at = 0.0
+
+    def _reset(self):
+        self._terms = {}
+        self._term_names = []    # 語ID -> 語（追記のみ、書き出しで使う）
+        self._df = array('i')
+        self._docs = []          # 語ID -> 文書位置の array('i')
+        self._weights = []       # 語ID -> 重みの array('f')
+        self._doc_ids = array('i')
+        self._positions = {}     # 質問ID -> 文書位置
+        self._removed = set()
+        self._built_count = 0
+        self._max_id = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _idf(self, term_id, n_docs):
+        return math.log((1 + n_docs) / (1 + self._df[term_id])) + 1.0
+
+    def _add(self, question_id, title, content):
+        if question_id in self._positions:
+            self._remove(question_id)
+        counts = question_terms(title, content)
+        position = len(self._doc_ids)
+        self._doc_ids.append(question_id)
+        self._positions[question_id] = position
+        self._max_id = max(self._max_id, question_id)
+
+        term_ids = []
+        for gram in counts:
+            term_id = self._terms.get(gram)
+            if term_id is None:
+                term_id = self._terms[gram] = len(self._df)
+                self._term_names.append(gram)
+                self._df.append(0)
+                self._docs.append(array('i'))
+                self._weights.append(array('f'))
+            self._df[term_id] += 1
+            term_ids.append(term_id)
+
+        n_docs = len(self._positions)
+        weights = [(1.0 + math.log(count)) * self._idf(term_id, n_docs)
+                   for term_id, count in zip(term_ids, counts.values())]
+        norm = math.sqrt(sum(w * w for w in weights)) or 1.0
+        for term_id, weight in zip(term_ids, weights):
+            self._docs[term_id].append(position)
+            self._weights[term_id].append(weight / norm)
+
+    def _remove(self, question_id):
+        # 転置リストからは消さず、検索結果から除外するだけにする（次の全構築で詰める）
+        position = self._positions.pop(question_id, None)
+        if position is not None:
+            self._removed.add(position)
+
+    def add_question(self, question_id, title, content):
+        """質問を追加する（同じIDが既にあれば置き換える）
+
+        ディスクへの書き出しは呼び出し元（質問の投稿）で待たず、SAVE_EVERY 件ごとにバックグラウンドで行う。
+        """
+        with self._lock:
+            self._add(question_id, title, content)
+            self._dirty += 1
+            dirty = self._dirty
+        if dirty >= SAVE_EVERY:
+            self._save_in_background()
+
+    def remove_question(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+            self._dirty += 1
+
+    def _questions_source(self, conn):
+        """索引の対象にする質問（アーカイブDBへ移した質問も含め、移動中で両方にある質問は本体の分だけ）"""
+        if not self.pool.attach_archive(conn):
+            return 'questions'
+        return f'''(SELECT id, title, content FROM main.questions
+                    UNION ALL
+                    SELECT id, title, content FROM {db_pool.ARCHIVE_SCHEMA}.questions
+                    WHERE id NOT IN (SELECT id FROM main.questions))'''
+
+    def rebuild(self):
+        """DBの全質問（アーカイブDBを含む）から作り直す"""
+        started = time.perf_counter()
+        with self._lock, get_connection() as conn:
+            self._reset()
+            for question_id, title, content in conn.execute(
+                    f'SELECT id, title, content FROM {self._questions_source(conn)} ORDER BY id'):
+                self._add(question_id, title, content)
+            self._built_count = len(self._positions)
+            self._dirty += 1
+            self._synced_at = time.monotonic()
+        logger.info("類似質問インデックスを構築しました: %d件, 語彙 %d, %.0fms",
+                    len(self), len(self._terms), (time.perf_counter() - started) * 1000.0)
+
+    def sync(self):
+        """インデックスにない質問を取り込む（削除された質問があれば全体を作り直す）"""
+        with self._lock, get_connection() as conn:
+            # アーカイブへ移した質問は削除ではないので、合わせて数えれば作り直しにならない
+            source = self._questions_source(conn)
+            total, max_id = conn.execute(f'SELECT COUNT(*), MAX(id) FROM {source}').fetchone()
+            needs_rebuild = (max_id or 0) < self._max_id or total < len(self._positions)
+            if not needs_rebuild:
+                added = 0
+                for question_id, title, content in conn.execute(
+                        f'SELECT id, title, content FROM {source} WHERE id > ? ORDER BY id',
+                        (self._max_id,)):
+                    self._add(question_id, title, content)
+                    added += 1
+                if added:
+                    self._dirty += added
+                    logger.info("類似質問インデックスに %d件を取り込みました", added)
+            self._synced_at = time.monotonic()
+        if needs_rebuild:
+            self.rebuild()
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._synced_at > SYNC_INTERVAL:
+            self.sync()
+
+    def _query_terms(self, text):
+        n_docs = len(self._positions)
+        max_df = MAX_DF_RATIO * n_docs if n_docs >= 100 else n_docs
+        terms = []
+        norm = 0.0
+        for gram, count in ngrams(text).items():
+            term_id = self._terms.get(gram)
+            # 未知の語も正規化には含める（質問が増えて語彙が広がっても類似度の尺度を変えない）
+            idf = self._idf(term_id, n_docs) if term_id is not None else math.log(1 + n_docs) + 1.0
+            weight = (1.0 + math.log(count)) * idf
+            norm += weight * weight
+            if term_id is not None and self._df[term_id] <= max_df:
+                terms.append((term_id, weight))
+        norm = math.sqrt(norm) or 1.0
+        return [(term_id, w / norm) for term_id, w in terms]
+
+    def search(self, text, k=5, min_score=0.0):
+        """text に似た質問の [(質問ID, 類似度), ...] を類似度の高い順に返す"""
+        self._maybe_sync()
+        with self._lock:
+            terms = self._query_terms(text)
+            if not terms:
+                return []
+            if np is not None:
+                return self._search_numpy(terms, k, min_score)
+            scores = defaultdict(float)
+            for term_id, query_weight in terms:
+                for position, weight in zip(self._docs[term_id], self._weights[term_id]):
+                    scores[position] += query_weight * weight
+            ranked = nlargest(k + len(self._removed), scores.items(), key=lambda item: item[1])
+            return [(self._doc_ids[position], score) for position, score in ranked
+                    if position not in self._removed and score >= min_score][:k]
+
+    def _search_numpy(self, terms, k, min_score):
+        scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+        for term_id, query_weight in terms:
+            # 転置リスト内の文書位置は重複しないので、そのまま加算できる
+            positions = np.frombuffer(self._docs[term_id], dtype=np.int32)
+            scores[positions] += query_weight * np.frombuffer(self._weights[term_id], dtype=np.float32)
+        if self._removed:
+            scores[list(self._removed)] = 0.0
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._doc_ids[position], float(scores[position])) for position in top
+                if scores[position] > 0.0 and scores[position] >= min_score]
+
+    def _snapshot(self):
+        """書き出す内容のスナップショット（_lock を持って呼ぶ）
+
+        転置リストと文書IDは追記しかしない（作り直しでは別のオブジェクトに置き換える）ので、
+        ここでは各 array の長さと参照だけを控え、中身のコピーはロックの外で行う。
+        語ごとの件数（df）は上書きされるので、ここでコピーする。
+        """
+        return {
+            'dirty': self._dirty,
+            'meta': (FORMAT_VERSION, self._built_count, self._max_id),
+            'term_names': self._term_names,
+            'df': array('i', self._df),
+            'docs': self._docs,
+            'weights': self._weights,
+            'lengths': [len(docs) for docs in self._docs],
+            'doc_ids': self._doc_ids,
+            'doc_count': len(self._doc_ids),
+            'removed': sorted(self._removed),
+            'count': len(self),
+        }
+
+    def save(self):
+        """インデックスを .npz に書き出す（NumPy が無い場合は何もしない）
+
+        _lock を持つのはスナップショットを取る間だけで、配列の組み立てとファイルへの書き込みの間も
+        検索と追加は止まらない。
+        """
+        if np is None:
+            return False
+        if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+            # 一時ディレクトリのDBなどで保存先が既に無い場合
+            logger.warning("類似質問インデックスの保存先がありません: %s", self.path)
+            return False
+        with self._save_lock:
+            with self._lock:
+                snapshot = self._snapshot()
+            lengths = np.array(snapshot['lengths'], dtype=np.int64)
+            indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            pairs = list(zip(snapshot['docs'], snapshot['weights'], snapshot['lengths']))
+            arrays = {
+                'meta': np.array(snapshot['meta'], dtype=np.int64),
+                'terms': np.array(snapshot['term_names'][:len(lengths)], dtype=str),
+                'df': np.frombuffer(snapshot['df'], dtype=np.int32),
+                'indptr': indptr,
+                'docs': np.frombuffer(b''.join(docs[:n].tobytes() for docs, _, n in pairs), dtype=np.int32),
+                'weights': np.frombuffer(b''.join(w[:n].tobytes() for _, w, n in pairs), dtype=np.float32),
+                'doc_ids': np.frombuffer(snapshot['doc_ids'][:snapshot['doc_count']], dtype=np.int32),
+                'removed': np.array(snapshot['removed'], dtype=np.int32),
+            }
+            # 途中で落ちても壊れたファイルを残さないよう、一時ファイルに書いてから置き換える
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.path)
+            del arrays, pairs
+            with self._lock:
+                # 書き出している間に追加された分は次回に残す
+                self._dirty = max(0, self._dirty - snapshot['dirty'])
+        logger.info("類似質問インデックスを保存しました: %s (%d件)", self.path, snapshot['count'])
+        return True
+
+    def _save_quietly(self):
+        try:
+            self.save()
+        except Exception:
+            logger.exception("類似質問インデックスの保存に失敗しました")
+
+    def _save_in_background(self):
+        """書き出しをバックグラウンドのスレッドで始める（書き出し中なら何もしない、次の追加で再び呼ばれる）"""
+        if np is None:
+            return
+        with self._lock:
+            if self._saver is not None and self._saver.is_alive():
+                return
+            self._saver = threading.Thread(target=self._save_quietly, name='qa_app-similarity-save', daemon=True)
+            self._saver.start()
+
+    def load(self):
+        """保存済みのインデックスを読み込む（読めなければ False）"""
+        if np is None or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                version, built_count, max_id = (int(v) for v in data['meta'])
+                if version != FORMAT_VERSION:
+                    logger.info("類似質問インデックスの形式が古いため作り直します: %s", self.path)
+                    return False
+                terms = data['terms'].tolist()
+                indptr = data['indptr']
+                docs = data['docs']
+                weights = data['weights']
+                with self._lock:
+                    self._reset()
+                    self._terms = {term: term_id for term_id, term in enumerate(terms)}
+                    self._term_names = terms
+                    self._df = array('i', data['df'].tobytes())
+                    self._docs = [array('i', docs[start:end].tobytes())
+                                  for start, end in zip(indptr[:-1], indptr[1:])]
+                    self._weights = [array('f', weights[start:end].tobytes())
+                                     for start, end in zip(indptr[:-1], indptr[1:])]
+                    self._doc_ids = array('i', data['doc_ids'].tobytes())
+                    self._removed = set(data['removed'].tolist())
+                    self._positions = {qid: position for position, qid in enumerate(self._doc_ids)
+                                       if position not in self._removed}
+                    self._built_count = built_count
+                    self._max_id = max_id
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("類似質問インデックスを読み込めないため作り直します: %s", e)
+            return False
+        logger.info("類似質問インデックスを読み込みました: %s (%d件)", self.path, len(self))
+        return True
+
+    def open(self):
+        """保存済みのインデックスを読み込んでDBとの差分を取り込む（無ければ構築する）"""
+        if self.load() and len(self) < self._built_count * REBUILD_GROWTH:
+            self.sync()
+        else:
+            self.rebuild()
+        if self._dirty:
+            self.save()
+
+    def close(self):
+        """書き出し中のスレッドを待ち、残りの追加があれば書き出す"""
+        saver = self._saver
+        if saver is not None:
+            saver.join()
+        if self._dirty:
+            self.save()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """共通プールのデータベースに対応するインデックス（初回に読み込みまたは構築する）"""
+    global _index
+    pool = db_pool.get_pool()
+    index = _index
+    if index is not None and index.pool is pool:
+        return index
+    with _index_lock:
+        if _index is None or _index.pool is not pool:
+            if _index is not None:
+                _index.close()
+            index = SimilarityIndex(pool)
+            index.open()
+            _index = index
+        return _index
+
+
+def add_question(question_id, title, content):
+    """保存した質問をインデックスに追加する（インデックス未作成なら次回の構築に任せる）"""
+    index = _index
+    if index is not None and index.pool is db_pool.get_pool():
+        index.add_question(question_id, title, content)
+
+
+def find_similar(text, k=5, min_score=0.0):
+    return get_index().search(text, k, min_score)
+
+
+@atexit.register
+def _shutdown():
+    if _index is not None:
+        try:
+            _index.close()
+        except Exception:
+            logger.exception("類似質問インデックスの保存に失敗しました")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="類似質問インデックスの構築・検索")
+    parser.add_argument("--db", help="データベースファイルのパス（既定: QA_APP_DB または qa_app.db）")
+    parser.add_argument("--rebuild", action="store_true", help="DBの全質問からインデックスを作り直す")
+    parser.add_argument("--query", help="類似する質問を検索するテキスト")
+    parser.add_argument("-k", type=int, default=5, help="--query で表示する件数")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db_pool.configure(args.db)
+
+    if args.rebuild:
+        index = SimilarityIndex(db_pool.get_pool())
+        index.rebuild()
+        if index.save():
+            print(f"インデックスを保存しました: {index.path} ({len(index)}件)")
+        else:
+            print(f"インデックスを構築しました（NumPy が無いため保存していません）: {len(index)}件")
+        return 0
+
+    index = get_index()
+    if args.query:
+        started = time.perf_counter()
+        results = index.search(args.query, args.k)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        with get_connection() as conn:
+            for question_id, score in results:
+                row = conn.execute('SELECT title FROM questions WHERE id = ?', (question_id,)).fetchone()
+                print(f"{score:.3f}  #{question_id} {row[0] if row else '(削除済み)'}")
+        print(f"{len(results)}件 ({elapsed:.1f}ms)")
+        return 0
+
+    print(f"{index.path}: {len(index)}件, 語彙 {len(index._terms)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
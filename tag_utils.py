@@ -0,0 +1,30 @@
+import re
+import unicodedata
+
+# タグの区切り文字（NFKC正規化後のカンマと読点）
+_SEPARATORS = re.compile(r'[,、]')
+
+
+def normalize_tag(tag):
+    """全角英数字・半角カナなどの表記をNFKCで揃え、前後の空白を除く"""
+    return unicodedata.normalize('NFKC', tag).strip()
+
+
+def normalize_tags(tags):
+    """タグのリストまたはカンマ区切りの文字列を、空と重複を除いたリストにする（順序は保持）"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = [tags]
+    result = []
+    for value in tags:
+        for tag in _SEPARATORS.split(unicodedata.normalize('NFKC', value)):
+            tag = tag.strip()
+            if tag and tag not in result:
+                result.append(tag)
+    return result
+
+
+def join_tags(tags):
+    """questions.tags に保存するカンマ区切りの文字列"""
+    return ",".join(normalize_tags(tags))
@@ -0,0 +1,18 @@
+import pytest
+
+import db_init
+import db_pool
+from log_config import configure_logging
+from query_cache import read_cache
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """一時ディレクトリのデータベース（スキーマは最新）に共通プールを向ける"""
+    configure_logging(level="ERROR")
+    pool = db_pool.configure(str(tmp_path / "qa_app.db"))
+    read_cache.clear()
+    db_init.upgrade()
+    yield pool
+    pool.close()
+    read_cache.clear()
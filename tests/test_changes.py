@@ -0,0 +1,52 @@
+"""変更履歴からの差分取得（get_changes_since の差分と読み直しの判定）"""
+import data_handler
+import db_pool
+
+
+def _save_questions(count):
+    data_handler.signup("10000001", "田中")
+    return [data_handler.save_question(f"質問 {i}", "本文", "設計", ["配管"], "10000001") for i in range(count)]
+
+
+def test_changes_since_returns_changed_rows(temp_db):
+    ids = _save_questions(2)
+    seq = data_handler.latest_change_seq()
+    data_handler.add_answer(ids[0], "回答", "10000001")
+
+    changes = data_handler.get_changes_since(seq)
+    assert not changes.reset
+    assert changes.seq == data_handler.latest_change_seq()
+    assert [q.id for q in changes.questions] == [ids[0]]
+    assert [a.question_id for a in changes.answers] == [ids[0]]
+    # 追いついた後は空の差分
+    assert data_handler.get_changes_since(changes.seq).questions == []
+
+
+def test_reset_when_seq_ahead_of_database(temp_db):
+    _save_questions(1)
+    latest = data_handler.latest_change_seq()
+    # DBが作り直された（画面の番号の方が新しい）
+    changes = data_handler.get_changes_since(latest + 10)
+    assert changes.reset
+    assert changes.seq == latest
+
+
+def test_reset_when_history_pruned(temp_db):
+    _save_questions(3)
+    latest = data_handler.latest_change_seq()
+    with db_pool.get_connection() as conn:
+        conn.execute("DELETE FROM changes WHERE seq <= 2")
+        conn.commit()
+    assert data_handler.get_changes_since(0).reset
+    # 消した範囲より後からなら差分を返せる
+    assert not data_handler.get_changes_since(2).reset
+    assert data_handler.get_changes_since(2).seq == latest
+
+
+def test_reset_when_too_many_changes(temp_db):
+    _save_questions(4)
+    latest = data_handler.latest_change_seq()
+    changes = data_handler.get_changes_since(0, limit=3)
+    assert changes.reset
+    assert changes.seq == latest
+    assert not data_handler.get_changes_since(0, limit=latest).reset
@@ -0,0 +1,55 @@
+"""接続プールの貸し出しと返却（入れ子・逐次取得のジェネレーター）"""
+import threading
+
+import data_handler
+import db_pool
+
+
+def _save_questions(count=3):
+    for ldap_id, name in (("10000001", "田中"), ("10000002", "佐藤"), ("10000003", "鈴木")):
+        data_handler.signup(ldap_id, name)
+    return [data_handler.save_question(f"質問 {i}", "本文", "設計", ["配管"], "10000001") for i in range(count)]
+
+
+def test_nested_connection_released_by_last_holder(temp_db):
+    def hold():
+        with temp_db.connection() as conn:
+            yield conn
+
+    holder = hold()
+    inner = next(holder)
+    with temp_db.connection() as outer:
+        assert outer is inner
+        # 先に借りた側が抜けても、まだ使っている接続はプールへ戻さない
+        holder.close()
+        assert temp_db.stats()['in_use'] == 1
+        outer.execute("SELECT 1")
+    assert temp_db.stats()['in_use'] == 0
+
+
+def test_paused_iterator_uses_its_own_connection(temp_db):
+    _save_questions()
+    rows = data_handler.iter_questions()
+    next(rows)
+    with db_pool.get_connection() as conn:
+        assert temp_db.stats()['in_use'] == 2
+        rows.close()
+        assert temp_db.stats()['in_use'] == 1
+        conn.execute("SELECT COUNT(*) FROM questions").fetchone()
+    assert temp_db.stats()['in_use'] == 0
+
+
+def test_iterator_closed_on_another_thread(temp_db):
+    question_id = _save_questions(1)[0]
+    data_handler.add_answer(question_id, "回答1", "10000002")
+    data_handler.add_answer(question_id, "回答2", "10000003")
+    answers = data_handler.iter_answers(question_id)
+    next(answers)
+    with db_pool.get_connection() as conn:
+        # GCなどで別のスレッドから閉じられても、このスレッドが使っている接続は戻さない
+        closer = threading.Thread(target=answers.close)
+        closer.start()
+        closer.join()
+        assert temp_db.stats()['in_use'] == 1
+        assert conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] == 2
+    assert temp_db.stats()['in_use'] == 0
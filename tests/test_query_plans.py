@@ -0,0 +1,24 @@
+"""data_handler のクエリがインデックスを使っているかの検査（check_query_plans.py と同じ検査を pytest で実行する）"""
+import pytest
+
+import check_query_plans
+from log_config import configure_logging
+
+
+@pytest.fixture(scope="module")
+def plan_check():
+    # 合成データ・アーカイブDBへの移動・統計の収集は重いので、モジュールで一度だけ行う
+    configure_logging(level="ERROR")
+    return check_query_plans.run_check()
+
+
+def test_no_full_scan_or_temp_btree(plan_check):
+    violations, _ = plan_check
+    assert not violations, "インデックスを使わない実行計画があります:\n" + "\n".join(
+        f"  [{function}] {detail}\n      {sql}" for function, sql, detail in violations)
+
+
+def test_all_public_functions_checked(plan_check):
+    _, missing = plan_check
+    assert not missing, ("検査シナリオで呼ばれていない関数があります（check_query_plans.run_scenarios に追加してください）: "
+                         + ", ".join(missing))
@@ -0,0 +1,57 @@
+"""タグ別一覧（question_tags の並べ替えキーとページ送り）"""
+import data_handler
+import db_init
+import db_pool
+
+
+def _save_tagged_questions():
+    data_handler.signup("10000001", "田中")
+    tag_sets = [["配管"], ["配管", "腐食"], ["腐食"], ["配管", "腐食", "ポンプ"], ["ポンプ"], ["配管"], ["腐食", "配管"]]
+    ids = [data_handler.save_question(f"質問 {i}", "本文", "設計", tags, "10000001") for i, tags in enumerate(tag_sets)]
+    # 投稿日時をずらして並び順を決める（同じ日時の質問はIDの降順）
+    with db_pool.get_connection() as conn:
+        conn.executemany("UPDATE questions SET created_ts = ?1, last_activity_ts = ?1 WHERE id = ?2",
+                         [(1700000000 + (i // 2) * 60, qid) for i, qid in enumerate(ids)])
+        conn.commit()
+    return ids, tag_sets
+
+
+def _all_pages(tags, mode, **kwargs):
+    ids, cursor = [], None
+    while True:
+        page, cursor = data_handler.get_questions_by_tags(tags, mode, cursor=cursor, page_size=2, **kwargs)
+        ids += [q.id for q in page]
+        if cursor is None:
+            return ids
+
+
+def test_tag_pages_follow_sort_key(temp_db):
+    ids, tag_sets = _save_tagged_questions()
+    newest_first = sorted(range(len(ids)), key=lambda i: (i // 2, ids[i]), reverse=True)
+
+    def expected(tags, match):
+        return [ids[i] for i in newest_first if match(set(tags) & set(tag_sets[i]), set(tags))]
+
+    assert _all_pages(["配管"], 'or') == expected(["配管"], lambda hit, tags: hit)
+    # 複数のタグが付いた質問も1回だけ
+    assert _all_pages(["配管", "腐食"], 'or') == expected(["配管", "腐食"], lambda hit, tags: hit)
+    assert _all_pages(["配管", "腐食"], 'and') == expected(["配管", "腐食"], lambda hit, tags: hit == tags)
+    assert _all_pages(["配管", "未使用のタグ"], 'and') == []
+
+
+def test_tag_keys_follow_question_updates(temp_db):
+    ids, _ = _save_tagged_questions()
+    data_handler.add_answer(ids[1], "回答", "10000001")
+    answer_id = data_handler.get_answers(ids[1])[0].id
+    data_handler.resolve_question(ids[1], answer_id)
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE questions SET tags = '配管,バルブ' WHERE id = ?", (ids[2],))
+        conn.commit()
+        assert db_init.check_tag_keys(conn.cursor()) == []
+
+    resolved = _all_pages(["配管"], 'or', resolved_filter=True)
+    assert resolved == [ids[1]]
+    assert ids[1] not in _all_pages(["配管"], 'or', resolved_filter=False)
+    assert _all_pages(["バルブ"], 'or') == [ids[2]]
+    # 回答で最終アクティビティが最も新しくなる
+    assert _all_pages(["腐食"], 'or', sort='activity')[0] == ids[1]
@@ -0,0 +1,53 @@
+"""日時の整数列（旧形式の文字列の変換とマイグレーションでの補完）"""
+from datetime import datetime
+
+import pytest
+
+import db_init
+import db_pool
+from time_utils import to_epoch
+
+# 過去のバージョンが保存した形式（日付だけ・秒まで・datetime をそのまま保存したマイクロ秒付き）
+LEGACY_VALUES = [
+    ('2024-01-10', datetime(2024, 1, 10)),
+    ('2024-01-10 09:30:15', datetime(2024, 1, 10, 9, 30, 15)),
+    ('2024-01-10 09:30:15.123456', datetime(2024, 1, 10, 9, 30, 15)),
+]
+
+
+@pytest.mark.parametrize("value, expected", LEGACY_VALUES)
+def test_to_epoch_legacy_formats(value, expected):
+    assert to_epoch(value) == int(expected.timestamp())
+
+
+@pytest.mark.parametrize("value", [None, "", "不明", "2024-13-40"])
+def test_to_epoch_unreadable(value):
+    assert to_epoch(value) is None
+
+
+def test_migration_backfills_legacy_timestamps(tmp_path):
+    pool = db_pool.configure(str(tmp_path / "legacy.db"))
+    try:
+        # 整数列の無いバージョン 6 のスキーマに旧形式の日時で書き込んでおく
+        with pool.connection() as conn:
+            db_init.upgrade_connection(conn, target=6)
+            conn.execute("INSERT INTO users (ldap_id, name, created_at) VALUES ('10000001', '田中', '2024-01-10')")
+            conn.execute('''INSERT INTO questions (title, content, tags, ldap_id, created_at)
+                            VALUES ('質問', '本文', '配管', '10000001', '2024-01-10 09:30:15')''')
+            conn.execute('''INSERT INTO answers (question_id, content, ldap_id, posted_at, updated_at)
+                            VALUES (1, '回答', '10000001', '2024-01-11 08:00:00.123456', '2024-01-12')''')
+            conn.commit()
+
+        db_init.upgrade()
+
+        with pool.connection() as conn:
+            assert conn.execute("SELECT created_ts FROM users").fetchone()[0] == to_epoch('2024-01-10')
+            assert conn.execute("SELECT created_ts, last_activity_ts FROM questions").fetchone() == (
+                to_epoch('2024-01-10 09:30:15'), to_epoch('2024-01-12'))
+            assert conn.execute("SELECT posted_ts, updated_ts FROM answers").fetchone() == (
+                to_epoch('2024-01-11 08:00:00'), to_epoch('2024-01-12'))
+            # タグ別一覧の並べ替えキーにも写っている
+            assert conn.execute("SELECT created_ts FROM question_tags").fetchone()[0] == to_epoch('2024-01-10 09:30:15')
+            assert db_init.check_timestamps(conn.cursor()) == []
+    finally:
+        pool.close()
@@ -0,0 +1,123 @@
+"""書き込みキュー（グループコミット内の取り消し・満杯・ロック待ちの再試行）"""
+import sqlite3
+import threading
+import time
+import types
+
+import pytest
+
+import db_pool
+import write_queue
+from write_queue import WriteQueue, WriteQueueFull
+
+
+@pytest.fixture
+def table(temp_db):
+    with temp_db.connection() as conn:
+        conn.execute("CREATE TABLE items (name TEXT NOT NULL)")
+        conn.commit()
+    return temp_db
+
+
+def _insert(name, fail=False):
+    def op(conn):
+        conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+        if fail:
+            raise ValueError(name)
+        return name
+    return op
+
+
+def _names(pool):
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT name FROM items ORDER BY name")]
+
+
+def _block(writer):
+    """ライタースレッドを止めておく書き込みを積む（戻り値の Event で再開する）"""
+    started, release = threading.Event(), threading.Event()
+
+    def op(conn):
+        started.set()
+        release.wait(5)
+    future = writer.submit(op)
+    assert started.wait(5)
+    return future, release
+
+
+def test_failed_op_rolled_back_alone_in_group_commit(table):
+    writer = WriteQueue(table, group_commit_ms=50)
+    try:
+        blocker, release = _block(writer)
+        # 止めている間に積んだ書き込みは次の1回のコミットにまとまる
+        futures = [writer.submit(_insert("a")), writer.submit(_insert("b", fail=True)), writer.submit(_insert("c"))]
+        release.set()
+        blocker.result(5)
+        assert futures[0].result(5) == "a"
+        with pytest.raises(ValueError):
+            futures[1].result(5)
+        assert futures[2].result(5) == "c"
+        assert writer.stats()['max_batch'] == 3
+    finally:
+        writer.close()
+    assert _names(table) == ["a", "c"]
+    assert writer.stats()['failed'] == 1
+
+
+def test_full_queue_rejects_submit(table):
+    writer = WriteQueue(table, max_queue=1)
+    try:
+        blocker, release = _block(writer)
+        queued = writer.submit(_insert("a"))
+        with pytest.raises(WriteQueueFull):
+            writer.submit(_insert("b"), timeout=0.01)
+        assert writer.stats()['rejected'] == 1
+        release.set()
+        blocker.result(5)
+        assert queued.result(5) == "a"
+    finally:
+        writer.close()
+    assert _names(table) == ["a"]
+
+
+def _locked_writer(table, monkeypatch, release_after=None):
+    """別の接続が書き込みロックを持った状態のキュー（待機の sleep の回数で再試行を数える）"""
+    # ロック待ちですぐ失敗するようにビジータイムアウトを無くす
+    pool = db_pool.ConnectionPool(table.db_path, pragmas={**db_pool.DEFAULT_PRAGMAS, 'busy_timeout': 0}, timeout=0)
+    writer = WriteQueue(pool)
+    # ライターの接続（PRAGMA の適用）はロックを取る前に済ませておく
+    writer.execute(lambda conn: None, timeout=5)
+    holder = sqlite3.connect(table.db_path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if release_after is not None and len(sleeps) == release_after:
+            holder.execute("ROLLBACK")
+    monkeypatch.setattr(write_queue, 'time', types.SimpleNamespace(
+        monotonic=time.monotonic, perf_counter=time.perf_counter, sleep=sleep))
+    return writer, holder, sleeps
+
+
+def test_begin_retried_while_locked(table, monkeypatch):
+    writer, holder, sleeps = _locked_writer(table, monkeypatch, release_after=1)
+    try:
+        assert writer.execute(_insert("a"), timeout=5) == "a"
+    finally:
+        writer.close()
+        holder.close()
+    assert len(sleeps) == 1
+    assert _names(table) == ["a"]
+
+
+def test_gives_up_after_lock_retries(table, monkeypatch):
+    writer, holder, sleeps = _locked_writer(table, monkeypatch)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            writer.execute(_insert("a"), timeout=5)
+    finally:
+        writer.close()
+        holder.close()
+    assert len(sleeps) == write_queue.LOCK_RETRIES - 1
+    assert _names(table) == []
@@ -0,0 +1,94 @@
+import re
+from datetime import date, datetime, timedelta
+
+# 日時は表示用の文字列（*_at、ローカル時刻）と並べ替え・範囲検索用の整数（*_ts、UNIX時刻の秒）を併せて保存する
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 年度の開始月（4月〜翌3月）
+FISCAL_YEAR_START_MONTH = 4
+
+# fromisoformat で読めない旧形式（区切りを '-' に揃えた後で試す）
+_LEGACY_FORMATS = ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+                   "%Y%m%d%H%M%S", "%Y%m%d")
+
+
+def now_stamp(now=None):
+    """書き込み用の (表示用文字列, UNIX時刻) の組"""
+    now = now or datetime.now()
+    return now.strftime(TIMESTAMP_FORMAT), int(now.timestamp())
+
+
+def to_epoch(value):
+    """保存済みの日時をUNIX時刻（秒）にする（読めない値は None）
+
+    '2024-01-10' / '2024-01-10 09:00:00' / datetime をそのまま保存した '2024-01-10 09:00:00.123456' /
+    ISO 8601（'T' 区切り・タイムゾーン付き）/ '2024/01/10' / 数値（UNIX時刻）を受け付ける。
+    タイムゾーンの無い値はローカル時刻とみなす。
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day).timestamp())
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    if re.fullmatch(r'\d{9,11}(\.\d*)?', text):
+        return int(float(text))
+    text = re.sub(r'^(\d{4})[/.](\d{1,2})[/.](\d{1,2})', r'\1-\2-\3', text)
+    # 'YYYY-M-D' のような0埋めの無い日付を揃える
+    text = re.sub(r'^(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)',
+                  lambda m: f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}", text)
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        pass
+    for fmt in _LEGACY_FORMATS:
+        try:
+            return int(datetime.strptime(text, fmt).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+def _midnight(day):
+    return int(datetime(day.year, day.month, day.day).timestamp())
+
+
+def last_days(days, today=None):
+    """今日を含む直近 days 日間の期間 (開始, None)
+
+    開始は日付の境目にそろえるので、同じ日のうちは同じ値になる（読み取りキャッシュのキーが変わらない）。
+    """
+    today = today or date.today()
+    return _midnight(today - timedelta(days=days - 1)), None
+
+
+def fiscal_year_of(day=None):
+    """日付が属する年度（4月始まり、2025年3月は2024年度）"""
+    day = day or date.today()
+    return day.year if day.month >= FISCAL_YEAR_START_MONTH else day.year - 1
+
+
+def fiscal_year(year):
+    """年度の期間 (開始, 終了)（終了は翌年度の開始で、範囲に含まない）"""
+    return (_midnight(date(year, FISCAL_YEAR_START_MONTH, 1)),
+            _midnight(date(year + 1, FISCAL_YEAR_START_MONTH, 1)))
+
+
+def period_conditions(column, period):
+    """期間 (開始, 終了) の絞り込み条件とパラメータ（開始を含み終了を含まない、None は制限なし）"""
+    if not period:
+        return [], []
+    start, end = period
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{column} < ?")
+        params.append(end)
+    return conditions, params
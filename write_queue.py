@@ -0,0 +1,264 @@
+import atexit
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import db_pool
+from log_config import get_logger
+
+logger = get_logger('write_queue')
+
+# キューに積める書き込みの上限（環境変数 QA_APP_WRITE_QUEUE_SIZE で変更可能）
+MAX_QUEUE = int(os.environ.get('QA_APP_WRITE_QUEUE_SIZE', '1000'))
+
+# 先頭の書き込みを受け取ってから同じトランザクションにまとめる待ち時間（ミリ秒、QA_APP_GROUP_COMMIT_MS）
+GROUP_COMMIT_MS = float(os.environ.get('QA_APP_GROUP_COMMIT_MS', '5'))
+
+# 1回のコミットにまとめる書き込みの上限
+MAX_BATCH = 200
+
+# キューが満杯のときに空きを待つ秒数（超えたら WriteQueueFull）
+SUBMIT_TIMEOUT = 5.0
+
+# 書き込みの完了を待つ秒数の既定値
+RESULT_TIMEOUT = 30.0
+
+# BEGIN / COMMIT がロック待ちで失敗したときの再試行回数
+LOCK_RETRIES = 3
+
+_STOP = object()
+
+
+class WriteQueueFull(sqlite3.OperationalError):
+    """書き込みキューが満杯で、待機時間内に空かなかった"""
+
+
+class WriteQueue:
+    """すべての書き込みを1本のライタースレッドで実行するキュー
+
+    呼び出し側は接続を受け取る関数 op(conn) を submit() し、Future で結果を受け取る。
+    書き込みが続いている間、ライターは先頭の書き込みから GROUP_COMMIT_MS の間に
+    届いた書き込みを1つのトランザクションにまとめてコミットする（グループコミット）。
+    単発の書き込みは待たずにすぐコミットする。
+    各書き込みは SAVEPOINT で区切るので、失敗した書き込みだけが取り消される。
+    op の中では commit() / rollback() を呼ばないこと。
+    """
+
+    def __init__(self, pool, max_queue=MAX_QUEUE, group_commit_ms=GROUP_COMMIT_MS, max_batch=MAX_BATCH):
+        self.pool = pool
+        self.group_commit = group_commit_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._batches = 0
+        self._max_batch_seen = 0
+        self._max_depth = 0
+        self._commit_ms = 0.0
+        self._last_batch = 0
+
+        self._thread = threading.Thread(target=self._run, name='qa_app-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, op, timeout=SUBMIT_TIMEOUT):
+        """書き込みをキューに積んで Future を返す（満杯なら timeout 秒待って WriteQueueFull）"""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # 書き込みの中から呼ばれた場合は同じトランザクションでそのまま実行する
+            future.set_result(op(self._conn))
+            return future
+        if self._closed:
+            raise sqlite3.ProgrammingError("書き込みキューは既にクローズされています")
+        # ログの操作ユーザーやクエリ統計の関数名をライタースレッドに引き継ぐ
+        item = (op, contextvars.copy_context(), future)
+        try:
+            self._queue.put(item, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise WriteQueueFull(f"書き込みキューが満杯です（{self._queue.maxsize}件）")
+        with self._lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return future
+
+    def execute(self, op, timeout=RESULT_TIMEOUT):
+        """書き込みを実行し、コミット後に op の戻り値を返す"""
+        return self.submit(op).result(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        # 直前のバッチが1件だけ（競合なし）なら待たずに、既に届いている分だけまとめる
+        window = self.group_commit if self._last_batch > 1 or not self._queue.empty() else 0.0
+        deadline = time.monotonic() + window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    def _with_retry(self, sql):
+        for attempt in range(LOCK_RETRIES):
+            try:
+                self._conn.execute(sql)
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == LOCK_RETRIES - 1 or 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                logger.warning("%s がロック待ちで失敗したため再試行します: %s", sql, e)
+                time.sleep(0.05 * (attempt + 1))
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        done = []
+        try:
+            self._with_retry('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            logger.exception("書き込みトランザクションを開始できません: %s", e)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return len(batch)
+
+        for op, ctx, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._conn.execute('SAVEPOINT write_op')
+            try:
+                result = ctx.run(op, self._conn)
+            except Exception as e:
+                self._conn.execute('ROLLBACK TO write_op')
+                self._conn.execute('RELEASE write_op')
+                future.set_exception(e)
+                continue
+            self._conn.execute('RELEASE write_op')
+            done.append((future, result))
+
+        try:
+            self._with_retry('COMMIT')
+        except sqlite3.Error as e:
+            logger.exception("グループコミットに失敗しました（%d件）: %s", len(done), e)
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            for future, _ in done:
+                future.set_exception(e)
+            return len(batch)
+
+        for future, result in done:
+            future.set_result(result)
+        with self._lock:
+            self._batches += 1
+            self._completed += len(done)
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._commit_ms += (time.perf_counter() - started) * 1000.0
+        return len(batch) - len(done)
+
+    def _abort(self, batch, error):
+        try:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+        except sqlite3.Error:
+            logger.exception("書き込みトランザクションのロールバックに失敗しました")
+        failed = 0
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+            failed += 1
+        return failed
+
+    def _run(self):
+        self._conn = self.pool.dedicated_connection()
+        # トランザクションは BEGIN IMMEDIATE / COMMIT で明示的に制御する
+        self._conn.isolation_level = None
+        try:
+            while True:
+                batch = self._collect(self._queue.get())
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                self._last_batch = len(batch)
+                if batch:
+                    try:
+                        failed = self._run_batch(batch)
+                    except Exception as e:
+                        # 取り消し自体に失敗した場合もライタースレッドは止めない
+                        logger.exception("書き込みバッチの実行に失敗しました: %s", e)
+                        failed = self._abort(batch, e)
+                    if failed:
+                        with self._lock:
+                            self._failed += failed
+                if stop:
+                    break
+        finally:
+            self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'max_depth': self._max_depth,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'batches': self._batches,
+                'avg_batch': self._completed / self._batches if self._batches else 0.0,
+                'max_batch': self._max_batch_seen,
+                'avg_commit_ms': self._commit_ms / self._batches if self._batches else 0.0,
+            }
+
+    def close(self, timeout=RESULT_TIMEOUT):
+        """キューに残った書き込みを実行してからライタースレッドを止める"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_write_queue():
+    """共通プールのデータベースに書き込むキュー（db_pool.configure() でDBが変われば作り直す）"""
+    global _writer
+    pool = db_pool.get_pool()
+    writer = _writer
+    if writer is not None and writer.pool is pool:
+        return writer
+    with _writer_lock:
+        if _writer is None or _writer.pool is not pool:
+            if _writer is not None:
+                _writer.close()
+            _writer = WriteQueue(pool)
+        return _writer
+
+
+def run_write(op, timeout=RESULT_TIMEOUT):
+    """op(conn) をライタースレッドで実行し、コミット後に戻り値を返す"""
+    return get_write_queue().execute(op, timeout)
+
+
+def write_queue_stats():
+    return _writer.stats() if _writer is not None else {}
+
+
+@atexit.register
+def _shutdown():
+    if _writer is not None:
+        _writer.close()